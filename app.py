@@ -1,7 +1,8 @@
+import hashlib
 import json
-import time
 import os 
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 
@@ -12,26 +13,40 @@ st.set_page_config(layout="wide")
 
 # Local application imports
 from ui import display_header
-from chart_manager import display_charts, preprocess_df_for_charts
+from chart_manager import CHART_COLUMNS, display_charts, get_trend_rollup
 from data_manager import (
-    filter_data_by_role,
+    get_role_rows,
     generate_csv_file_dialog,
-    mask_dataframe_for_1on1,
-    merge_changed_rows,
+    ChangeBuffer,
+    display_save_status,
     lock_filtered_rows_dialog
 )
 from data_manager_snowflake import (
+    get_shared_dataset,
     read_data_snowflake,
-    save_changed_rows_snowflake,
+    submit_changed_rows,
         
 )
 from filter_manager import (
-    apply_filter,
+    filter_model_hash,
+    filter_rows,
+    get_column_index,
+    get_filter_result_cache,
     load_saved_filters_snowflake,
     save_filter_dialog_snowflake
 
 )
-from grid_manager import display_table, setup_aggrid
+from grid_manager import (
+    build_grid_payload,
+    collect_filter_values,
+    configure_server_view,
+    display_pagination,
+    display_table,
+    get_grid_generation,
+    query_grid_page,
+    reconcile_change_buffer,
+    setup_aggrid
+)
 from keboola_streamlit import KeboolaStreamlit
 
 
@@ -56,92 +71,386 @@ def initialize_session_state():
     """
     state_defaults = {
         'df': pd.DataFrame(),
-        'df_original': pd.DataFrame(),
+        'df_version': None,
+        'df_scope': None,
         'user_role': None,
         'user_email': None,
         'editable_columns': [],
         'columns_to_display': [],
         'grid_options': None,
         'filtered_df': pd.DataFrame(),
-        'changed_rows': pd.DataFrame(),
+        'change_buffer': ChangeBuffer(),
         'chart_year': None,
         'chart_title': None,
         'rows_to_lock': pd.DataFrame(),
         'filter_name': None,
-        'df_last_saved': pd.DataFrame(),
+        'last_edit_event': None,
         'unsaved_warning_displayed': False,
         'user_filters': None,
         'filter_names': None,
-        'snowflake_session': None,
         'toggle': 'Ne',
         'active_tab' : 'tab1',
-        'grid_key_filter': ''
+        'grid_key_filter': '',
+        'grid_view': None,
+        'grid_filter_model': {},
+        'grid_sort_model': [],
+        'grid_page': 0,
+        'grid_filter_values': {},
+        'grid_filter_values_key': None,
+        'grid_base_key': None,
+        'grid_generation': 0,
+        'grid_edits': set(),
+        'grid_payload': None,
+        'save_jobs': [],
+        'save_messages': [],
+        'header_role': None,
+        'view_filter': None,
+        'grid_page_df': None,
+        'grid_data': None,
+        'view_frame': None,
+        'view_frame_key': None,
+        'app_run': 0,
+        'fragment_runs': {}
     }
     for key, default in state_defaults.items():
         st.session_state.setdefault(key, default)
 
 
-def process_and_save_changes(df, changed_rows, debug):
+def process_and_save_changes(change_buffer):
     """
-    Confirm and save any changes made to the dataframe, displaying a confirmation dialog and progress bar.
+    Send pending changes to the background write pool without waiting for the write.
     
     Parameters:
-        df (pd.DataFrame): The current dataframe with original data.
-        changed_rows (pd.DataFrame): Rows that have been modified and need saving.
-        debug (bool): Debug mode flag for enhanced logging.
+        change_buffer (ChangeBuffer): Edits that need saving.
+
+    The buffer is emptied right away, so editing can continue; if the write fails,
+    the edits are put back into the buffer.
     """
-    if st.session_state['changed_rows'].empty:
+    if not change_buffer:
         st.warning('Nebyly provedeny žádné změny k uložení')
     else:
-        try:
-            progress_text = "**Odesílám data do databáze...**"
-            progress = st.progress(0, text=progress_text)
-            changed_rows.reset_index(drop=True, inplace=True)
-            progress.progress(20, text=progress_text)
-
-            # Flatten MultiIndex columns if present
-            if isinstance(changed_rows.columns, pd.MultiIndex):
-                changed_rows_flattened = changed_rows.xs('self', axis=1, level=1)
-                changed_rows = pd.concat([changed_rows[['USER_ID', 'YEAR', 'EVALUATION']], changed_rows_flattened], axis=1)
-                changed_rows.columns = ['USER_ID', 'YEAR', 'EVALUATION'] + list(changed_rows_flattened.columns)
-
-            pk_columns = ['USER_ID', 'YEAR', 'EVALUATION']
-            progress.progress(40, text=progress_text)
-
-            # Ensure primary key columns are set correctly
-            if all(col in changed_rows.columns for col in pk_columns):
-                changed_rows.dropna(subset=pk_columns, inplace=True)
-                changed_rows[pk_columns] = changed_rows[pk_columns].astype(int)
-
-                df_orig = df.copy()
-                save_changed_rows_snowflake(df_orig, changed_rows, debug, keboola, progress)
-            
-            progress.progress(80, text="**Uloženo. Proběhne obnova aplikace...**")
-            time.sleep(1)
-            progress.progress(100)
-            time.sleep(1)
+        pk_columns = ['USER_ID', 'YEAR', 'EVALUATION']
+        changed_rows = change_buffer.to_frame()
 
-        except Exception as e:
-            st.error('Ukládání dat selhalo. Kontaktujte prosím administrátora:'+str(e))
-            st.stop()
+        # Ensure primary key columns are set correctly
+        changed_rows.dropna(subset=pk_columns, inplace=True)
+        changed_rows[pk_columns] = changed_rows[pk_columns].astype(int)
+
+        submit_changed_rows(changed_rows, keboola, "Změny hodnocení", restore=(change_buffer.changes(), change_buffer.versions()))
+        change_buffer.clear()
+        st.session_state['unsaved_warning_displayed'] = False
         st.rerun()
 
 
-def filter_dataframe(filter_model, selected_year, toggle):
-    # Start with the base filtered data for the role
-    filtered = filter_data_by_role(st.session_state['df'], st.session_state['user_role'], st.session_state['user_email'])
+def filter_view_rows(filter_model, selected_year, toggle):
+    """Row positions of the shared frame selected by the round, the role, the team toggle and the saved filter."""
+    df = st.session_state['df']
+    column_index = get_column_index(df, st.session_state['df_version'], st.session_state['df_scope'])
 
-    # Apply year filter
-    filtered = filtered[filtered['YEAR_EVALUATION'] == selected_year]
+    # Start with the selected round, resolved from the column index
+    mask = column_index.mask('YEAR_EVALUATION', [selected_year])
 
-    if filter_model:
-        filtered = apply_filter(filtered, filter_model)
+    # Restrict to the rows visible for the role
+    role_rows = get_role_rows(df, st.session_state['user_role'], st.session_state['user_email'],
+                              st.session_state['df_version'], st.session_state['df_scope'])
+    if role_rows is not None:
+        if role_rows.size == 0:
+            st.warning("V hierarchii manažera nebyli nalezeni žádní zaměstnanci.")
+            st.stop()
+        role_mask = np.zeros(len(df), dtype=bool)
+        role_mask[role_rows] = True
+        mask &= role_mask
 
     # Apply toggle filter for MA role
     if st.session_state['user_role'] == 'MA' and toggle == "Ano":
-        filtered = filtered[filtered['DIRECT_MANAGER_EMAIL'] == st.session_state['user_email']]
-    
-    return filtered
+        mask &= column_index.mask('DIRECT_MANAGER_EMAIL', [st.session_state['user_email']])
+
+    return filter_rows(df, filter_model, column_index, mask)
+
+
+def filter_dataframe(filter_model, selected_year, toggle):
+    """
+    Return the rows of the shared frame selected by the filter bar.
+
+    Row positions come from the process-wide FilterResultCache, so sessions with the same role,
+    user and filters share them; the frame is taken from the shared dataset only when the
+    view of this session changes and is reused by the following reruns.
+    """
+    team_view = st.session_state['user_role'] == 'MA' and toggle == "Ano"
+    key = (st.session_state['user_role'], st.session_state['user_email'], selected_year, filter_model_hash(filter_model), team_view)
+    view_key = (st.session_state['df_scope'], st.session_state['df_version'], *key)
+    if st.session_state['view_frame_key'] != view_key:
+        rows = get_filter_result_cache().get(st.session_state['df_scope'], st.session_state['df_version'], key,
+                                             lambda: filter_view_rows(filter_model, selected_year, toggle))
+        st.session_state['view_frame'] = st.session_state['df'].take(rows)
+        st.session_state['view_frame_key'] = view_key
+    return st.session_state['view_frame']
+
+
+def resolve_user_role():
+    """
+    Set the user role and email from the Keboola headers, resolved once per session.
+
+    Users with a role outside the mapping are stopped with a warning.
+    """
+    if st.session_state['header_role'] is None:
+        try:
+            role_mapping = {
+                st.secrets["ROLE_BP_ID"]: "BP", st.secrets["ROLE_LC_ID"]: "LC",
+                st.secrets["ROLE_MA_ID"]: "MA", st.secrets["ROLE_DEV_ID"]: "DEV",
+                st.secrets["ROLE_TEST_ID"]: "TEST"
+            }
+            user_role_ids = headers["X-Kbc-User-Roles"].split(",") 
+            matched_role = next((role_mapping.get(role_id, "UNKNOWN") for role_id in user_role_ids if role_id in role_mapping), "UNKNOWN")
+            if st.session_state['user_email'] is None:
+                st.session_state['user_email'] = headers["X-Kbc-User-Email"].lower()
+            st.session_state['header_role'] = matched_role
+        except KeyError:
+            # Line for DEV
+            st.session_state['header_role'] = 'DEV'
+            #st.error("Nepodařilo se rozpoznat roli uživatele. Kontaktujte administrátora.")
+            #st.stop()
+
+    if st.session_state['header_role'] == 'UNKNOWN':
+        unknown_roles = headers["X-Kbc-User-Roles"]
+        warning_text = f'Nepodařilo se rozpoznat roli. Kontaktujte administrátora: {unknown_roles}'
+        st.warning(warning_text)
+        st.stop()
+    st.session_state['user_role'] = st.session_state['header_role']
+
+
+def is_fragment_rerun(name):
+    """
+    Tell whether the fragment called name is rerunning on its own rather than as part of a run of the whole app.
+
+    Must be called on every run of the fragment.
+    """
+    runs = st.session_state['fragment_runs']
+    rerun = runs.get(name) == st.session_state['app_run']
+    runs[name] = st.session_state['app_run']
+    return rerun
+
+
+@st.fragment
+def display_filter_bar():
+    """
+    Display the saved filter, evaluation round and team view selection.
+
+    Writes (filter_model, selected_year, toggle) to st.session_state['view_filter']. The grid,
+    the action bar and the charts all show the filtered view, so a change reruns the whole app.
+    """
+    rerun = is_fragment_rerun('filter_bar')
+
+    if st.session_state['user_role'] == 'MA':
+        filter_col1, filter_col2, filter_col3 = st.columns([0.5,0.4,0.1])
+    else:
+        filter_col1, filter_col2 = st.columns([0.5,0.5])
+
+    with filter_col1:
+        selected_filter_name = st.selectbox("Použít uložený filtr", [''] + st.session_state['filter_names'],
+                                            disabled=st.session_state['unsaved_warning_displayed'],
+                                            help="Globální filtr je možné měnit, pokud nejsou neuložené změny.")
+        if selected_filter_name:
+            selected_filter_row = st.session_state['user_filters'][st.session_state['user_filters']['FILTER_NAME'] == selected_filter_name].iloc[0]
+            st.session_state['grid_key_filter'] = selected_filter_row['FILTER_NAME']
+            filter_model = json.loads(selected_filter_row['FILTERED_VALUES'])
+        else:
+            filter_model = None
+
+    with filter_col2:
+        unique_years = sorted(st.session_state['df']['YEAR_EVALUATION'].unique(), reverse=True)
+        default_year = unique_years[0] if unique_years else None
+        selected_year = st.selectbox("Kolo hodnocení", 
+                                     key="selected_year",
+                                     options=unique_years, 
+                                     index=0 if default_year else None,
+                                     disabled=st.session_state['unsaved_warning_displayed'],
+                                     help="Globální filtr je možné měnit, pokud nejsou neuložené změny.")
+
+    if st.session_state['user_role'] == 'MA':
+        with filter_col3:
+            toggle = st.select_slider(
+                "Pouze můj tým",
+                options=["Ne", "Ano"],  # Text options instead of numbers
+                value="Ano",  # Default value
+                disabled=st.session_state['unsaved_warning_displayed'],
+                help="Globální filtr je možné měnit, pokud nejsou neuložené změny."
+            )
+            st.session_state['toggle'] = toggle
+            specific_value = "_team_view"
+            if st.session_state['toggle'] == 'Ano':
+                if specific_value not in st.session_state['grid_key_filter']:
+                    st.session_state['grid_key_filter'] += specific_value
+            elif st.session_state['toggle'] == 'Ne':
+                if specific_value in st.session_state['grid_key_filter']:
+                    st.session_state['grid_key_filter'] = st.session_state['grid_key_filter'].replace(specific_value,'')
+
+    view_filter = (filter_model, selected_year, st.session_state['toggle'])
+    changed = view_filter != st.session_state['view_filter']
+    st.session_state['view_filter'] = view_filter
+    if changed and rerun:
+        st.rerun(scope="app")
+
+
+@st.fragment
+def display_editable_grid(view_df, view_key, key_positions):
+    """
+    Display one page of the view in the editable grid and track the edits.
+
+    Parameters:
+        view_df (pd.DataFrame): Rows selected by the filter bar.
+        view_key (str): Key of the filter bar selection, part of the grid key.
+        key_positions (dict): Row labels of the shared dataset by primary key, see ChangeBuffer.apply.
+
+    The grid's own filter, sort and page come from st.session_state['grid_filter_model'],
+    ['grid_sort_model'] and ['grid_page']. Writes the whole server view with pending edits
+    applied to st.session_state['filtered_df'], and the page with the data returned by the
+    grid to ['grid_page_df'] and ['grid_data'] for the action bar. An edit reruns only this
+    fragment, unless it is the first pending edit (the warning and the disabled filters must
+    show) or it changes a chart column while a chart is displayed.
+    """
+    rerun = is_fragment_rerun('editable_grid')
+    change_buffer = st.session_state['change_buffer']
+    had_changes, chart_revision = bool(change_buffer), change_buffer.revision(CHART_COLUMNS)
+
+    # Pending edits are applied before the server filter, sort and paging, so they stay visible on remount
+    server_df, df_for_grid, page_count = query_grid_page(view_df, change_buffer, key_positions,
+                                                         st.session_state['grid_filter_model'],
+                                                         st.session_state['grid_sort_model'],
+                                                         st.session_state['grid_page'])
+
+    st.session_state['grid_options'] = setup_aggrid(df_for_grid, 
+                                                    st.session_state['editable_columns'], 
+                                                    st.session_state['columns_to_display'],
+                                                    st.session_state['user_role'], 
+                                                    st.session_state['user_email'])
+    configure_server_view(st.session_state['grid_options'], st.session_state['grid_filter_model'],
+                          st.session_state['grid_sort_model'], st.session_state['grid_filter_values'])
+    df_for_grid = build_grid_payload(df_for_grid, st.session_state['grid_options'])
+
+    # Only the current page is sent; the grid remounts when the page or the server filter changes,
+    # saves, locks and refreshes reach it as row updates keyed by ROW_ID
+    server_state = json.dumps([st.session_state['grid_filter_model'], st.session_state['grid_sort_model']], sort_keys=True, default=str)
+    grid_key = f"{view_key}_{st.session_state['grid_page']}_{hashlib.md5(server_state.encode()).hexdigest()[:8]}"
+    grid_key = f"{grid_key}_{get_grid_generation(df_for_grid, grid_key)}"
+    df_grid, grid_response = display_table(df_for_grid, st.session_state['grid_options'], grid_key, license_key=license_key)
+    display_pagination(page_count, len(server_df))
+    st.session_state['grid_page_df'] = df_for_grid
+    st.session_state['grid_data'] = grid_response['data']
+
+    # Filter or sort changed in the grid, serve the new view from the server
+    grid_state = grid_response.grid_state
+    if grid_state:
+        grid_filter_model = grid_state.get('filter', {}).get('filterModel', {}) or {}
+        grid_sort_model = grid_state.get('sort', {}).get('sortModel', []) or []
+        if grid_filter_model != st.session_state['grid_filter_model'] or grid_sort_model != st.session_state['grid_sort_model']:
+            st.session_state['grid_filter_model'] = grid_filter_model
+            st.session_state['grid_sort_model'] = grid_sort_model
+            st.session_state['grid_page'] = 0
+            st.rerun(scope="app")
+
+    # Charts, CSV export and locking work with the whole server view including unsaved edits
+    st.session_state['filtered_df'] = server_df
+
+    chart_changed = st.session_state.get('chart_view') and change_buffer.revision(CHART_COLUMNS) != chart_revision
+    if rerun and (bool(change_buffer) != had_changes or chart_changed):
+        st.rerun(scope="app")
+
+
+@st.fragment
+def display_action_bar(current_filter_model, client):
+    """
+    Display the buttons for saving filters, CSV export, saving changes and locking, by user role.
+
+    Parameters:
+        current_filter_model (dict): Filter model of the grid, saved by "Uložit aktuální filtry".
+        client (KeboolaStreamlit): Client passed to the writes.
+
+    Reads the view with pending edits from st.session_state['filtered_df'] and the grid page
+    from ['grid_page_df'] and ['grid_data'], as written by display_editable_grid.
+    """
+    def save_changes():
+        reconcile_change_buffer(st.session_state['grid_data'], st.session_state['grid_page_df'],
+                                st.session_state['grid_options'], st.session_state['change_buffer'])
+        process_and_save_changes(st.session_state['change_buffer'])
+
+    # Display buttons based on user_role
+    if st.session_state['user_role'] in ['BP','DEV','TEST']:
+        # Define 4 equally wide columns for button layout, with conditional display for each role
+        col1, col2, col3, col4 = st.columns(4)
+
+        with col1:
+            if st.button("🔎 Uložit aktuální filtry", use_container_width=True, help='Kliknutím uložíte aktuálně nastavené filtry'):
+                save_filter_dialog_snowflake(current_filter_model, client)
+
+        with col2:
+            if st.button("📥 Vygenerovat CSV", use_container_width=True, help='Kliknutím vygenerujete CSV soubor ke stažení'):
+                generate_csv_file_dialog(st.session_state['filtered_df'])
+
+        with col3:
+            if st.button("💾 Potvrdit uložení změn", use_container_width=True, type='primary', help='Kliknutím potvrdíte uložení provedených změn, změny budou uloženy do databáze'):
+                save_changes()
+
+        with col4:
+            if st.button("🔒 Uzamknout hodnocení", use_container_width=True, help='Kliknutím uzamknete hodnocení všech aktuálně vyfiltrovaných záznamů'):
+                if not st.session_state['filtered_df'].empty:
+                    # Only the keys are needed, the lock runs on the server
+                    st.session_state['rows_to_lock'] = st.session_state['filtered_df'][['USER_ID', 'YEAR', 'EVALUATION']]
+                    lock_filtered_rows_dialog(client)  
+                else:
+                    st.warning("Nebyly vybrány žádné záznamy k uzamčení.")
+            
+    # Handle 'MA' role
+    if st.session_state['user_role'] in ['MA']:
+        ma_col1, ma_col2, ma_col3 = st.columns([0.2, 0.2, 0.4])
+        with ma_col1:
+            if st.button("🔎 Uložit aktuální filtry", use_container_width=True, help='Kliknutím uložíte aktuálně nastavené filtry'):
+                save_filter_dialog_snowflake(current_filter_model, client)
+        
+        with ma_col2:
+            if st.button("📥 Vygenerovat CSV", use_container_width=True, help='Kliknutím vygenerujete CSV soubor ke stažení'):
+                generate_csv_file_dialog(st.session_state['filtered_df'])
+
+        with ma_col3:
+            if st.button("💾 Potvrdit uložení změn", use_container_width=True, type='primary', help='Kliknutím potvrdíte uložení provedených změn, změny budou uloženy do databáze'):
+                save_changes()
+
+    if st.session_state['user_role'] == 'LC':
+        lc_col1, lc_col2 = st.columns(2)
+        with lc_col1:
+            if st.button("🔎 Uložit aktuální filtry", use_container_width=True, help='Kliknutím uložíte aktuálně nastavené filtry'):
+                save_filter_dialog_snowflake(current_filter_model, client)
+        
+        with lc_col2:
+            if st.button("📥 Vygenerovat CSV", use_container_width=True, help='Kliknutím vygenerujete CSV soubor ke stažení'):
+                generate_csv_file_dialog(st.session_state['filtered_df'])
+
+
+@st.fragment
+def display_visualizations(view_key, filter_model):
+    """
+    Display the 1-on-1 selection for managers and the chart picked by the user.
+
+    Parameters:
+        view_key (str): Key of the filter bar selection.
+        filter_model (dict): Saved filter applied by the filter bar.
+
+    Reads the view with pending edits from st.session_state['filtered_df'], so charts picked
+    after edits made in the grid fragment show them.
+    """
+    # Charts are computed on demand and reused until the data they show change; the identity is
+    # part of the key, as DEV and TEST users switch role and email within one session
+    chart_key = (st.session_state['df_version'], st.session_state['user_role'], st.session_state['user_email'], view_key,
+                 json.dumps([filter_model, st.session_state['grid_filter_model']], sort_keys=True, default=str),
+                 st.session_state['change_buffer'].revision(CHART_COLUMNS))
+    selected_name = None
+    if st.session_state['user_role'] == 'MA':
+        full_names = ["Zobraz všechny"] + list(st.session_state['filtered_df']['FULL_NAME'].unique())
+        selected_name = st.selectbox("Schůzka 1-on-1:", full_names)
+        if selected_name == "Zobraz všechny":
+            selected_name = None
+    trend_rollup = get_trend_rollup(st.secrets["WORKSPACE_SOURCE_TABLE_ID"], st.session_state['df_scope'])
+    display_charts(trend_rollup, st.session_state['filtered_df'], license_key, chart_key, selected_name)
 
 
 def main():
@@ -151,37 +460,15 @@ def main():
     Initializes the user environment, role-based options, and UI components based on user role. 
     Loads data based on debug mode, sets up role-based filtering and displays, and 
     defines functionality for editing, filtering, and visualizing data. Also manages 
-    condition-based display options and caching behavior.
+    condition-based display options and caching behavior. The filter bar, the grid, the action
+    bar and the charts are fragments, so an interaction with one of them reruns only that part.
     """
     initialize_session_state()
+    st.session_state['app_run'] += 1
 
-    # Load data based on debug mode and assign roles
-    try:
-        role_mapping = {
-            st.secrets["ROLE_BP_ID"]: "BP", st.secrets["ROLE_LC_ID"]: "LC",
-            st.secrets["ROLE_MA_ID"]: "MA", st.secrets["ROLE_DEV_ID"]: "DEV",
-            st.secrets["ROLE_TEST_ID"]: "TEST"
-        }
-        user_role_ids = headers["X-Kbc-User-Roles"].split(",") 
-        matched_role = next((role_mapping.get(role_id, "UNKNOWN") for role_id in user_role_ids if role_id in role_mapping), "UNKNOWN")
-        st.session_state['user_role'] = matched_role
-        if st.session_state['user_email'] is None:
-            st.session_state['user_email'] = headers["X-Kbc-User-Email"].lower()
-        if matched_role=='UNKNOWN':
-            unknown_roles = headers["X-Kbc-User-Roles"]
-            warning_text = f'Nepodařilo se rozpoznat roli. Kontaktujte administrátora: {unknown_roles}'
-            st.warning(warning_text)
-            st.stop()
-    except KeyError:
-        # Line for DEV
-        st.session_state['user_role'] = 'DEV'
-        #st.error("Nepodařilo se rozpoznat roli uživatele. Kontaktujte administrátora.")
-        #st.stop()
+    # Assign roles
+    resolve_user_role()
     
-    if st.session_state['df'].empty:
-        with st.spinner("Načítám data..."):
-            read_data_snowflake(st.secrets["WORKSPACE_SOURCE_TABLE_ID"], keboola)
-
     if st.session_state['user_role'] in ['DEV', 'TEST']:
         def on_user_email_change():
             """Callback to reload filters when user_email changes."""
@@ -197,6 +484,18 @@ def main():
             )
         st.session_state['user_role'] = st.sidebar.selectbox("Role", options=roles)
     
+    # MA sessions read only their subtree, the hierarchy filter runs in the database;
+    # SCOPED_READS = "false" makes them share the whole table like the other roles
+    scoped_reads = st.secrets.get('SCOPED_READS', 'true') != 'false'
+    scope = st.session_state['user_email'] if scoped_reads and st.session_state['user_role'] == 'MA' else None
+
+    # Load the shared dataset, or switch to its newer version once there are no unsaved changes
+    shared_version = get_shared_dataset(st.secrets["WORKSPACE_SOURCE_TABLE_ID"], scope).version
+    dataset_outdated = st.session_state['df_version'] != shared_version and not st.session_state['change_buffer']
+    if st.session_state['df'].empty or dataset_outdated:
+        with st.spinner("Načítám data..."):
+            read_data_snowflake(st.secrets["WORKSPACE_SOURCE_TABLE_ID"], keboola, scope=scope)
+
     # Load saved filters
     if st.session_state['user_filters'] is None or st.session_state['filter_names'] is None:
         st.session_state['user_filters'], st.session_state['filter_names'] = load_saved_filters_snowflake(st.session_state['user_email'], keboola)      
@@ -213,52 +512,11 @@ def main():
             st.session_state["active_tab"] = "tab1"
         
         # Filters
-        if st.session_state['user_role'] == 'MA':
-            filter_col1, filter_col2, filter_col3 = st.columns([0.5,0.4,0.1])
-        else:
-            filter_col1, filter_col2 = st.columns([0.5,0.5])
-
-        with filter_col1:
-            selected_filter_name = st.selectbox("Použít uložený filtr", [''] + st.session_state['filter_names'],
-                                                disabled=st.session_state['unsaved_warning_displayed'],
-                                                help="Globální filtr je možné měnit, pokud nejsou neuložené změny.")
-            if selected_filter_name:
-                selected_filter_row = st.session_state['user_filters'][st.session_state['user_filters']['FILTER_NAME'] == selected_filter_name].iloc[0]
-                st.session_state['grid_key_filter'] = selected_filter_row['FILTER_NAME']
-                filter_model = json.loads(selected_filter_row['FILTERED_VALUES'])
-            else:
-                filter_model = None
-    
-        with filter_col2:
-            unique_years = sorted(st.session_state['df']['YEAR_EVALUATION'].unique(), reverse=True)
-            default_year = unique_years[0] if unique_years else None
-            selected_year = st.selectbox("Kolo hodnocení", 
-                                         key="selected_year",
-                                         options=unique_years, 
-                                         index=0 if default_year else None,
-                                         disabled=st.session_state['unsaved_warning_displayed'],
-                                         help="Globální filtr je možné měnit, pokud nejsou neuložené změny.")
-    
-        if st.session_state['user_role'] == 'MA':
-            with filter_col3:
-                toggle = st.select_slider(
-                    "Pouze můj tým",
-                    options=["Ne", "Ano"],  # Text options instead of numbers
-                    value="Ano",  # Default value
-                    disabled=st.session_state['unsaved_warning_displayed'],
-                    help="Globální filtr je možné měnit, pokud nejsou neuložené změny."
-                )
-                st.session_state['toggle'] = toggle
-                specific_value = "_team_view"
-                if st.session_state['toggle'] == 'Ano':
-                    if specific_value not in st.session_state['grid_key_filter']:
-                        st.session_state['grid_key_filter'] += specific_value
-                elif st.session_state['toggle'] == 'Ne':
-                    if specific_value in st.session_state['grid_key_filter']:
-                        st.session_state['grid_key_filter'] = st.session_state['grid_key_filter'].replace(specific_value,'')
+        display_filter_bar()
+        filter_model, selected_year, toggle = st.session_state['view_filter']
 
         # Filter the dataframe to be displayed based on selected filters and conditions 
-        st.session_state['filtered_df'] = filter_dataframe(filter_model, selected_year, st.session_state['toggle'])
+        view_df = filter_dataframe(filter_model, selected_year, toggle)
 
         # Set up and display AgGrid table
         st.session_state['columns_to_display'] = ['FULL_NAME', 'JOB_TITLE_CZ', 'LOGIN','L2_ORGANIZATION_UNIT_NAME_CZ', 'L3_ORGANIZATION_UNIT_NAME_CZ', 
@@ -268,27 +526,26 @@ def main():
         
         st.session_state['editable_columns'] = ['VYKON', 'HODNOTY', 'POTENCIAL', 'MOZNY_KARIERNI_POSUN', 'PRAVDEPODOBNOST_ODCHODU', 'NASTUPCE', 'POZNAMKY']
 
-        df_for_grid = st.session_state['filtered_df'].copy()
-        st.session_state['grid_options'] = setup_aggrid(df_for_grid, 
-                                                        st.session_state['editable_columns'], 
-                                                        st.session_state['columns_to_display'],
-                                                        st.session_state['user_role'], 
-                                                        st.session_state['user_email'])
-        if not df_for_grid.empty:
-            df_grid, new_changes, grid_response = display_table(df_for_grid, st.session_state['grid_options'], st.session_state['grid_key_filter'], license_key=license_key)
-        else:
+        if view_df.empty:
             st.warning("Pro vybrané filtry a období nebyla nalezena žádná data.")
             st.stop()
 
-        if 'data' in grid_response and not grid_response['data'].empty:
-            st.session_state['filtered_df'] = df_grid.copy()
+        # The grid's own filter, sort and page are served from the server and reset with the view
+        view_key = f"{selected_year}_{st.session_state['grid_key_filter']}"
+        if st.session_state['grid_view'] != view_key:
+            st.session_state['grid_view'] = view_key
+            st.session_state['grid_filter_model'] = {}
+            st.session_state['grid_sort_model'] = []
+            st.session_state['grid_page'] = 0
+        if st.session_state['grid_filter_values_key'] != (view_key, st.session_state['df_version']):
+            st.session_state['grid_filter_values_key'] = (view_key, st.session_state['df_version'])
+            st.session_state['grid_filter_values'] = collect_filter_values(view_df, st.session_state['columns_to_display'])
 
-        grid_state = grid_response.grid_state
-        current_filter_model = grid_state['filter']['filterModel'] if grid_state and 'filter' in grid_state and 'filterModel' in grid_state['filter'] else {}
-        merge_changed_rows(new_changes)
+        key_positions = get_shared_dataset(st.secrets["WORKSPACE_SOURCE_TABLE_ID"], scope).key_positions
+        display_editable_grid(view_df, view_key, key_positions)
 
         # Display warning if unsaved changes exist
-        if not st.session_state['changed_rows'].empty:
+        if st.session_state['change_buffer']:
             st.session_state['unsaved_warning_displayed'] = True
         else:
             st.session_state['unsaved_warning_displayed'] = False
@@ -296,55 +553,14 @@ def main():
         if st.session_state['unsaved_warning_displayed']:
             st.error("⚠️ Máte neuložené změny. Nezapomeňte je uložit před opuštěním aplikace")
 
-        # Display buttons based on user_role
-        if st.session_state['user_role'] in ['BP','DEV','TEST']:
-            # Define 4 equally wide columns for button layout, with conditional display for each role
-            col1, col2, col3, col4 = st.columns(4)
-
-            with col1:
-                if st.button("🔎 Uložit aktuální filtry", use_container_width=True, help='Kliknutím uložíte aktuálně nastavené filtry'):
-                    save_filter_dialog_snowflake(current_filter_model, keboola)
-
-            with col2:
-                if st.button("📥 Vygenerovat CSV", use_container_width=True, help='Kliknutím vygenerujete CSV soubor ke stažení'):
-                    generate_csv_file_dialog(grid_response['data'])
-
-            with col3:
-                if st.button("💾 Potvrdit uložení změn", use_container_width=True, type='primary', help='Kliknutím potvrdíte uložení provedených změn, změny budou uloženy do databáze'):
-                    process_and_save_changes(st.session_state['df'], st.session_state['changed_rows'], debug)
-
-            with col4:
-                if st.button("🔒 Uzamknout hodnocení", use_container_width=True, help='Kliknutím uzamknete hodnocení všech aktuálně vyfiltrovaných záznamů'):
-                    if not st.session_state['filtered_df'].empty:
-                        st.session_state['rows_to_lock'] = st.session_state['filtered_df'].copy()
-                        lock_filtered_rows_dialog(st.session_state['df'], keboola)  
-                    else:
-                        st.warning("Nebyly vybrány žádné záznamy k uzamčení.")
-                
-        # Handle 'MA' role
-        if st.session_state['user_role'] in ['MA']:
-            ma_col1, ma_col2, ma_col3 = st.columns([0.2, 0.2, 0.4])
-            with ma_col1:
-                if st.button("🔎 Uložit aktuální filtry", use_container_width=True, help='Kliknutím uložíte aktuálně nastavené filtry'):
-                    save_filter_dialog_snowflake(current_filter_model, keboola)
-            
-            with ma_col2:
-                if st.button("📥 Vygenerovat CSV", use_container_width=True, help='Kliknutím vygenerujete CSV soubor ke stažení'):
-                    generate_csv_file_dialog(grid_response['data'])
-
-            with ma_col3:
-                if st.button("💾 Potvrdit uložení změn", use_container_width=True, type='primary', help='Kliknutím potvrdíte uložení provedených změn, změny budou uloženy do databáze'):
-                    process_and_save_changes(st.session_state['df'], st.session_state['changed_rows'], debug)
-
-        if st.session_state['user_role'] == 'LC':
-            lc_col1, lc_col2 = st.columns(2)
-            with lc_col1:
-                if st.button("🔎 Uložit aktuální filtry", use_container_width=True, help='Kliknutím uložíte aktuálně nastavené filtry'):
-                    save_filter_dialog_snowflake(current_filter_model, keboola)
-            
-            with lc_col2:
-                if st.button("📥 Vygenerovat CSV", use_container_width=True, help='Kliknutím vygenerujete CSV soubor ke stažení'):
-                    generate_csv_file_dialog(grid_response['data'])
+        # Outcome of background writes finished since the last run, and writes still running
+        for message_type, message in st.session_state['save_messages']:
+            getattr(st, message_type)(message)
+        st.session_state['save_messages'] = []
+        if st.session_state['save_jobs']:
+            display_save_status(keboola)
+
+        display_action_bar(st.session_state['grid_filter_model'], keboola)
         
         # Visualization tab
         with tab2:
@@ -352,17 +568,7 @@ def main():
                 st.session_state["active_tab"] = "tab2"
             
             if st.session_state['active_tab'] == 'tab2':
-                if st.session_state['user_role'] == 'MA':
-                    full_names = ["Zobraz všechny"] + list(st.session_state['filtered_df']['FULL_NAME'].unique())
-                    selected_name = st.selectbox("Schůzka 1-on-1:", full_names)
-                    masked_df = st.session_state['filtered_df'] if selected_name == "Zobraz všechny" else mask_dataframe_for_1on1(st.session_state['filtered_df'], selected_name)
-                    with st.spinner("Načítám vizualizace..."):
-                        masked_df_charts = preprocess_df_for_charts(masked_df)
-                        display_charts(st.session_state['df'], masked_df_charts, license_key)
-                else:
-                    with st.spinner("Načítám vizualizace..."):
-                        df_filtered_charts = preprocess_df_for_charts(st.session_state['filtered_df'])
-                        display_charts(st.session_state['df'], df_filtered_charts, license_key)
+                display_visualizations(view_key, filter_model)
         
         # Manual tab
         with tab3:
@@ -1,31 +1,82 @@
+import threading
+
 import streamlit as st
+import numpy as np
 import pandas as pd
-import plotly.express as px
 
 from st_aggrid import AgGrid, GridOptionsBuilder, DataReturnMode, GridUpdateMode, JsCode, ColumnsAutoSizeMode
 
+from data_manager import mask_dataframe_for_1on1
+from data_manager_snowflake import get_shared_dataset
+
 # Define common grid styling that can be reused across all grids
 GRID_STYLES = {
     ".ag-row-hover": {"background-color": "#def8ff !important"},  # Light blue hover color
 }
 
-def preprocess_df_for_charts(df):
+# Columns the charts read from the filtered data
+CHART_COLUMNS = ['USER_ID', 'YEAR', 'YEAR_EVALUATION', 'FULL_NAME', 'HODNOTY', 'VYKON', 'HODNOTY_PREVIOUS',
+                 'VYKON_PREVIOUS', 'POTENCIAL', 'POTENCIAL_PREVIOUS']
+
+# Categories of the grid summaries in display order, the category codes index this list
+GRID_CATEGORIES = ['Top', 'Middle', 'Low', 'Nehodnocení']
+TOP, MIDDLE, LOW, UNRATED = range(len(GRID_CATEGORIES))
+
+POTENCIAL_VALUES = ['0', 'nízký', 'střední', 'vysoký']
+
+# Column of the 3x3 grid for people whose POTENCIAL is missing or not one of POTENCIAL_VALUES
+POTENCIAL_UNRATED = 'nehodnoceno'
+
+# Trend metrics and the source columns they are averaged from
+TREND_METRICS = {'CO': 'VYKON', 'JAK': 'HODNOTY'}
+
+# Chart blocks of the Vizualizace tab, computed only when picked
+CHART_VIEWS = ["Výkon v dimenzích CO a JAK", "Výkon v dimenzích CO, JAK a POTENCIÁL", "Vývoj CO a JAK v čase"]
+
+# 5x5 grid category by [CO, JAK]; ratings are 1-5, 0 means not rated
+GRID_5_CATEGORIES = np.array([
+    # JAK: 0        1    2       3       4       5
+    [UNRATED, UNRATED, UNRATED, UNRATED, UNRATED, UNRATED],  # CO 0
+    [UNRATED, LOW,     LOW,     LOW,     LOW,     LOW],      # CO 1
+    [UNRATED, LOW,     LOW,     MIDDLE,  MIDDLE,  MIDDLE],   # CO 2
+    [UNRATED, LOW,     MIDDLE,  MIDDLE,  MIDDLE,  MIDDLE],   # CO 3
+    [UNRATED, LOW,     MIDDLE,  MIDDLE,  TOP,     TOP],      # CO 4
+    [UNRATED, LOW,     MIDDLE,  MIDDLE,  TOP,     TOP],      # CO 5
+])
+
+# Rows of the 3x3 grid: bands of CO + JAK, and the band of every sum 0-10
+CO_JAK_BANDS = ['0', '1-3', '4-7', '8-10']
+CO_JAK_BAND_CODES = np.repeat(np.arange(len(CO_JAK_BANDS)), [1, 3, 4, 3])
+
+# 3x3 grid category by [CO + JAK, POTENCIAL code], expanded from the category of each band
+GRID_3_CATEGORIES = np.array([
+    # POTENCIAL: 0  nízký    střední  vysoký
+    [UNRATED, UNRATED, UNRATED, UNRATED],  # 0
+    [UNRATED, LOW,     LOW,     MIDDLE],   # 1-3
+    [UNRATED, MIDDLE,  MIDDLE,  TOP],      # 4-7
+    [UNRATED, MIDDLE,  TOP,     TOP],      # 8-10
+])[CO_JAK_BAND_CODES]
+
+def short_names(full_names):
+    """Shorten 'First Last' to 'F. Last'; single-word names are kept as they are."""
+    names = full_names.fillna('').astype(str)
+    parts = names.str.split()
+    return names.where(parts.str.len() <= 1, parts.str[0].str[0] + '. ' + parts.str[-1])
+
+
+def preprocess_df_for_charts(df, selected_name=None):
     """
     Prepare the DataFrame for chart display, converting columns to appropriate types 
-    and adding missing combinations of JAK, CO, and POTENCIAL values.
+    and adding short names shown in the grids.
 
     Parameters:
     - df (pd.DataFrame): The original DataFrame.
+    - selected_name (str, optional): Person of a 1-on-1 meeting; names of everyone else are masked.
 
     Returns:
-    - pd.DataFrame: A preprocessed DataFrame ready for visualization.
+    - pd.DataFrame: A preprocessed copy of the chart columns ready for visualization.
     """
-    df = df.copy()  # Avoid modifying the original DataFrame
-
-    # Define possible values, ensuring all are strings
-    hodnoty_values = [0, 1, 2, 3, 4, 5]
-    vykon_values = [0, 1, 2, 3, 4, 5]
-    potencial_values = ["0", "nízký", "střední", "vysoký"]
+    df = df[[column for column in CHART_COLUMNS if column in df.columns]].copy()
 
     # Convert columns to integers if appropriate
     df['HODNOTY'] = df['HODNOTY'].fillna(0).astype('Int64')
@@ -37,189 +88,201 @@ def preprocess_df_for_charts(df):
 
     # Ensure POTENCIAL column is also in string format for consistency
     df['POTENCIAL'] = df['POTENCIAL'].astype(str)
+    if selected_name is not None:
+        df = mask_dataframe_for_1on1(df, selected_name)
+    df['FULL_NAME_SPLIT'] = short_names(df['FULL_NAME'])
+    return df
 
-    def transform_name(name):
-        parts = name.split()
-        if len(parts) > 1:
-            return f"{parts[0][0]}. {parts[-1]}"
-        return name
-        
-    # Identify missing combinations
-    existing_combinations = df.set_index(['JAK', 'CO', 'POTENCIAL']).index
-    all_combinations = pd.MultiIndex.from_product(
-        [hodnoty_values, vykon_values, potencial_values],
-        names=['JAK', 'CO', 'POTENCIAL']
-    )
-    missing_combinations = all_combinations.difference(existing_combinations)
 
-    # Convert MultiIndex to DataFrame for missing rows and add FULL_NAME column
-    missing_rows = pd.DataFrame(missing_combinations.tolist(), columns=['JAK', 'CO', 'POTENCIAL'])
-    missing_rows['FULL_NAME'] = ''  # Add empty FULL_NAME for visualization
+def memoize_chart(name, cache_key, compute):
+    """
+    Return the data of a chart block, computing it only when cache_key changed since the last run.
+
+    Parameters:
+    - name (str): Name of the chart data; one entry per name is kept in st.session_state['chart_cache'].
+    - cache_key (tuple): Everything the data depend on.
+    - compute (callable): Builds the data.
+    """
+    cache = st.session_state.setdefault('chart_cache', {})
+    entry = cache.get(name)
+    if entry is None or entry[0] != cache_key:
+        entry = (cache_key, compute())
+        cache[name] = entry
+    return entry[1]
 
-    # Append missing rows to the original DataFrame, dropping duplicates
-    df = pd.concat([df, missing_rows], ignore_index=True).drop_duplicates(subset=['JAK', 'CO', 'POTENCIAL', 'FULL_NAME'])
-    df['FULL_NAME_SPLIT'] = df['FULL_NAME'].apply(transform_name)
-    return df
 
+class GridCells:
+    """
+    People of a chart grid grouped by cell.
+
+    Cell membership is computed once from integer row and column codes and one stable
+    sort groups the rows, so counts, joined names and row positions of every cell come
+    out in arrays of the grid's fixed shape. Rows with a code outside the grid are left out.
+    """
 
-def categorize_3_grid(row):
+    def __init__(self, row_codes, column_codes, shape, names):
+        n_rows, n_columns = shape
+        valid = (row_codes >= 0) & (row_codes < n_rows) & (column_codes >= 0) & (column_codes < n_columns)
+        positions = np.flatnonzero(valid)
+        cells = row_codes[positions] * n_columns + column_codes[positions]
+        order = np.argsort(cells, kind='stable')
+
+        self.shape = shape
+        self.positions = positions[order]
+        self.counts = np.bincount(cells, minlength=n_rows * n_columns).reshape(shape)
+        self.offsets = np.concatenate([[0], np.cumsum(self.counts.ravel())])
+        sorted_names = np.asarray(names, dtype=object)[self.positions]
+        self.names = np.array([
+            ', '.join(name for name in sorted_names[start:end] if name)
+            for start, end in zip(self.offsets[:-1], self.offsets[1:])
+        ], dtype=object).reshape(shape)
+
+    def rows(self, row, column):
+        """Positions of the rows in the given cell."""
+        cell = row * self.shape[1] + column
+        return self.positions[self.offsets[cell]:self.offsets[cell + 1]]
+
+    def to_frame(self, index_column, index_labels, column_labels):
+        """Joined names as the frame shown in AgGrid, with the highest row first."""
+        frame = pd.DataFrame(self.names[::-1], columns=[str(label) for label in column_labels])
+        frame.insert(0, index_column, list(index_labels)[::-1])
+        return frame
+
+
+def _rating_codes(series, size):
+    """Ratings as integer codes 0..size-1, -1 for missing or out of range values."""
+    values = pd.to_numeric(series, errors='coerce').to_numpy(dtype=float)
+    valid = np.isfinite(values) & (values >= 0) & (values < size) & (values == np.floor(values))
+    return np.where(valid, values, -1).astype(np.intp)
+
+
+def categorize_3_grid(df, period='current'):
     """
     Categorize rows into 'Top', 'Middle', 'Low', or 'Nehodnocení' based on CO, JAK, 
     and POTENCIAL values for a 3x3 grid.
 
     Parameters:
-    - row (pd.Series): A single row from the DataFrame.
+    - df (pd.DataFrame): Rows with CO, JAK and POTENCIAL columns.
+    - period (str): The evaluation period ('current' or 'previous').
 
     Returns:
-    - str: The category label for the row.
+    - np.ndarray: Category codes, indexes into GRID_CATEGORIES, looked up in GRID_3_CATEGORIES.
     """
-    CO = row['CO']
-    JAK = row['JAK']
-    POTENCIAL = row['POTENCIAL']
-    sum_co_jak = CO + JAK
-    
-    if POTENCIAL == "0" or sum_co_jak == 0:
-        return 'Nehodnocení'
-    elif POTENCIAL in ["nízký", "střední"] and sum_co_jak in range(1, 4):
-        return 'Low'
-    elif (POTENCIAL == "vysoký" and sum_co_jak in range(1, 4)) or \
-         (POTENCIAL in ["nízký", "střední"] and sum_co_jak in range(4, 8)) or \
-         (POTENCIAL == "nízký" and sum_co_jak in range(8, 11)):
-        return 'Middle'
-    elif (POTENCIAL == "vysoký" and sum_co_jak in range(4, 8)) or \
-         (POTENCIAL in ["střední", "vysoký"] and sum_co_jak in range(8, 11)):
-        return 'Top'
-    else:
-        return 'Nehodnocení'
+    suffix = '_PREVIOUS' if period == 'previous' else ''
+    co = _rating_codes(df[f'CO{suffix}'], 6)
+    jak = _rating_codes(df[f'JAK{suffix}'], 6)
+    potencial = pd.Categorical(df[f'POTENCIAL{suffix}'].astype(str), categories=POTENCIAL_VALUES).codes
+    valid = (co >= 0) & (jak >= 0) & (potencial >= 0)
+    return np.where(valid, GRID_3_CATEGORIES[(co + jak).clip(0), potencial.clip(0)], UNRATED)
 
 
-def categorize_5_grid(row):
+def categorize_5_grid(df, period='current'):
     """
     Categorize rows into 'Top', 'Middle', 'Low', or 'Nehodnocení' based on CO and JAK 
     values for a 5x5 grid.
 
     Parameters:
-    - row (pd.Series): A single row from the DataFrame.
+    - df (pd.DataFrame): Rows with CO and JAK columns.
+    - period (str): The evaluation period ('current' or 'previous').
 
     Returns:
-    - str: The category label for the row.
+    - np.ndarray: Category codes, indexes into GRID_CATEGORIES, looked up in GRID_5_CATEGORIES.
     """
-    CO = row['CO']
-    JAK = row['JAK']
-    
-    if CO == 0 or JAK == 0:
-        return 'Nehodnocení'
-    elif (CO in [4, 5] and JAK in [4, 5]):
-        return 'Top'
-    elif ((CO == 2 and JAK in [3, 4, 5]) or 
-          (CO == 3 and JAK in [2, 3, 4, 5]) or 
-          (CO in [4, 5] and JAK in [2, 3])):
-        return 'Middle'
-    elif ((CO == 1 or JAK == 1) or 
-          (CO == 2 and JAK in [1, 2]) or 
-          (CO in [3, 4, 5] and JAK == 1)):
-        return 'Low'
-    else:
-        return 'Nehodnocení'
+    suffix = '_PREVIOUS' if period == 'previous' else ''
+    co = _rating_codes(df[f'CO{suffix}'], 6)
+    jak = _rating_codes(df[f'JAK{suffix}'], 6)
+    valid = (co >= 0) & (jak >= 0)
+    return np.where(valid, GRID_5_CATEGORIES[co.clip(0), jak.clip(0)], UNRATED)
 
 
-def display_5_grid_summary(filtered_df, period):
+def grid_5_cells(df, period='current'):
+    """Group people of the 5x5 grid into cells by [CO, JAK]."""
+    suffix = '_PREVIOUS' if period == 'previous' else ''
+    return GridCells(_rating_codes(df[f'CO{suffix}'], 6), _rating_codes(df[f'JAK{suffix}'], 6), (6, 6),
+                     df['FULL_NAME_SPLIT'].to_numpy())
+
+
+def grid_3_cells(df, period='current'):
     """
-    Display a summary of counts and percentages for each 5x5 grid category ('Top', 'Middle', 'Low', 'Nehodnocení').
+    Group people of the 3x3 grid into cells by [CO + JAK band, POTENCIAL].
+
+    People without a known POTENCIAL go to the last column (POTENCIAL_UNRATED) instead of being left out.
+    """
+    suffix = '_PREVIOUS' if period == 'previous' else ''
+    co = _rating_codes(df[f'CO{suffix}'], 6)
+    jak = _rating_codes(df[f'JAK{suffix}'], 6)
+    band = np.where((co >= 0) & (jak >= 0), CO_JAK_BAND_CODES[(co + jak).clip(0)], -1)
+    potencial = pd.Categorical(df[f'POTENCIAL{suffix}'].astype(str), categories=POTENCIAL_VALUES).codes.astype(np.intp)
+    potencial[potencial < 0] = len(POTENCIAL_VALUES)
+    return GridCells(band, potencial, (len(CO_JAK_BANDS), len(POTENCIAL_VALUES) + 1),
+                     df['FULL_NAME_SPLIT'].to_numpy())
+
+
+def build_5_grid(chart_df, period='current'):
+    """
+    Compute the 5x5 grid of CO and JAK ratings and the counts of its categories.
 
     Parameters:
-    - filtered_df (pd.DataFrame): Filtered data for the summary.
+    - chart_df (pd.DataFrame): Data prepared by preprocess_df_for_charts.
     - period (str): The evaluation period ('current' or 'previous').
+
+    Returns:
+    - tuple: Names of people in every CO x JAK cell with CO from 5 down to 0, and counts per GRID_CATEGORIES.
     """
-    # Apply the categorization function to each row in the DataFrame
-    filtered_df_summary = filtered_df[filtered_df['USER_ID'].notnull()]
-    filtered_df_summary.loc[:, 'Category'] = filtered_df_summary.apply(categorize_5_grid, axis=1)
-
-    # Calculate the counts and percentages for each category
-    category_counts = filtered_df_summary['Category'].value_counts()
-    total_count = len(filtered_df_summary)
-    category_percentages = (category_counts / total_count * 100).round(2)
-
-    # Display the results in Streamlit
-    with st.container():
-        for category in ['Top', 'Middle', 'Low', 'Nehodnocení']:
-            count = category_counts.get(category, 0)
-            percentage = category_percentages.get(category, 0.0)
-            
-            # Use Markdown to format each category with a bold title, count, and percentage
-            st.markdown(
-                f"""
-                <div style="border: 1px solid #ddd; padding: 10px; margin: 5px 0; border-radius: 5px;">
-                    <strong style="font-size: 16px; color: #2A9D8F;">{category}:</strong>
-                    <span style="font-size: 14px;">{count}</span> 
-                    <span style="font-size: 14px; color: #888;">({percentage}%)</span>
-                </div>
-                """, 
-                unsafe_allow_html=True
-            )
-
-
-def display_3_grid_summary(filtered_df, period):
+    suffix = '_PREVIOUS' if period == 'previous' else ''
+    pivot_df = grid_5_cells(chart_df, period).to_frame(f'CO{suffix}', range(6), range(6))
+    return pivot_df, np.bincount(categorize_5_grid(chart_df, period), minlength=len(GRID_CATEGORIES))
+
+
+def build_3_grid(chart_df, period='current'):
     """
-    Display a summary of counts and percentages for each 3x3 grid category ('Top', 'Middle', 'Low', 'Nehodnocení').
+    Compute the 3x3 grid of CO, JAK and POTENCIAL ratings and the counts of its categories.
 
     Parameters:
-    - filtered_df (pd.DataFrame): Filtered data for the summary.
+    - chart_df (pd.DataFrame): Data prepared by preprocess_df_for_charts.
     - period (str): The evaluation period ('current' or 'previous').
+
+    Returns:
+    - tuple: Names of people in every CO + JAK band x POTENCIAL cell with the highest band first,
+      and counts per GRID_CATEGORIES. The POTENCIAL_UNRATED column is there only when someone is in it.
     """
-    # Apply the categorization function to each row in the DataFrame
-    filtered_df_summary = filtered_df[filtered_df['USER_ID'].notnull()]
-    filtered_df_summary.loc[:, '3_grid_Category'] = filtered_df_summary.apply(categorize_3_grid, axis=1)
-
-    # Calculate the counts and percentages for each 3_grid category
-    grid_category_counts = filtered_df_summary['3_grid_Category'].value_counts()
-    total_count = len(filtered_df_summary)
-    grid_category_percentages = (grid_category_counts / total_count * 100).round(2)
-
-    # Display the results in Streamlit
-    with st.container():
-        for category in ['Top', 'Middle', 'Low', 'Nehodnocení']:
-            count = grid_category_counts.get(category, 0)
-            percentage = grid_category_percentages.get(category, 0.0)
-            
-            st.markdown(
-                f"""
-                <div style="border: 1px solid #ddd; padding: 10px; margin: 5px 0; border-radius: 5px;">
-                    <strong style="font-size: 16px; color: #2A9D8F;">{category}:</strong>
-                    <span style="font-size: 14px;">{count}</span> 
-                    <span style="font-size: 14px; color: #888;">({percentage}%)</span>
-                </div>
-                """, 
-                unsafe_allow_html=True
-            )
-
-
-def display_5_grid(filtered_df, period, license_key):
+    cells = grid_3_cells(chart_df, period)
+    pivot_df = cells.to_frame('CO_JAK', CO_JAK_BANDS, POTENCIAL_VALUES + [POTENCIAL_UNRATED])
+    if cells.counts[:, -1].sum() == 0:
+        pivot_df = pivot_df.drop(columns=POTENCIAL_UNRATED)
+    return pivot_df, np.bincount(categorize_3_grid(chart_df, period), minlength=len(GRID_CATEGORIES))
+
+
+def display_category_summary(category_counts):
+    """
+    Display counts and percentages of the grid categories ('Top', 'Middle', 'Low', 'Nehodnocení').
+
+    Parameters:
+    - category_counts (np.ndarray): Number of people in every category, see GRID_CATEGORIES.
+    """
+    percentages = (category_counts / max(category_counts.sum(), 1) * 100).round(2)
+
+    # Use Markdown to format each category with a bold title, count, and percentage
+    st.markdown(''.join(
+        f"""
+        <div style="border: 1px solid #ddd; padding: 10px; margin: 5px 0; border-radius: 5px;">
+            <strong style="font-size: 16px; color: #2A9D8F;">{category}:</strong>
+            <span style="font-size: 14px;">{count}</span> 
+            <span style="font-size: 14px; color: #888;">({percentage}%)</span>
+        </div>
+        """
+        for category, count, percentage in zip(GRID_CATEGORIES, category_counts, percentages)
+    ), unsafe_allow_html=True)
+
+
+def display_5_grid(pivot_df, period, license_key):
     """
     Display a 5x5 grid of CO (performance) and JAK (values) ratings.
 
     Parameters:
-    - filtered_df (pd.DataFrame): Filtered data for grid display.
+    - pivot_df (pd.DataFrame): The grid computed by build_5_grid.
     - period (str): 'current' or 'previous' period indicator.
     """
-    # Define the mapping or use string formatting
-    suffix = '_PREVIOUS' if period == 'previous' else ''
-    index_column = f'CO{suffix}'
-    columns_column = f'JAK{suffix}'
-
-    # Create the pivot table
-    pivot_df = filtered_df.pivot_table(
-        index=index_column,
-        columns=columns_column,
-        values='FULL_NAME_SPLIT',
-        aggfunc=lambda x: ', '.join([name for name in x if name]),
-        observed=False
-    ).fillna('')
-
-    pivot_df = pivot_df.sort_index(ascending=False)
-    pivot_df.reset_index(inplace=True)
-    pivot_df.columns = pivot_df.columns.map(str)
-
     gb = GridOptionsBuilder.from_dataframe(pivot_df)
     # Dynamically enable/disable pagination
     page_size = 6
@@ -338,15 +401,6 @@ def display_5_grid(filtered_df, period, license_key):
     
     grid_options = gb.build()
     
-    try:
-        if period == 'previous':
-            chart_year = 'Předchozí hodnocení'
-        else:
-            chart_year = str(filtered_df['YEAR_EVALUATION'].unique()[0])
-    except:
-        chart_year = 'Žádná data k zobrazení'
-    #chart_title = f'Výkon v dimenzích CO a JAK: {chart_year}'
-    #st.markdown(f"<h7 style='text-align: left; font-weight: bold;'>{chart_title}</h7>", unsafe_allow_html=True)
     
     AgGrid(
         pivot_df,
@@ -364,47 +418,14 @@ def display_5_grid(filtered_df, period, license_key):
     )
 
 
-def display_3_grid(filtered_df, period, license_key):
+def display_3_grid(pivot_df, period, license_key):
     """
     Display a 3x3 grid of CO (performance), JAK (values), and POTENCIAL ratings.
 
     Parameters:
-    - filtered_df (pd.DataFrame): Filtered data for grid display.
+    - pivot_df (pd.DataFrame): The grid computed by build_3_grid.
     - period (str): 'current' or 'previous' period indicator.
     """
-    # Define the suffix based on the period
-    suffix = '_PREVIOUS' if period == 'previous' else ''
-    vykon_column = f'CO{suffix}'
-    hodnoty_column = f'JAK{suffix}'
-    potencial_column = f'POTENCIAL{suffix}'
-   
-    # Compute 'HODNOTY_VYKON_SUM' for the selected period
-    filtered_df['JAK_CO_SUM'] = filtered_df[hodnoty_column] + filtered_df[vykon_column]
-    
-    # Define bins and labels for CO_JAK
-    bins = [-float('inf'), 0, 3, 7, 10]
-    labels = ['0', '1-3', '4-7', '8-10']
-    filtered_df['CO_JAK'] = pd.cut(
-        filtered_df['JAK_CO_SUM'],
-        bins=bins,
-        labels=labels,
-        include_lowest=True,
-        right = True
-    )
-
-    # Create the pivot table using the selected period's POTENCIAL column
-    pivot_df = filtered_df.pivot_table(
-        index='CO_JAK',
-        columns=potencial_column,
-        values='FULL_NAME_SPLIT',
-        aggfunc=lambda x: ', '.join([name for name in x if name]),
-        observed=False
-    ).fillna('')
-    
-    pivot_df = pivot_df.sort_index(ascending=False)
-    pivot_df.reset_index(inplace=True)
-    pivot_df.columns = pivot_df.columns.map(str)
-    
     # Configure grid options
     gb = GridOptionsBuilder.from_dataframe(pivot_df)
     page_size = 4
@@ -515,16 +536,6 @@ def display_3_grid(filtered_df, period, license_key):
     
     grid_options = gb.build()
     
-    # Display the chart title with the correct year
-    try:
-        if period == 'previous':
-            chart_year = 'Předchozí hodnocení'
-        else:
-            chart_year = str(filtered_df['YEAR_EVALUATION'].unique()[0])
-    except:
-        chart_year = 'Žádná data k zobrazení'
-    #chart_title = f'Výkon v dimenzích CO, JAK a potenciál: {chart_year}'
-    #st.markdown(f"<h7 style='text-align: left; font-weight: bold;'>{chart_title}</h7>", unsafe_allow_html=True)
     
     # Display the grid
     AgGrid(
@@ -540,71 +551,179 @@ def display_3_grid(filtered_df, period, license_key):
        # width='100%'
     )
 
-def display_column_chart(df, filtered_df):
+def _period_sort_key(year_evaluation):
+    """Order '2024-NA' (whole year) before '2024-1', '2024-2', ..."""
+    year, evaluation = str(year_evaluation).split('-', 1)
+    return int(year), -1 if evaluation == 'NA' else int(evaluation)
+
+
+class TrendRollup:
+    """
+    Sums and counts of the CO and JAK ratings per person and evaluation round of a shared dataset.
+
+    Built once from the shared frame and then brought up to date with the rows that upserts
+    changed since (see SharedDataset.changed_rows), so a save costs the size of its delta.
+    The ratings counted for every row are kept: the rollup is updated from the changed rows of a
+    newer version of the frame, which hold only the new values, so what was counted for them
+    before is needed to take it back out. The trend of any group of people is a gather of their
+    rows and a sum, without touching the frame.
+    """
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.lock = threading.Lock()
+        self.version = None
+        self._build(pd.DataFrame(columns=['USER_ID', 'YEAR_EVALUATION', *TREND_METRICS.values()]))
+
+    def _codes(self, rows):
+        """Person and round codes (-1 when unknown) and the ratings of the rows."""
+        users = self.users.get_indexer(rows['USER_ID'].astype(str))
+        periods = self.periods.get_indexer(rows['YEAR_EVALUATION'].astype(str))
+        values = np.column_stack([
+            pd.to_numeric(rows[column], errors='coerce').to_numpy(dtype=float)
+            for column in TREND_METRICS.values()
+        ]).reshape(len(rows), len(TREND_METRICS))
+        return users, periods, values
+
+    def _add(self, positions, sign):
+        users, periods, values = self.row_users[positions], self.row_periods[positions], self.row_values[positions]
+        for metric in range(len(TREND_METRICS)):
+            valid = (users >= 0) & (periods >= 0) & ~np.isnan(values[:, metric])
+            np.add.at(self.sums[:, :, metric], (users[valid], periods[valid]), sign * values[valid, metric])
+            np.add.at(self.counts[:, :, metric], (users[valid], periods[valid]), sign)
+
+    def _build(self, df):
+        self.users = pd.Index(pd.unique(df['USER_ID'].astype(str)))
+        self.periods = pd.Index(sorted(pd.unique(df['YEAR_EVALUATION'].astype(str)), key=_period_sort_key))
+        self.sums = np.zeros((len(self.users), len(self.periods), len(TREND_METRICS)))
+        self.counts = np.zeros(self.sums.shape, dtype=np.int64)
+        self.row_users, self.row_periods, self.row_values = self._codes(df)
+        self._add(np.arange(len(df)), 1)
+
+    def _update(self, df, positions):
+        """Replace the ratings counted for the changed rows; False when they bring a new person or round."""
+        users, periods, values = self._codes(df.iloc[positions])
+        if (users < 0).any() or (periods < 0).any():
+            return False
+        # Rows appended to the frame since the last update were not counted yet
+        appended = len(df) - len(self.row_users)
+        if appended > 0:
+            self.row_users = np.concatenate([self.row_users, np.full(appended, -1, dtype=self.row_users.dtype)])
+            self.row_periods = np.concatenate([self.row_periods, np.full(appended, -1, dtype=self.row_periods.dtype)])
+            self.row_values = np.concatenate([self.row_values, np.full((appended, len(TREND_METRICS)), np.nan)])
+        self._add(positions, -1)
+        self.row_users[positions], self.row_periods[positions], self.row_values[positions] = users, periods, values
+        self._add(positions, 1)
+        return True
+
+    def refresh(self):
+        """Bring the rollup to the current version of the dataset."""
+        with self.dataset.lock:
+            df = self.dataset.df
+            if df is None or self.version == self.dataset.version:
+                return
+            positions = None if self.version is None else self.dataset.changed_rows(self.version, set(TREND_METRICS.values()))
+            if positions is None or not self._update(df, positions):
+                self._build(df)
+            self.version = self.dataset.version
+
+    def series(self, user_ids, periods=None):
+        """
+        Average CO and JAK ratings per evaluation round of the given people.
+
+        Parameters:
+        - user_ids (array-like): People of the group.
+        - periods (int, optional): Keep only the last rounds in which the group was rated.
+
+        Returns:
+        - pd.DataFrame: Long format with YEAR_EVALUATION, Metric and Value columns, rounds in time order.
+        """
+        with self.lock:
+            self.refresh()
+            users = self.users.get_indexer(pd.unique(pd.Series(user_ids).astype(str)))
+            users = users[users >= 0]
+            sums = self.sums[users].sum(axis=0)
+            counts = self.counts[users].sum(axis=0)
+            labels = self.periods
+
+        rated = counts.sum(axis=1) > 0
+        if periods is not None:
+            rated &= np.cumsum(rated[::-1])[::-1] <= periods
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = np.where(counts > 0, sums / counts, np.nan)[rated]
+        return pd.DataFrame({
+            'YEAR_EVALUATION': np.repeat(np.asarray(labels)[rated], len(TREND_METRICS)),
+            'Metric': np.tile(list(TREND_METRICS), int(rated.sum())),
+            'Value': means.ravel(),
+        })
+
+
+@st.cache_resource(max_entries=500)
+def get_trend_rollup(table_id, scope=None):
+    """Return the process-wide trend rollup of the shared dataset of the table, see get_shared_dataset."""
+    return TrendRollup(get_shared_dataset(table_id, scope))
+
+
+def display_column_chart(column_chart_data):
     """
     Display a bar chart showing trends over time for CO and JAK ratings.
 
     Parameters:
-    - df (pd.DataFrame): The main dataset.
-    - filtered_df (pd.DataFrame): The filtered dataset based on user selections.
+    - column_chart_data (pd.DataFrame): Averages per evaluation round from TrendRollup.series.
     """
-    filtered_user_ids = filtered_df['USER_ID'].unique()
-    df_filtered_by_user = df[df['USER_ID'].isin(filtered_user_ids)]
-    df_filtered_by_user = df_filtered_by_user.rename(columns={"HODNOTY":"CO", "VYKON":"JAK"})
-    column_chart_data = df_filtered_by_user.groupby(['YEAR']).agg({
-        'JAK': 'mean',
-        'CO': 'mean'
-    }).reset_index()
-    
-    column_chart_data = column_chart_data.melt(
-        id_vars='YEAR',
-        value_vars=['JAK', 'CO'],
-        var_name='Metric',
-        value_name='Value'
-    )
-    
+    # Plotly is needed only to draw the chart, so the chart data can be computed and tested without it
+    import plotly.express as px
+
     st.markdown("<h7 style='text-align: left; font-weight: bold;'>Vývoj CO a JAK v čase</h7>", unsafe_allow_html=True)
     column_chart_fig = px.bar(
         column_chart_data,
         height=300,
-        x='YEAR',
+        x='YEAR_EVALUATION',
         y='Value',
         color='Metric',
         barmode='group'
     )
-    # Set autoscaling for both width and height
+    # Set autoscaling for both width and height, rounds stay in time order as categories
     column_chart_fig.update_layout(
         autosize=True,
         height=None,
         width=None,
     )
+    column_chart_fig.update_xaxes(type='category', title='Kolo hodnocení')
     
     st.plotly_chart(column_chart_fig, use_container_width=True)
 
 
-def display_charts(df, filtered_df, license_key):
+def display_charts(trend_rollup, filtered_df, license_key, cache_key, selected_name=None):
     """
-    Display all main charts, including the 5x5 and 3x3 grids and a trend chart.
+    Display the chart picked by the user: the 5x5 grid, the 3x3 grid or the trend chart.
+
+    Streamlit runs the body of every tab and expander on each rerun, so nothing is computed
+    until a chart is picked, and the computed grids are reused while cache_key and the 1-on-1
+    selection stay the same. The trend is answered from the rollup of the shared dataset.
 
     Parameters:
-    - df (pd.DataFrame): The full dataset.
-    - filtered_df (pd.DataFrame): Filtered data for the displayed charts.
+    - trend_rollup (TrendRollup): Rollup of the dataset, see get_trend_rollup.
+    - filtered_df (pd.DataFrame): Filtered data for the displayed charts, not yet preprocessed.
+    - cache_key (tuple): Dataset version, filters and pending edits the filtered data come from.
+    - selected_name (str, optional): Person of a 1-on-1 meeting, other names are masked in the grids.
     """
-    with st.expander("**Výkon v dimenzích CO a JAK**", expanded=False):
-        # col1, col2 = st.columns(2)
-        # with col1:
-        display_5_grid(filtered_df=filtered_df, period='current', license_key=license_key)
-        display_5_grid_summary(filtered_df, period='current')
-        # with col2:
-        #     display_5_grid(filtered_df, period='previous')
-    
-    with st.expander("**Výkon v dimenzích CO, JAK a POTENCIÁL**", expanded=False):
-        # col1, col2 = st.columns(2)
-        # with col1:
-        display_3_grid(filtered_df, period='current', license_key=license_key)
-        display_3_grid_summary(filtered_df, period='current')
-        # with col2:
-        #     display_3_grid(filtered_df, period='previous')
-    
-    with st.expander("**Vývoj CO a JAK v čase**", expanded=False):
-        display_column_chart(df, filtered_df)
+    selected_chart = st.pills("Vizualizace", CHART_VIEWS, key='chart_view', label_visibility='collapsed')
+    if selected_chart is None:
+        st.info("Vyberte vizualizaci, která se má zobrazit.")
+        return
+
+    cache_key = (*cache_key, selected_name)
+    with st.spinner("Načítám vizualizace..."):
+        if selected_chart == CHART_VIEWS[2]:
+            display_column_chart(trend_rollup.series(filtered_df['USER_ID'].unique()))
+            return
+
+        chart_df = memoize_chart('chart_df', cache_key, lambda: preprocess_df_for_charts(filtered_df, selected_name))
+        if selected_chart == CHART_VIEWS[0]:
+            pivot_df, category_counts = memoize_chart('grid_5', cache_key, lambda: build_5_grid(chart_df, period='current'))
+            display_5_grid(pivot_df, period='current', license_key=license_key)
+        else:
+            pivot_df, category_counts = memoize_chart('grid_3', cache_key, lambda: build_3_grid(chart_df, period='current'))
+            display_3_grid(pivot_df, period='current', license_key=license_key)
+        display_category_summary(category_counts)
@@ -1,99 +1,293 @@
 import os
+import threading
 
+import numpy as np
 import streamlit as st
 import pandas as pd
 
-from datetime import datetime 
 from io import BytesIO
-from collections import defaultdict, deque
 
-from data_manager_snowflake import save_changed_rows_snowflake
+from data_manager_snowflake import PK_COLUMNS, LatestVersionCache, changed_mask, finish_write_job, submit_lock
 
 
-def build_manager_hierarchy(df):
-    """Precompute the manager-to-reports relationships."""
-    # Normalize email columns for consistent matching
-    df['EMAIL_ADDRESS'] = df['EMAIL_ADDRESS'].str.lower().str.strip()
-    df['DIRECT_MANAGER_EMAIL'] = df['DIRECT_MANAGER_EMAIL'].str.lower().str.strip()
+def _gather(offsets, values, nodes):
+    """Concatenate the CSR segments values[offsets[n]:offsets[n + 1]] of all given nodes."""
+    starts = offsets[nodes]
+    lengths = offsets[nodes + 1] - starts
+    total = lengths.sum()
+    if total == 0:
+        return values[:0]
+    # Position of each output element within its own segment
+    segment_offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return values[np.repeat(starts, lengths) + np.arange(total) - segment_offsets]
 
-    # Exclude rows where EMAIL_ADDRESS is '0'
-    df = df[df['EMAIL_ADDRESS'] != '0']
-    
-    # Create a mapping of manager to their direct reports
-    manager_to_reports = defaultdict(list)
-    for manager_email, employee_email in zip(df['DIRECT_MANAGER_EMAIL'], df['EMAIL_ADDRESS']):
-        manager_to_reports[manager_email].append(employee_email)
 
-    return manager_to_reports
+class HierarchyIndex:
+    """
+    Organisation hierarchy over EMAIL_ADDRESS / DIRECT_MANAGER_EMAIL of one dataset version.
 
-def get_all_reports(df, manager_email):
-    """Efficiently get all direct and indirect reports for a manager."""
-    # Precompute the manager-to-reports hierarchy
-    manager_to_reports = build_manager_hierarchy(df)
+    Employees are numbered once and both manager-to-reports edges and employee-to-rows
+    mappings are stored as CSR arrays. An employee may have different managers across
+    years, so the hierarchy is a DAG rather than a tree; subtrees are resolved by a
+    vectorized BFS on first use and memoized as row positions.
+    """
 
-    # Initialize BFS traversal
-    manager_email = manager_email.lower().strip()
-    all_reports = set()
-    queue = deque([manager_email])
+    def __init__(self, df):
+        self.lock = threading.Lock()
+        self.row_count = len(df)
 
-    while queue:
-        current_manager = queue.popleft()
+        # Number every email that appears as an employee or a manager
+        codes, self.emails = pd.factorize(pd.concat([df['EMAIL_ADDRESS'], df['DIRECT_MANAGER_EMAIL']], ignore_index=True))
+        employee_codes, manager_codes = codes.reshape(2, -1)
+        self.emails = np.asarray(self.emails, dtype=object)
+        self.email_to_node = {email: node for node, email in enumerate(self.emails)}
+        node_count = len(self.emails)
 
-        # If this manager was already processed, skip
-        if current_manager in all_reports:
-            continue
+        # Rows where EMAIL_ADDRESS is '0' or missing are not employees
+        is_employee = (employee_codes >= 0) & (df['EMAIL_ADDRESS'].to_numpy() != '0')
 
-        # Mark the manager as processed
-        all_reports.add(current_manager)
+        # Distinct manager -> employee edges across all years
+        has_edge = is_employee & (manager_codes >= 0)
+        edges = np.unique(np.stack([manager_codes[has_edge], employee_codes[has_edge]], axis=1), axis=0)
+        self.child_offsets = np.concatenate([[0], np.cumsum(np.bincount(edges[:, 0], minlength=node_count))])
+        self.children = edges[:, 1]
 
-        # Add direct reports to the queue if they exist
-        direct_reports = set(manager_to_reports.get(current_manager, []))
-        queue.extend(direct_reports)
+        # Row positions of every employee, in original row order
+        employee_rows = np.flatnonzero(is_employee)
+        order = np.argsort(employee_codes[employee_rows], kind='stable')
+        self.row_offsets = np.concatenate([[0], np.cumsum(np.bincount(employee_codes[employee_rows], minlength=node_count))])
+        self.rows = employee_rows[order]
 
-        
-    # Remove the manager's own email from the results
-    all_reports.discard(manager_email)
+        # Depth from the top of the organisation; nodes never reached sit in or under a reporting cycle
+        has_manager = np.zeros(node_count, dtype=bool)
+        has_manager[edges[:, 1]] = True
+        self.depth = np.full(node_count, -1, dtype=np.int64)
+        frontier = np.flatnonzero(~has_manager)
+        level = 0
+        while frontier.size:
+            self.depth[frontier] = level
+            children = _gather(self.child_offsets, self.children, frontier)
+            frontier = np.unique(children[self.depth[children] < 0])
+            level += 1
+        self.cyclic_emails = set(self.emails[self.depth < 0])
 
-    return all_reports
+        self._reports = {}
 
-def filter_data_by_role(df, user_role, user_email):
-    """Filter data based on user role."""
+    def _node(self, email):
+        return self.email_to_node.get(email.lower().strip()) if email else None
+
+    def _rows_of(self, nodes):
+        return np.sort(_gather(self.row_offsets, self.rows, nodes))
+
+    def all_reports(self, manager_email):
+        """Row positions of all direct and indirect reports of the manager."""
+        node = self._node(manager_email)
+        if node is None:
+            return np.empty(0, dtype=np.int64)
+        with self.lock:
+            if node not in self._reports:
+                visited = np.zeros(len(self.emails), dtype=bool)
+                visited[node] = True
+                frontier = np.array([node])
+                while frontier.size:
+                    children = _gather(self.child_offsets, self.children, frontier)
+                    frontier = np.unique(children[~visited[children]])
+                    visited[frontier] = True
+                # The manager is not part of their own team, even in a reporting cycle
+                visited[node] = False
+                self._reports[node] = self._rows_of(np.flatnonzero(visited))
+            return self._reports[node]
+
+    def direct_reports(self, manager_email):
+        """Row positions of the direct reports of the manager."""
+        node = self._node(manager_email)
+        if node is None:
+            return np.empty(0, dtype=np.int64)
+        children = self.children[self.child_offsets[node]:self.child_offsets[node + 1]]
+        return self._rows_of(children[children != node])
+
+    def depth_of(self, email):
+        """Depth of the employee below the top of the organisation, None if unknown or in a cycle."""
+        node = self._node(email)
+        if node is None or self.depth[node] < 0:
+            return None
+        return int(self.depth[node])
+
+
+@st.cache_resource
+def get_hierarchy_indexes():
+    """Hierarchy indexes shared across sessions, one for the newest dataset version of each scope."""
+    return LatestVersionCache(HierarchyIndex)
+
+
+def get_hierarchy_index(df, dataset_version, scope=None):
+    """Return the hierarchy index of the dataset version, built once and shared across sessions."""
+    return get_hierarchy_indexes().get(df, scope, dataset_version)
+
+
+def get_role_rows(df, user_role, user_email, dataset_version=None, scope=None):
+    """Row positions visible to the role, or None when the role sees all rows."""
     if user_role == 'MA':
-        # Get all direct and indirect reports
-        all_reports = get_all_reports(df, user_email)
+        # Get all direct and indirect reports from the precomputed hierarchy
+        return get_hierarchy_index(df, dataset_version, scope).all_reports(user_email)
+    return None
+
+
+def _version_time(version):
+    """HIST_DATA_MODIFIED_WHEN as a Timestamp comparable across sources, NaT when missing."""
+    return pd.to_datetime(version, errors='coerce')
+
+
+class ChangeBuffer:
+    """
+    Pending edits keyed by (USER_ID, YEAR, EVALUATION), holding only the edited fields
+    together with the values they replaced and the HIST_DATA_MODIFIED_WHEN the row had
+    when it was first edited, which the save checks against the stored row.
 
-        # Filter the DataFrame based on collected emails
-        df_filtered = df[df['EMAIL_ADDRESS'].isin(all_reports)]
+    The buffer also remembers the rows of its own saves that are still being written or were
+    written with a stamp the shown data does not have yet (see start_save and finish_save),
+    so that editing such a row again is not reported as a conflict with its own save.
+    """
 
-        if df_filtered.empty:
-            st.warning("V hierarchii manažera nebyli nalezeni žádní zaměstnanci.")
-            st.stop()
-    else:
-        df_filtered = df
+    def __init__(self):
+        self._edits = {}
+        self._baseline = {}
+        self._versions = {}
+        self._revisions = {}
+        self._clears = 0
+        self._saves = {}
 
-    return df_filtered
+    def __len__(self):
+        return len(self._edits)
 
+    def __contains__(self, item):
+        key, column = item
+        return column in self._edits.get(key, ())
 
-def merge_changed_rows(new_changes):
-    """Merge new changes into the existing session_state['changed_rows'] without duplicates."""
-    pk_columns = ['USER_ID', 'YEAR', 'EVALUATION']
+    @property
+    def pending_count(self):
+        """Number of edited cells waiting to be saved."""
+        return sum(len(edits) for edits in self._edits.values())
 
-    if st.session_state['changed_rows'].empty:
-        st.session_state['changed_rows'] = new_changes.copy()
-    else:
-        # Set PK as the index for both DataFrames
-        st.session_state['changed_rows'].set_index(pk_columns, inplace=True)
-        new_changes.set_index(pk_columns, inplace=True)
+    def record(self, key, column, old_value, new_value):
+        """Record the new value of one cell, keeping the value it had before the first edit."""
+        self._edits.setdefault(key, {})[column] = new_value
+        self._baseline.setdefault(key, {}).setdefault(column, old_value)
+        self._revisions[column] = self._revisions.get(column, 0) + 1
 
-        # Update the existing rows with the new changes
-        st.session_state['changed_rows'].update(new_changes)
+    def revision(self, columns=None):
+        """
+        Value that changes whenever a cell of the given columns is edited or the buffer is cleared,
+        so results derived from the edited data can be reused while it stays the same.
+        """
+        return self._clears, sum(count for column, count in self._revisions.items() if columns is None or column in columns)
 
-        # Append any new rows that were not present in the existing DataFrame
-        st.session_state['changed_rows'] = st.session_state['changed_rows'].combine_first(new_changes)
+    def merge(self, changes, overwrite=True, versions=None):
+        """
+        Merge {key: {column: (old_value, new_value)}} into the buffer, touching only the given cells.
+        With overwrite=False, cells that already have a pending edit keep it. versions maps keys
+        to the HIST_DATA_MODIFIED_WHEN the edited rows had; a row keeps the version of its first edit.
+        """
+        versions = versions or {}
+        for key, edits in changes.items():
+            for column, (old_value, new_value) in edits.items():
+                if overwrite or (key, column) not in self:
+                    self.record(key, column, old_value, new_value)
+            if key in versions and key in self._edits:
+                self._versions.setdefault(key, versions[key])
 
-        # Reset index for further use
-        st.session_state['changed_rows'].reset_index(inplace=True)
-        new_changes.reset_index(inplace=True)
+    def changes(self):
+        """Copy of the pending edits as {key: {column: (old_value, new_value)}}, accepted by merge."""
+        return {
+            key: {column: (self._baseline[key][column], value) for column, value in edits.items()}
+            for key, edits in self._edits.items()
+        }
+
+    def versions(self):
+        """Copy of the row versions as {key: HIST_DATA_MODIFIED_WHEN}, accepted by merge."""
+        return dict(self._versions)
+
+    def baseline(self, key):
+        """Values the edited cells of a row had before they were edited."""
+        return dict(self._baseline.get(key, {}))
+
+    def apply(self, df, key_positions):
+        """
+        Return the DataFrame with the pending edits applied.
+
+        df must keep the row labels of the shared dataset, which key_positions maps keys to.
+        """
+        if not self._edits:
+            return df
+        df = df.copy()
+        for key, edits in self._edits.items():
+            label = key_positions.get(key)
+            if label is None or label not in df.index:
+                continue
+            for column, value in edits.items():
+                if column in df.columns:
+                    df.at[label, column] = value
+        return df
+
+    def clear(self):
+        self._edits.clear()
+        self._baseline.clear()
+        self._versions.clear()
+        self._clears += 1
+
+    def start_save(self, keys):
+        """Mark rows as being written by a save of this buffer."""
+        for key in keys:
+            self._saves.setdefault(key, [0, None])[0] += 1
+
+    def finish_save(self, keys, stamp=None):
+        """
+        Mark a save of the rows as finished. stamp is the HIST_DATA_MODIFIED_WHEN the save wrote
+        them with; without it (failed save, conflicting rows) the stored version did not change.
+        """
+        for key in keys:
+            save = self._saves.get(key)
+            if save is None:
+                continue
+            save[0] -= 1
+            if stamp is not None and (save[1] is None or _version_time(stamp) > _version_time(save[1])):
+                save[1] = stamp
+            if save[0] <= 0 and save[1] is None:
+                del self._saves[key]
+
+    def expected_version(self, key):
+        """
+        Return (EXPECTED_MODIFIED_WHEN, CHECK_VERSION) for a save of the row.
+
+        While a save of the row is still being written, its stamp is not known yet and the
+        version is not checked. After it is written, its stamp is expected until the row
+        is edited from data that has that version or a newer one.
+        """
+        version = self._versions.get(key)
+        in_flight, stamp = self._saves.get(key, (0, None))
+        if in_flight > 0:
+            return None, False
+        if stamp is not None:
+            shown = _version_time(version)
+            if pd.isnull(shown) or shown < _version_time(stamp):
+                return stamp, True
+        return version, key in self._versions
+
+    def to_frame(self):
+        """
+        Save payload with the primary key columns, the edited fields and CHANGED_MASK telling
+        which fields of each row were edited, so that edits to empty values are written too.
+        Rows with a known version carry it in EXPECTED_MODIFIED_WHEN with CHECK_VERSION set
+        (see expected_version).
+        """
+        if not self._edits:
+            return pd.DataFrame(columns=PK_COLUMNS + ['CHANGED_MASK'])
+        rows = []
+        for key, edits in self._edits.items():
+            expected, check = self.expected_version(key)
+            rows.append(dict(zip(PK_COLUMNS, key), **edits, CHANGED_MASK=changed_mask(edits),
+                             EXPECTED_MODIFIED_WHEN=expected, CHECK_VERSION=check))
+        return pd.DataFrame(rows)
 
 
 def mask_dataframe_for_1on1(df, selected_name):
@@ -113,22 +307,15 @@ def generate_csv_file_dialog(data):
 
 
 @st.dialog("Potvrdit uzamčení záznamů")
-def lock_filtered_rows_dialog(df_orig, client):
+def lock_filtered_rows_dialog(client):
         st.error("""Kliknutím na Ano uzamknete hodnocení všech aktuálně vyfiltrovaných záznamů. Manažer nebude mít
                 po uzamčení možnost editace. Business Partner bude mít možnost editovat po dobu 30 dní od uzamčení.""")
         ano_col, ne_col = st.columns(2)
         with ano_col:
             if st.button("Ano", use_container_width=True, type='primary'):
                 if not st.session_state['rows_to_lock'].empty:
-                    locked_rows = st.session_state['rows_to_lock'][['USER_ID', 'YEAR', 'EVALUATION']].copy()
-                    locked_rows['IS_LOCKED'] = 1 
-                    locked_rows[['USER_ID', 'YEAR', 'EVALUATION','IS_LOCKED']] = locked_rows[['USER_ID', 'YEAR', 'EVALUATION','IS_LOCKED']].astype(int)
-                    progress_text = "**Odesílám data do databáze...**"
-                    progress = st.progress(0, text=progress_text)
-                    save_changed_rows_snowflake(df_orig, locked_rows, False, client, progress)
+                    submit_lock(st.session_state['rows_to_lock'], client, "Uzamčení hodnocení")
                     st.session_state['rows_to_lock'] = pd.DataFrame()
-                    progress.progress(100)
-                    st.session_state['grid_key_filter'] +=  f"_locked_{datetime.now().strftime('%Y%m%d%H%M%S%f')}"
                     st.rerun()
                 else:
                     st.warning("Nebyly vybrány žádné záznamy k uzamčení.")
@@ -137,4 +324,23 @@ def lock_filtered_rows_dialog(df_orig, client):
                 st.info("Záznamy nebyly uzamknuty.")
                 st.session_state['rows_to_lock'] = pd.DataFrame()
                 st.rerun()
-                
\ No newline at end of file
+                
+
+@st.fragment(run_every=1)
+def display_save_status(client):
+    """
+    Show writes running in the background and pick up their results.
+
+    Runs every second while there are jobs in session_state['save_jobs']. When a job
+    finishes, its outcome goes to session_state['save_messages'] and the whole app reruns,
+    so it shows the refreshed data.
+    """
+    messages = [finish_write_job(job, client) for job in st.session_state['save_jobs'] if job['future'].done()]
+    st.session_state['save_jobs'] = [job for job in st.session_state['save_jobs'] if job['state'] == 'pending']
+    if messages:
+        st.session_state['save_messages'].extend(messages)
+        st.rerun(scope="app")
+
+    pending = len(st.session_state['save_jobs'])
+    if pending:
+        st.info(f"⏳ Probíhá ukládání na pozadí ({pending})...")
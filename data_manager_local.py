@@ -0,0 +1,166 @@
+import json
+import os
+import sqlite3
+import threading
+
+import pandas as pd
+
+from data_manager_snowflake import (
+    DEFAULT_TIMESTAMP,
+    PK_COLUMNS,
+    UPDATABLE_COLUMNS,
+    build_scoped_query,
+    changed_mask,
+    row_key,
+    timestamp_text
+)
+from storage_manager import StorageBackend
+
+
+def map_json_to_sqlite_type(json_type):
+    if json_type == "str":
+        return "TEXT"
+    elif json_type == "int":
+        return "INTEGER"
+    elif json_type == "datetime64[ns]":
+        # Stored as timestamp_text strings, which sort in time order
+        return "TEXT"
+    else:
+        raise ValueError(f"Unsupported JSON type: {json_type}")
+
+
+def _records(df, columns):
+    """Rows of df as dicts of plain Python values for the given columns, missing values as None."""
+    return [{column: record.get(column) for column in columns} for record in json.loads(df.to_json(orient='records'))]
+
+
+class LocalBackend(StorageBackend):
+    """
+    Storage in an embedded SQLite database, for running the app and benchmarks locally.
+
+    The rating table is created from the debug CSV on first use, with a unique index on the
+    primary key, so merges and locks update rows by key instead of rewriting the file.
+    One connection is shared by all threads and each call holds the lock, as SQLite
+    has a single writer anyway.
+    """
+
+    def __init__(self, database_path, seed_path, source_table_id, filter_table_id, column_types):
+        self.column_types = column_types
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(database_path), exist_ok=True)
+        self._connection = sqlite3.connect(database_path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        with self._lock, self._connection:
+            if not self._table_exists(source_table_id):
+                self._seed_source_table(source_table_id, seed_path)
+            self._connection.execute(f"""
+                CREATE TABLE IF NOT EXISTS "{filter_table_id}" (
+                    "FILTER_NAME" TEXT, "FILTER_CREATOR" TEXT, "FILTERED_VALUES" TEXT,
+                    UNIQUE ("FILTER_NAME", "FILTER_CREATOR")
+                )
+            """)
+
+    def _table_exists(self, table_id):
+        query = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?"
+        return self._connection.execute(query, [table_id]).fetchone() is not None
+
+    def _seed_source_table(self, table_id, seed_path):
+        """Create the rating table with all columns of the expected schema and load the CSV into it."""
+        columns = list(self.column_types)
+        column_list = ', '.join(f'"{column}" {map_json_to_sqlite_type(self.column_types[column])}' for column in columns)
+        self._connection.execute(f'CREATE TABLE "{table_id}" ({column_list})')
+        pk_list = ', '.join(f'"{column}"' for column in PK_COLUMNS)
+        self._connection.execute(f'CREATE UNIQUE INDEX "{table_id}_PK" ON "{table_id}" ({pk_list})')
+
+        text_columns = {column: str for column, column_type in self.column_types.items() if column_type == 'str'}
+        seed = pd.read_csv(seed_path, dtype=text_columns).reindex(columns=columns)
+        for column in columns:
+            if self.column_types[column] == 'datetime64[ns]':
+                seed[column] = pd.to_datetime(seed[column], errors='coerce').map(timestamp_text)
+        placeholders = ', '.join(f':{column}' for column in columns)
+        self._connection.executemany(f'INSERT INTO "{table_id}" VALUES ({placeholders})', _records(seed, columns))
+
+    def load_rows(self, table_id, columns, scope=None, modified_since=None):
+        query, params = build_scoped_query(table_id, columns, manager_email=scope)
+        if modified_since is not None:
+            since = timestamp_text(modified_since)
+            query += ' AND (src."HIST_DATA_MODIFIED_WHEN" >= ? OR src."LOCKED_TIMESTAMP" >= ?)'
+            params += [since, since]
+        with self._lock:
+            df = pd.read_sql_query(query, self._connection, params=params)
+        for column in columns:
+            if self.column_types.get(column) == 'datetime64[ns]':
+                # timestamp_text leaves out zero microseconds, so stored values differ in precision
+                df[column] = pd.to_datetime(df[column], errors='coerce', format='ISO8601')
+        return df
+
+    def merge_rows(self, table_id, rows, column_types):
+        if rows.empty:
+            return 0
+
+        def is_changed(column):
+            return f'(:CHANGED_MASK & {changed_mask([column])}) <> 0'
+
+        # Same rules as build_merge_query, applied row by row through the primary key index
+        set_list = []
+        for column in UPDATABLE_COLUMNS:
+            value = f'CASE WHEN {is_changed(column)} THEN :{column} ELSE "{column}" END'
+            if column == 'LOCKED_TIMESTAMP':
+                locking = (f'{is_changed("IS_LOCKED")} AND :IS_LOCKED = 1 '
+                           f'AND ("LOCKED_TIMESTAMP" IS NULL OR "LOCKED_TIMESTAMP" <= \'{DEFAULT_TIMESTAMP}\')')
+                value = f'CASE WHEN {locking} THEN :HIST_DATA_MODIFIED_WHEN ELSE {value} END'
+            set_list.append(f'"{column}" = {value}')
+        query = f"""
+            UPDATE "{table_id}" SET {', '.join(set_list)}
+            WHERE {' AND '.join(f'"{column}" = :{column}' for column in PK_COLUMNS)}
+              AND (NOT COALESCE(:CHECK_VERSION, 0) OR "HIST_DATA_MODIFIED_WHEN" IS :EXPECTED_MODIFIED_WHEN)
+        """
+        records = _records(rows, PK_COLUMNS + UPDATABLE_COLUMNS + ['CHANGED_MASK', 'EXPECTED_MODIFIED_WHEN', 'CHECK_VERSION'])
+        with self._lock, self._connection:
+            return self._connection.executemany(query, records).rowcount
+
+    def find_conflicts(self, table_id, rows, stamp):
+        query = f"""
+            SELECT {', '.join(f'"{column}"' for column in PK_COLUMNS)} FROM "{table_id}"
+            WHERE {' AND '.join(f'"{column}" = ?' for column in PK_COLUMNS)} AND "HIST_DATA_MODIFIED_WHEN" IS NOT ?
+        """
+        with self._lock:
+            return [
+                row_key(*row)
+                for key in _records(rows, PK_COLUMNS)
+                for row in self._connection.execute(query, [key[column] for column in PK_COLUMNS] + [stamp])
+            ]
+
+    def lock_rows(self, table_id, keys, user_email, stamp):
+        if keys.empty:
+            return 0
+        query = f"""
+            UPDATE "{table_id}"
+            SET "IS_LOCKED" = 1,
+                "LOCKED_TIMESTAMP" = CASE WHEN "LOCKED_TIMESTAMP" IS NULL OR "LOCKED_TIMESTAMP" <= '{DEFAULT_TIMESTAMP}'
+                                          THEN :STAMP ELSE "LOCKED_TIMESTAMP" END,
+                "HIST_DATA_MODIFIED_BY" = :USER_EMAIL,
+                "HIST_DATA_MODIFIED_WHEN" = :STAMP
+            WHERE {' AND '.join(f'"{column}" = :{column}' for column in PK_COLUMNS)}
+              AND COALESCE("IS_LOCKED", 0) <> 1
+        """
+        records = [dict(key, STAMP=stamp, USER_EMAIL=user_email) for key in _records(keys, PK_COLUMNS)]
+        with self._lock, self._connection:
+            return self._connection.executemany(query, records).rowcount
+
+    def load_filters(self, table_id, user_email):
+        with self._lock:
+            return pd.read_sql_query(f'SELECT * FROM "{table_id}" WHERE "FILTER_CREATOR" = ?', self._connection, params=[user_email])
+
+    def save_filter(self, table_id, user_email, filter_name, filter_model_json):
+        query = f"""
+            INSERT INTO "{table_id}" ("FILTER_NAME", "FILTER_CREATOR", "FILTERED_VALUES") VALUES (?, ?, ?)
+            ON CONFLICT ("FILTER_NAME", "FILTER_CREATOR") DO UPDATE SET "FILTERED_VALUES" = excluded."FILTERED_VALUES"
+        """
+        with self._lock, self._connection:
+            self._connection.execute(query, [filter_name, user_email, filter_model_json])
+
+    def delete_filter(self, table_id, user_email, filter_name):
+        with self._lock, self._connection:
+            self._connection.execute(f'DELETE FROM "{table_id}" WHERE "FILTER_NAME" = ? AND "FILTER_CREATOR" = ?',
+                                     [filter_name, user_email])
@@ -1,97 +1,363 @@
+import itertools
 import json
 import os
-import uuid
+import queue
+import threading
+import time
 
+import numpy as np
 import streamlit as st
 import pandas as pd
 
-from datetime import datetime
-from snowflake.snowpark import Session
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from storage_manager import get_storage_backend
 
 
-def get_snowflake_session(client):
-    """Create and return a Snowflake session using Snowpark."""
-    if st.session_state['snowflake_session'] is None:
-        # Set up Snowflake connection parameters from st.secrets
-        try:
-            snowflake_config = {
-                "account": st.secrets["SNOWFLAKE_ACCOUNT"],
-                "user": st.secrets["SNOWFLAKE_USER"],
-                "password": st.secrets["SNOWFLAKE_PASSWORD"],
-                "warehouse": st.secrets["SNOWFLAKE_WAREHOUSE"],
-                "database": st.secrets["SNOWFLAKE_DB"],
-                "schema": st.secrets["SNOWFLAKE_SCHEMA"]
-            }
-
-            # Create and store the session in session state
-            st.session_state["snowflake_session"] = Session.builder.configs(snowflake_config).create()
-            client.create_event(message='Streamlit App Snowflake Init Connection', event_type='keboola_data_app_snowflake_init')
-        except Exception as e:
-            st.error(f"Error creating Snowflake session: {e}")
+PK_COLUMNS = ['USER_ID', 'YEAR', 'EVALUATION']
+
+# Columns a save can write; their order defines the bits of CHANGED_MASK
+UPDATABLE_COLUMNS = ['HODNOTY', 'VYKON', 'POTENCIAL', 'POZNAMKY', 'NASTUPCE', 'PRAVDEPODOBNOST_ODCHODU', 
+                     'IS_LOCKED', 'MOZNY_KARIERNI_POSUN', 'LOCKED_TIMESTAMP', 'HIST_DATA_MODIFIED_BY', 
+                     'HIST_DATA_MODIFIED_WHEN']
+
+# Timestamps at or before this value count as not set
+DEFAULT_TIMESTAMP = "1970-01-01 00:00:00.000"
+
+SOURCE_COLUMNS = ['USER_ID', 'YEAR', 'EVALUATION', 'LOGIN', 'EMAIL_ADDRESS', 'DIRECT_MANAGER_EMAIL', 'FULL_NAME', 'JOB_TITLE_CZ', 'DIRECT_MANAGER_FULL_NAME', 'LAST_EVALUATION', 
+                  'VYKON_PREVIOUS', 'HODNOTY_PREVIOUS', 'POTENCIAL_PREVIOUS', 'VYKON_SYSTEM', 'HODNOTY_SYSTEM', 'IS_LOCKED', 
+                  'VYKON', 'HODNOTY', 'POTENCIAL', 'PRAVDEPODOBNOST_ODCHODU', 'NASTUPCE', 'MOZNY_KARIERNI_POSUN', 'POZNAMKY', 'LOCKED_TIMESTAMP', 
+                  'HIST_DATA_MODIFIED_WHEN', 'HIST_DATA_MODIFIED_BY', 'JOB_ENTRY_DATE', 'TM_DATE', 'L2_ORGANIZATION_UNIT_NAME_CZ',
+                  'L3_ORGANIZATION_UNIT_NAME_CZ', 'L4_ORGANIZATION_UNIT_NAME_CZ', 'TEAM_CODE', 'L2_HEAD_OF_UNIT_FULL_NAME', 'L3_HEAD_OF_UNIT_FULL_NAME',
+                  'L4_HEAD_OF_UNIT_FULL_NAME', 'MES_DPP_STATUS']
+
+# Columns whose newest value is the watermark for incremental refreshes
+WATERMARK_COLUMNS = ['HIST_DATA_MODIFIED_WHEN', 'LOCKED_TIMESTAMP']
+
+# Rows written by other app instances may carry slightly older timestamps, so the delta
+# query re-reads this window below the watermark (upserts are idempotent)
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+# Upper bound for the recursive hierarchy walk, protects the query against cycles in manager data
+MAX_HIERARCHY_DEPTH = 30
+
+# Upserts remembered per dataset, so structures derived from the frame can catch up by the changed rows
+UPSERT_HISTORY = 64
+
+# Monotonic counter shared by all datasets, so a version never repeats within the process
+_dataset_versions = itertools.count(1)
+
+# Database writes run on this many threads per process, each with its own Snowpark session
+WRITE_WORKERS = 4
+
+# Row writes of all sessions arriving within this many seconds are committed together
+BATCH_WINDOW = 0.25
+
+
+def row_key(user_id, year, evaluation):
+    """Normalize a primary key to a hashable tuple comparable across sources."""
+    return (str(user_id), int(year), None if pd.isnull(evaluation) else int(float(evaluation)))
+
+
+def compute_watermark(df):
+    """Return the newest modification or lock timestamp in the frame, or None."""
+    watermark = None
+    for column in WATERMARK_COLUMNS:
+        if column in df.columns:
+            newest = pd.to_datetime(df[column], errors='coerce').max()
+            if pd.notnull(newest) and (watermark is None or newest > watermark):
+                watermark = newest
+    return watermark
+
+
+class SharedDataset:
+    """
+    Process-wide, versioned copy of a source table shared by all browser sessions.
+
+    Writers hold the lock; a published frame is never modified afterwards, so readers
+    only need the lock to take the frame and its version together.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.df = None
+        self.version = next(_dataset_versions)
+        self.watermark = None
+        self.key_positions = {}
+        self.history = deque(maxlen=UPSERT_HISTORY)
+
+    def publish(self, df):
+        """Replace the shared frame and bump the version."""
+        self.df = df
+        self.version = next(_dataset_versions)
+        self.watermark = compute_watermark(df)
+        self.key_positions = {
+            row_key(*key): position
+            for position, key in enumerate(zip(df['USER_ID'], df['YEAR'], df['EVALUATION']))
+        }
+        self.history.clear()
+
+    def changed_rows(self, since_version, columns):
+        """
+        Positions of rows appended, or with a value changed in any of the columns, by upserts
+        after since_version.
+
+        Returns None when the frame was published again since, or the history does not reach
+        that far back; whatever was derived from the older version must then be rebuilt.
+        """
+        if since_version == self.version:
+            return np.empty(0, dtype=np.intp)
+        entries = list(self.history)
+        start = next((number for number, entry in enumerate(entries) if entry[0] == since_version), None)
+        if start is None:
             return None
+        changed = [
+            np.concatenate([patched, appended]) if columns & patched_columns else appended
+            for _, _, patched, appended, patched_columns in entries[start:]
+        ]
+        return np.unique(np.concatenate(changed))
+
+    def upsert(self, delta, advance_watermark=True):
+        """
+        Upsert delta rows by primary key and bump the version.
 
-        return st.session_state["snowflake_session"]
-    # Return the existing session if already created
-    return st.session_state["snowflake_session"]
+        The frame of a published version is never modified. Only columns whose values differ
+        from the delta are copied, patched and set on a shallow copy of the frame, which shares
+        the unchanged columns and replaces the old frame together with the version bump; when no
+        value differs and no row is new, the version stays. Sessions holding an earlier version
+        keep reading consistent data without taking the lock. Rows not read from the table
+        (advance_watermark=False) leave the watermark, so changes of other writers older than them
+        are still fetched by the next refresh. The changed rows and columns are remembered in the
+        history, see changed_rows.
+        """
+        positions, new_rows = [], []
+        for row_number, key in enumerate(zip(delta['USER_ID'], delta['YEAR'], delta['EVALUATION'])):
+            position = self.key_positions.get(row_key(*key))
+            if position is None:
+                new_rows.append(row_number)
+            else:
+                positions.append((position, row_number))
 
+        delta_watermark = compute_watermark(delta) if advance_watermark else None
+        if delta_watermark is not None and (self.watermark is None or delta_watermark > self.watermark):
+            self.watermark = delta_watermark
 
-def read_data_snowflake(table_id, client):
-    """Read data from Snowflake table into a Pandas DataFrame using Snowpark."""
-    try:
-        # Get the reusable Snowflake session
-        session = get_snowflake_session(client)
+        df = self.df.copy(deep=False)
+        target_positions = np.asarray([position for position, _ in positions], dtype=np.intp)
+        delta_positions = [row_number for _, row_number in positions]
+        changed = np.zeros(len(target_positions), dtype=bool)
+        patched_columns = set()
+        for column in delta.columns.intersection(df.columns):
+            current = df[column].iloc[target_positions].reset_index(drop=True)
+            values = delta[column].iloc[delta_positions].reset_index(drop=True)
+            try:
+                differs = (current != values).fillna(True).to_numpy(dtype=bool)
+            except TypeError:
+                differs = np.ones(len(values), dtype=bool)
+            differs &= ~(current.isna() & values.isna()).to_numpy()
+            if not differs.any():
+                continue
+            patched = df[column].copy()
+            patched.iloc[target_positions[differs]] = values[differs].to_numpy()
+            df[column] = patched
+            changed |= differs
+            patched_columns.add(column)
 
-        # Check if session is None
-        if session is None:
-            st.error("Snowflake session could not be created.")
+        if not patched_columns and not new_rows:
             return
-            
-        # Load data from Snowflake table into a Pandas DataFrame
-        columns = ['USER_ID', 'YEAR', 'EVALUATION', 'LOGIN', 'EMAIL_ADDRESS', 'DIRECT_MANAGER_EMAIL', 'FULL_NAME', 'JOB_TITLE_CZ', 'DIRECT_MANAGER_FULL_NAME', 'LAST_EVALUATION', 
-                   'VYKON_PREVIOUS', 'HODNOTY_PREVIOUS', 'POTENCIAL_PREVIOUS', 'VYKON_SYSTEM', 'HODNOTY_SYSTEM', 'IS_LOCKED', 
-                   'VYKON', 'HODNOTY', 'POTENCIAL', 'PRAVDEPODOBNOST_ODCHODU', 'NASTUPCE', 'MOZNY_KARIERNI_POSUN', 'POZNAMKY', 'LOCKED_TIMESTAMP', 
-                   'HIST_DATA_MODIFIED_WHEN', 'HIST_DATA_MODIFIED_BY', 'JOB_ENTRY_DATE', 'TM_DATE', 'L2_ORGANIZATION_UNIT_NAME_CZ',
-                   'L3_ORGANIZATION_UNIT_NAME_CZ', 'L4_ORGANIZATION_UNIT_NAME_CZ', 'TEAM_CODE', 'L2_HEAD_OF_UNIT_FULL_NAME', 'L3_HEAD_OF_UNIT_FULL_NAME',
-                   'L4_HEAD_OF_UNIT_FULL_NAME', 'MES_DPP_STATUS']
-        
-        df_snowflake = session.table(table_id).select(columns).to_pandas()
-        client.create_event(message='Streamlit App Snowflake Read Table', event_type='keboola_data_app_snowflake_read_table', event_data=f'table_id: {table_id}')
-
-        # Add the YEAR_EVALUATION
-        df_snowflake['YEAR_EVALUATION'] = df_snowflake.apply(
-            lambda row: f"{row['YEAR']}-{int(float(row['EVALUATION']))}" 
-                        if pd.notnull(row['EVALUATION']) else f"{row['YEAR']}-NA",
-            axis=1
-        )
-        df_snowflake['DIRECT_MANAGER_EMAIL'] = df_snowflake['DIRECT_MANAGER_EMAIL'].str.lower()
-        df_snowflake['EMAIL_ADDRESS'] = df_snowflake['EMAIL_ADDRESS'].str.lower()
-        # Store in session state
-        st.session_state['df'] = df_snowflake
 
-    except Exception as e:
-        st.error(f"Failed to load data from Snowflake: {e}")
-        st.stop()
+        key_positions = self.key_positions
+        if new_rows:
+            appended = delta.iloc[new_rows]
+            start = len(df)
+            df = pd.concat([df, appended], ignore_index=True)
+            key_positions = dict(key_positions)
+            for offset, key in enumerate(zip(appended['USER_ID'], appended['YEAR'], appended['EVALUATION'])):
+                key_positions[row_key(*key)] = start + offset
+        self.df, self.key_positions = df, key_positions
 
+        previous_version, self.version = self.version, next(_dataset_versions)
+        appended_positions = np.arange(len(self.df) - len(new_rows), len(self.df), dtype=np.intp)
+        self.history.append((previous_version, self.version, target_positions[changed],
+                             appended_positions, frozenset(patched_columns)))
 
-def execute_query_snowflake(query: str, client = None):
-    # Step 3: Write the filter incrementally to the database using Snowpark
-    try:
-        # Get Snowflake session
-        session = get_snowflake_session(client)
-        session.sql(query).collect()
-        client.create_event(message='Streamlit App Snowflake Query', event_type='keboola_data_app_snowflake_query', event_data=f'Query: {query}')
-    except Exception as e:
-        st.error(f"Failed to execute a query: {e}")
 
+class LatestVersionCache:
+    """
+    A structure derived from a shared dataset, kept for the newest version of each scope only.
+
+    build(df) makes the structure. Asking for a newer version replaces the entry of its scope,
+    so indexes of outdated versions are not kept. Sessions still showing an older version
+    (unsaved changes) get a structure built for them that is not cached.
+    """
+
+    def __init__(self, build):
+        self.build = build
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, df, scope, version):
+        with self._lock:
+            cached_version, value = self._entries.get(scope, (None, None))
+            if cached_version == version and version is not None:
+                return value
+            if version is not None and (cached_version is None or version > cached_version):
+                value = self.build(df)
+                self._entries[scope] = (version, value)
+                return value
+        return self.build(df)
 
-def write_data_snowflake(df: pd.DataFrame, table_name: str, auto_create_table: bool = False, overwrite: bool = False, client = None) -> None:
+
+@st.cache_resource(max_entries=500)
+def get_shared_dataset(table_id, scope=None):
+    """
+    Return the process-wide dataset holder for the given table.
+
+    scope is None for the whole table, or the manager email for a dataset
+    restricted to that manager's subtree (see build_scoped_query).
+    """
+    return SharedDataset()
+
+
+def build_scoped_query(table_id, columns, manager_email=None):
+    """
+    Build a SELECT over the source table with the manager's subtree pushed down.
+
+    Parameters:
+    - table_id (str): Source table name.
+    - columns (list): Columns to select.
+    - manager_email (str, optional): Restrict rows to direct and indirect reports of this
+      manager, resolved by a recursive CTE over DIRECT_MANAGER_EMAIL.
+
+    Returns:
+    - tuple: The query text and the list of bind parameters.
+    """
+    column_list = ', '.join(f'src."{column}"' for column in columns)
+    conditions, params = [], []
+    with_clause = ''
+
+    if manager_email:
+        manager_email = manager_email.lower().strip()
+        # Edges are deduplicated across years, the walk stops at MAX_HIERARCHY_DEPTH
+        with_clause = f"""
+            WITH RECURSIVE edges AS (
+                SELECT DISTINCT LOWER(TRIM("EMAIL_ADDRESS")) AS EMPLOYEE_EMAIL,
+                       LOWER(TRIM("DIRECT_MANAGER_EMAIL")) AS MANAGER_EMAIL
+                FROM "{table_id}"
+                WHERE "EMAIL_ADDRESS" <> '0'
+            ),
+            reports (EMPLOYEE_EMAIL, DEPTH) AS (
+                SELECT EMPLOYEE_EMAIL, 1 FROM edges WHERE MANAGER_EMAIL = ?
+                UNION ALL
+                SELECT edges.EMPLOYEE_EMAIL, reports.DEPTH + 1
+                FROM edges JOIN reports ON edges.MANAGER_EMAIL = reports.EMPLOYEE_EMAIL
+                WHERE reports.DEPTH < {MAX_HIERARCHY_DEPTH}
+            )
+        """
+        params.append(manager_email)
+        conditions.append('LOWER(TRIM(src."EMAIL_ADDRESS")) IN (SELECT EMPLOYEE_EMAIL FROM reports)')
+        # The manager is not part of their own team
+        conditions.append('LOWER(TRIM(src."EMAIL_ADDRESS")) <> ?')
+        params.append(manager_email)
+
+    where_clause = ' AND '.join(conditions) if conditions else 'TRUE'
+    query = f'{with_clause}SELECT {column_list} FROM "{table_id}" AS src WHERE {where_clause}'
+    return query, params
+
+
+def get_snowflake_config():
+    """Snowflake connection parameters from st.secrets."""
+    return {
+        "account": st.secrets["SNOWFLAKE_ACCOUNT"],
+        "user": st.secrets["SNOWFLAKE_USER"],
+        "password": st.secrets["SNOWFLAKE_PASSWORD"],
+        "warehouse": st.secrets["SNOWFLAKE_WAREHOUSE"],
+        "database": st.secrets["SNOWFLAKE_DB"],
+        "schema": st.secrets["SNOWFLAKE_SCHEMA"]
+    }
+
+
+def read_data_snowflake(table_id, client, scope=None):
+    """
+    Point session_state['df'] at the shared copy of the Snowflake table.
+
+    The table is pulled through Snowpark only when the process-wide cache is empty
+    (first session of the process); the lock makes concurrent sessions
+    wait for that single load instead of each querying the warehouse. Sessions share
+    the frame by reference, so it must be treated as read-only. With a scope (manager
+    email), only that manager's subtree is read.
+    """
+    dataset = get_shared_dataset(table_id, scope)
+    with dataset.lock:
+        if dataset.df is None:
+            df_snowflake = load_data_snowflake(table_id, client, scope=scope)
+            if df_snowflake is None:
+                return
+            dataset.publish(df_snowflake)
+
+        # Store a reference (not a copy) in session state
+        st.session_state['df'] = dataset.df
+        st.session_state['df_version'] = dataset.version
+        st.session_state['df_scope'] = scope
+
+
+def refresh_data_snowflake(table_id, client, scope=None):
+    """
+    Bring the shared table up to date after a write.
+
+    Only rows modified or locked since the dataset watermark are fetched and upserted
+    into the shared frame. Falls back to a full load when there is no frame or watermark yet.
+    """
+    dataset = get_shared_dataset(table_id, scope)
+    with dataset.lock:
+        if dataset.df is None or dataset.watermark is None:
+            df_snowflake = load_data_snowflake(table_id, client, scope=scope)
+            if df_snowflake is None:
+                return
+            dataset.publish(df_snowflake)
+        else:
+            delta = load_data_snowflake(table_id, client, scope=scope, modified_since=dataset.watermark - WATERMARK_OVERLAP)
+            if delta is None:
+                return
+            if not delta.empty:
+                dataset.upsert(delta)
+
+        st.session_state['df'] = dataset.df
+        st.session_state['df_version'] = dataset.version
+        st.session_state['df_scope'] = scope
+
+
+def prepare_source_frame(df):
+    """Add derived columns and normalize emails of a frame read from the source table."""
+    # Add the YEAR_EVALUATION
+    evaluation = pd.to_numeric(df['EVALUATION'], errors='coerce')
+    has_evaluation = evaluation.notna()
+    evaluation_label = pd.Series('NA', index=df.index, dtype=object)
+    evaluation_label[has_evaluation] = evaluation[has_evaluation].astype('int64').astype(str)
+    df['YEAR_EVALUATION'] = df['YEAR'].astype(str) + '-' + evaluation_label
+
+    # Normalize emails once here, the shared frame is not modified afterwards
+    df['DIRECT_MANAGER_EMAIL'] = df['DIRECT_MANAGER_EMAIL'].str.lower().str.strip()
+    df['EMAIL_ADDRESS'] = df['EMAIL_ADDRESS'].str.lower().str.strip()
+    return df
+
+
+def load_data_snowflake(table_id, client, scope=None, modified_since=None):
+    """
+    Read the source table into a Pandas DataFrame through the storage backend.
+
+    When scope (manager email) is given, the hierarchy filter runs in the database and only
+    the manager's subtree is transferred. When modified_since is given, only rows modified
+    or locked at or after it are read.
+    """
     try:
-        # Get Snowflake session
-        session = get_snowflake_session(client)
-        session.write_pandas(df=df, table_name=table_name, auto_create_table=auto_create_table, overwrite=overwrite).collect()
-        client.create_event(message='Streamlit App Snowflake Write Table', event_type='keboola_data_app_snowflake_write_table', event_data=f'table_id: {table_name}')
+        df = get_storage_backend(client).load_rows(table_id, SOURCE_COLUMNS, scope=scope, modified_since=modified_since)
+        return prepare_source_frame(df)
+
     except Exception as e:
-        st.error(f"Failed to execute a query: {e}")
+        st.error(f"Failed to load data: {e}")
+        st.stop()
 
 
 def map_json_to_snowflake_type(json_type):
@@ -105,130 +371,418 @@ def map_json_to_snowflake_type(json_type):
         raise ValueError(f"Unsupported JSON type: {json_type}")
 
 
-def save_changed_rows_snowflake(df_original, changed_rows, debug, client, progress):
-    """Save only the changed rows with new values to a CSV file or Snowflake."""
-     
-    # Step 1: Standardize Primary Key Column Data Types
-    pk_columns = ['USER_ID', 'YEAR', 'EVALUATION']
-    for col in pk_columns:
-        df_original[col] = df_original[col].astype(str if col == 'USER_ID' else 'int32')
-        changed_rows[col] = changed_rows[col].astype(str if col == 'USER_ID' else 'int32')
-    
-    # Log who and when is changing the values
-    changed_rows['HIST_DATA_MODIFIED_BY'] = st.session_state['user_email']
-    changed_rows['HIST_DATA_MODIFIED_WHEN'] = datetime.now()
-    
-    # Step 2: Ensure Timestamp Columns Are Converted to String Format
-    timestamp_columns = ['LOCKED_TIMESTAMP', 'HIST_DATA_MODIFIED_WHEN', 'JOB_ENTRY_DATE', 'TM_DATE']
-    default_timestamp = "1970-01-01 00:00:00.000"
-    
-    for timestamp_col in timestamp_columns:
-        if timestamp_col in changed_rows.columns:
-            changed_rows[timestamp_col] = changed_rows[timestamp_col].fillna(default_timestamp).astype(str)
-        if timestamp_col in df_original.columns:
-            df_original[timestamp_col] = df_original[timestamp_col].fillna(default_timestamp).astype(str)
-
-    # Step 3: Merge DataFrames and Fill NaNs
-    # Merge changed_rows with df_original on PK columns
-    merged_df = pd.merge(
-        changed_rows,
-        df_original,
-        on=pk_columns,
-        how='left',
-        suffixes=('', '_orig')
+def timestamp_text(value):
+    """Render a timestamp as a string keeping its full precision, None for missing values."""
+    if pd.isnull(value):
+        return None
+    return pd.Timestamp(value).isoformat(sep=' ')
+
+
+def changed_mask(columns):
+    """Bit mask of the UPDATABLE_COLUMNS among columns, bit i standing for UPDATABLE_COLUMNS[i]."""
+    return sum(1 << bit for bit, column in enumerate(UPDATABLE_COLUMNS) if column in columns)
+
+
+def build_merge_query(table_id, column_types):
+    """
+    Build a MERGE that updates rows bound as one JSON array parameter.
+
+    Every row carries CHANGED_MASK and only the columns whose bit is set are written, the
+    others keep the target value. Locking a row stamps LOCKED_TIMESTAMP unless it already has one.
+    Rows with CHECK_VERSION set are written only while the stored HIST_DATA_MODIFIED_WHEN still
+    equals their EXPECTED_MODIFIED_WHEN, so a row changed by someone else in the meantime is skipped.
+    """
+    source_columns = PK_COLUMNS + UPDATABLE_COLUMNS
+    select_list = ',\n                   '.join(
+        [f'value:"{column}"::{map_json_to_snowflake_type(column_types[column])} AS "{column}"' for column in source_columns]
+        + ['value:"CHANGED_MASK"::NUMBER(38,0) AS "CHANGED_MASK"',
+           'value:"EXPECTED_MODIFIED_WHEN"::TIMESTAMP_NTZ(9) AS "EXPECTED_MODIFIED_WHEN"',
+           'value:"CHECK_VERSION"::BOOLEAN AS "CHECK_VERSION"']
     )
-    #'VYKON_SYSTEM', 'HODNOTY_SYSTEM'
-    columns_to_update = ['HODNOTY', 'VYKON', 'POTENCIAL', 'POZNAMKY', 'NASTUPCE', 'PRAVDEPODOBNOST_ODCHODU', 
-                         'IS_LOCKED', 'MOZNY_KARIERNI_POSUN', 'LOCKED_TIMESTAMP', 'HIST_DATA_MODIFIED_BY', 
-                         'HIST_DATA_MODIFIED_WHEN']
-
-    # For each column, fill NaNs in changed_rows with values from df_original
-    for col in columns_to_update:
-        if col in merged_df.columns and col + '_orig' in merged_df.columns:
-            merged_df[col] = merged_df[col].fillna(merged_df[col + '_orig'])
-    
-    # Drop the original columns with '_orig' suffix
-    cols_to_drop = [col for col in merged_df.columns if col.endswith('_orig')]
-    merged_df.drop(columns=cols_to_drop, inplace=True)
-
-    # Now, merged_df contains the updated rows with NaNs filled
-    df_updated = merged_df.copy()
-
-    # Step 4: Ensure Numeric Columns Are Properly Formatted
-    for col in ['IS_LOCKED', 'HODNOTY', 'VYKON']: #'VYKON_SYSTEM', 'HODNOTY_SYSTEM'
-        if col in df_updated.columns:
-            df_updated[col] = pd.to_numeric(df_updated[col], errors='coerce').fillna(0).astype(int)
-
-    # Step 5: Apply Conditional Logic to Update LOCKED_TIMESTAMP
-    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]  # Format with milliseconds
-    df_updated.loc[(df_updated['IS_LOCKED'] == 1) & 
-                   ((df_updated['LOCKED_TIMESTAMP'] == '') | 
-                    (df_updated['LOCKED_TIMESTAMP'] == "1970-01-01 00:00:00") | 
-                    (df_updated['LOCKED_TIMESTAMP'] == "1970-01-01 00:00:00.000000") |
-                    (df_updated['LOCKED_TIMESTAMP'] == default_timestamp)), 
-                   'LOCKED_TIMESTAMP'] = current_time
-    
-    # Step 6: Align with Expected Schema and Convert Datetimes to Strings
+
+    def is_changed(column):
+        return f'BITAND(source."CHANGED_MASK", {changed_mask([column])}) <> 0'
+
+    set_list = []
+    for column in UPDATABLE_COLUMNS:
+        value = f'IFF({is_changed(column)}, source."{column}", target."{column}")'
+        if column == 'LOCKED_TIMESTAMP':
+            locking = (f'{is_changed("IS_LOCKED")} AND source."IS_LOCKED" = 1 '
+                       f'AND (target."LOCKED_TIMESTAMP" IS NULL OR target."LOCKED_TIMESTAMP" <= \'{DEFAULT_TIMESTAMP}\')')
+            value = f'IFF({locking}, source."HIST_DATA_MODIFIED_WHEN", {value})'
+        set_list.append(f'target."{column}" = {value}')
+
+    return f"""
+        MERGE INTO "{table_id}" AS target
+        USING (
+            SELECT {select_list}
+            FROM TABLE(FLATTEN(INPUT => PARSE_JSON(?)))
+        ) AS source
+        ON {' AND '.join(f'target."{column}" = source."{column}"' for column in PK_COLUMNS)}
+        WHEN MATCHED AND (NOT COALESCE(source."CHECK_VERSION", FALSE)
+                          OR target."HIST_DATA_MODIFIED_WHEN" IS NOT DISTINCT FROM source."EXPECTED_MODIFIED_WHEN")
+            THEN UPDATE SET {', '.join(set_list)}
+    """
+
+
+def merge_rows_snowflake(session, table_id, rows, column_types):
+    """
+    Write the changed cells of existing rows in a single MERGE statement.
+
+    rows holds the key columns, CHANGED_MASK, the changed UPDATABLE_COLUMNS and optionally
+    EXPECTED_MODIFIED_WHEN and CHECK_VERSION; only these are sent, as one JSON parameter, so a
+    save is one round trip and one transaction. Uses no Streamlit state and can run outside a
+    script run. Returns the number of updated rows.
+    """
+    if rows.empty:
+        return 0
+    columns = (PK_COLUMNS + [column for column in UPDATABLE_COLUMNS if column in rows.columns] + ['CHANGED_MASK']
+               + [column for column in ['EXPECTED_MODIFIED_WHEN', 'CHECK_VERSION'] if column in rows.columns])
+    payload = rows[columns].to_json(orient='records')
+    result = session.sql(build_merge_query(table_id, column_types), params=[payload]).collect()
+    return int(result[0][0]) if result else 0
+
+
+def build_key_source():
+    """Subquery reading primary keys from a JSON array bound as one parameter."""
+    key_list = ', '.join(
+        f'value:"{column}"::{"VARCHAR" if column == "USER_ID" else "NUMBER(38,0)"} AS "{column}"' for column in PK_COLUMNS
+    )
+    return f'(SELECT {key_list} FROM TABLE(FLATTEN(INPUT => PARSE_JSON(?))))'
+
+
+def find_conflicts_snowflake(session, table_id, rows, stamp):
+    """
+    Return the keys of rows that a MERGE stamped with stamp left unwritten.
+
+    Every row the MERGE updated carries the stamp in HIST_DATA_MODIFIED_WHEN, so the rows of
+    the batch with another value failed the version check.
+    """
+    query = f"""
+        SELECT {', '.join(f'target."{column}"' for column in PK_COLUMNS)}
+        FROM "{table_id}" AS target
+        JOIN {build_key_source()} AS source
+        ON {' AND '.join(f'target."{column}" = source."{column}"' for column in PK_COLUMNS)}
+        WHERE target."HIST_DATA_MODIFIED_WHEN" IS DISTINCT FROM ?::TIMESTAMP_NTZ(9)
+    """
+    result = session.sql(query, params=[rows[PK_COLUMNS].to_json(orient='records'), stamp]).collect()
+    return [row_key(*row) for row in result]
+
+
+def lock_rows_snowflake(session, table_id, keys, user_email, stamp):
+    """
+    Lock rows given by their keys in a single UPDATE; only the keys are sent.
+
+    LOCKED_TIMESTAMP is set to stamp unless the row already has one, rows that are
+    already locked are left untouched. Returns the number of locked rows.
+    """
+    if keys.empty:
+        return 0
+    query = f"""
+        UPDATE "{table_id}" AS target
+        SET "IS_LOCKED" = 1,
+            "LOCKED_TIMESTAMP" = IFF(target."LOCKED_TIMESTAMP" IS NULL OR target."LOCKED_TIMESTAMP" <= '{DEFAULT_TIMESTAMP}',
+                                     ?::TIMESTAMP_NTZ(9), target."LOCKED_TIMESTAMP"),
+            "HIST_DATA_MODIFIED_BY" = ?,
+            "HIST_DATA_MODIFIED_WHEN" = ?::TIMESTAMP_NTZ(9)
+        FROM {build_key_source()} AS source
+        WHERE {' AND '.join(f'target."{column}" = source."{column}"' for column in PK_COLUMNS)}
+          AND COALESCE(target."IS_LOCKED", 0) <> 1
+    """
+    result = session.sql(query, params=[stamp, user_email, stamp, keys[PK_COLUMNS].to_json(orient='records')]).collect()
+    return int(result[0][0]) if result else 0
+
+
+def lock_frame(rows, user_email, stamp):
+    """Return the rows that are not locked yet, locked by the rule of lock_rows_snowflake."""
+    rows = rows[pd.to_numeric(rows['IS_LOCKED'], errors='coerce').fillna(0) != 1].copy()
+    locked_at = pd.to_datetime(rows['LOCKED_TIMESTAMP'], errors='coerce')
+    rows['IS_LOCKED'] = 1
+    rows['LOCKED_TIMESTAMP'] = locked_at.where(locked_at > pd.Timestamp(DEFAULT_TIMESTAMP), pd.Timestamp(stamp))
+    rows['HIST_DATA_MODIFIED_BY'] = user_email
+    rows['HIST_DATA_MODIFIED_WHEN'] = pd.Timestamp(stamp)
+    return rows
+
+
+@st.cache_data(show_spinner=False)
+def load_expected_schema():
+    """Load column types of the source table from static/expected_schema.json."""
     file_path = os.path.join(os.path.dirname(__file__), './static/expected_schema.json')
     with open(file_path, 'r', encoding='utf-8') as file: 
-        expected_schema = json.load(file)  
-    
-    for col, dtype in expected_schema.items():
-        if col not in df_updated.columns:
-            df_updated[col] = default_timestamp if 'datetime' in dtype else ('' if dtype == 'str' else 0)
-        else:
-            if dtype == 'str':
-                df_updated[col] = df_updated[col].astype(str)
-            elif 'int' in dtype:
-                df_updated[col] = pd.to_numeric(df_updated[col], errors='coerce').fillna(0).astype('int')
-            elif 'datetime' in dtype:
-                df_updated[col] = pd.to_datetime(df_updated[col], errors='coerce').fillna(default_timestamp).astype(str)
-
-    df_updated = df_updated.drop(columns=['YEAR_EVALUATION'])
+        return json.load(file)
+
+
+def prepare_changed_rows(changed_rows, user_email):
+    """
+    Prepare changed rows for writing.
+
+    changed_rows holds the key columns and the changed columns; CHANGED_MASK (see changed_mask)
+    tells which cells of a row changed. Without it, every non-null value counts as changed.
+    A changed cell that is missing is written as NULL.
+    Rows with CHECK_VERSION set are written only if nobody changed them since
+    EXPECTED_MODIFIED_WHEN; other rows are written unconditionally.
+    """
+    rows = changed_rows.copy()
+    for column in PK_COLUMNS:
+        rows[column] = rows[column].astype(str if column == 'USER_ID' else 'int32')
+    if 'CHANGED_MASK' not in rows.columns:
+        rows['CHANGED_MASK'] = 0
+        for column in UPDATABLE_COLUMNS:
+            if column in rows.columns:
+                rows['CHANGED_MASK'] |= rows[column].notna() * changed_mask([column])
     
-    # Step 7: Save Data
-    if debug:
-        file_path = os.path.join(os.path.dirname(__file__), 'data', 'in', 'tables', 'anonymized_data.csv')
-        df_anonymized = pd.read_csv(file_path)
-        df_anonymized.set_index(pk_columns, inplace=True)
-        df_updated.set_index(pk_columns, inplace=True)
-        df_anonymized.update(df_updated)
-        df_anonymized.reset_index(inplace=True)
-        df_anonymized.to_csv(file_path, index=False)
+    # Log who and when is changing the values
+    rows['HIST_DATA_MODIFIED_BY'] = user_email
+    rows['HIST_DATA_MODIFIED_WHEN'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
+    rows['CHANGED_MASK'] |= changed_mask(['HIST_DATA_MODIFIED_BY', 'HIST_DATA_MODIFIED_WHEN'])
+
+    # Ensure numeric columns are properly formatted, only changed cells are written; a cleared
+    # value stays missing so that it is stored as NULL rather than as a rating of 0
+    for column in ['IS_LOCKED', 'HODNOTY', 'VYKON']:
+        if column in rows.columns:
+            rows[column] = pd.to_numeric(rows[column], errors='coerce').round().astype('Int64')
+    if 'CHECK_VERSION' in rows.columns:
+        rows['CHECK_VERSION'] = rows['CHECK_VERSION'].fillna(False).astype(bool)
+        rows['EXPECTED_MODIFIED_WHEN'] = rows['EXPECTED_MODIFIED_WHEN'].map(timestamp_text)
     else:
-        table_name = st.secrets["WORKSPACE_SOURCE_TABLE_ID"]
-        temp_table_name = f"TEMP_STAGING_{st.session_state['user_email'].replace('@', '_').replace('.', '_')}_{uuid.uuid4().hex}"
-        
-        create_temp_table_sql = f"CREATE OR REPLACE TRANSIENT TABLE \"{temp_table_name}\" (\n"
-        columns = [f'"{col}" {map_json_to_snowflake_type(dtype)}' for col, dtype in expected_schema.items()]
-        create_temp_table_sql += ",\n".join(columns) + "\n);"
-        
-        progress.progress(50, text="**Probíhá zápis změn...**")
-        execute_query_snowflake(create_temp_table_sql, client=client)
-        write_data_snowflake(df_updated, temp_table_name, auto_create_table=False, overwrite=False, client=client)
-
-        update_sql = f"""
-            UPDATE "{table_name}" AS target
-            SET { ', '.join([f'target."{col}" = source."{col}"' for col in columns_to_update]) }
-            FROM "{temp_table_name}" AS source
-            WHERE { ' AND '.join([f'target."{col}" = source."{col}"' for col in pk_columns]) };
-        """
-        drop_temp_table_sql = f'DROP TABLE IF EXISTS "{temp_table_name}";'
-        progress.progress(60, text="**Ukládám...**")
-        execute_query_snowflake(update_sql, client=client)
-        execute_query_snowflake(drop_temp_table_sql, client=client)
-
-    # Clear tracked changes
-    st.session_state['changed_rows'] = pd.DataFrame()
-    st.session_state['unsaved_warning_displayed'] = False
-    
-    read_data_snowflake(st.secrets["WORKSPACE_SOURCE_TABLE_ID"], client)
+        rows['CHECK_VERSION'] = False
+        rows['EXPECTED_MODIFIED_WHEN'] = None
+    for column in rows.columns:
+        if pd.api.types.is_datetime64_any_dtype(rows[column]):
+            rows[column] = rows[column].map(timestamp_text)
+    return rows
 
-    pk_columns = ['USER_ID', 'YEAR', 'EVALUATION']
-    st.session_state['df_original'] = st.session_state['df'].set_index(pk_columns).copy()
-    st.session_state['df_last_saved'] = st.session_state['df_original'].copy()
-    
-    st.success("Změny uloženy, aplikace bude obnovena.")
-    return df_updated
 
+def lock_shared_rows(table_id, scope, keys, user_email, stamp):
+    """Apply locked rows to the shared dataset (see SharedDataset.upsert) instead of reading them back."""
+    dataset = get_shared_dataset(table_id, scope)
+    with dataset.lock:
+        if dataset.df is None:
+            return
+        positions = [dataset.key_positions[key] for key in map(row_key, keys['USER_ID'], keys['YEAR'], keys['EVALUATION'])
+                     if key in dataset.key_positions]
+        columns = PK_COLUMNS + ['IS_LOCKED', 'LOCKED_TIMESTAMP', 'HIST_DATA_MODIFIED_BY', 'HIST_DATA_MODIFIED_WHEN']
+        locked = lock_frame(dataset.df.iloc[positions][columns], user_email, stamp)
+        if not locked.empty:
+            dataset.upsert(locked, advance_watermark=False)
+
+        st.session_state['df'] = dataset.df
+        st.session_state['df_version'] = dataset.version
+        st.session_state['df_scope'] = scope
+
+
+@st.cache_resource
+def get_write_executor():
+    """Per-process pool running database writes outside of script runs."""
+    return ThreadPoolExecutor(max_workers=WRITE_WORKERS, thread_name_prefix='snowflake_write')
+
+
+class WriteCoordinator:
+    """
+    Group commit of row writes from all sessions of the process.
+
+    Requests arriving within BATCH_WINDOW seconds of the first one are written by one merge
+    of the storage backend on a dedicated thread. A key can appear only once in a MERGE source,
+    so a request touching a key that is already in the batch waits for the next round.
+    Every batch gets its own HIST_DATA_MODIFIED_WHEN, which tells the rows it wrote from the
+    rows skipped on a version conflict. Each request gets a Future resolved with its number of
+    written rows, the keys of its conflicting rows and the stamp of the batch, or with the error.
+    """
+
+    def __init__(self, table_id, column_types, backend):
+        self.table_id = table_id
+        self.column_types = column_types
+        self.backend = backend
+        self._last_stamp = None
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='snowflake_write_coordinator', daemon=True)
+        self._thread.start()
+
+    def submit(self, rows):
+        """Queue prepared rows (see prepare_changed_rows) for the next batch."""
+        future = Future()
+        self._requests.put((rows, future))
+        return future
+
+    def _run(self):
+        pending = []
+        while True:
+            if not pending:
+                pending.append(self._requests.get())
+            deadline = time.monotonic() + BATCH_WINDOW
+            while (remaining := deadline - time.monotonic()) > 0:
+                try:
+                    pending.append(self._requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            batch, pending = self._take_batch(pending)
+            self._commit(batch)
+
+    @staticmethod
+    def _take_batch(pending):
+        """Split requests into a batch with unique keys and the requests deferred to the next round."""
+        batch, deferred, batch_keys = [], [], set()
+        for rows, future in pending:
+            keys = set(zip(*(rows[column] for column in PK_COLUMNS)))
+            if keys & batch_keys:
+                deferred.append((rows, future))
+            else:
+                batch.append((rows, future))
+                batch_keys |= keys
+        return batch, deferred
+
+    def _next_stamp(self):
+        """Modification time of a batch, unique among the batches of this coordinator."""
+        stamp = datetime.now()
+        if self._last_stamp is not None and stamp <= self._last_stamp:
+            stamp = self._last_stamp + timedelta(microseconds=1)
+        self._last_stamp = stamp
+        return timestamp_text(stamp)
+
+    def _commit(self, batch):
+        try:
+            rows = pd.concat([rows for rows, _ in batch], ignore_index=True)
+            stamp = self._next_stamp()
+            rows['HIST_DATA_MODIFIED_WHEN'] = stamp
+            updated_rows = self.backend.merge_rows(self.table_id, rows, self.column_types)
+            conflicts = set()
+            if updated_rows < len(rows):
+                conflicts = set(self.backend.find_conflicts(self.table_id, rows, stamp))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for rows, future in batch:
+            keys = [row_key(*key) for key in zip(*(rows[column] for column in PK_COLUMNS))]
+            conflicting = [key for key in keys if key in conflicts]
+            future.set_result({'rows': len(keys) - len(conflicting), 'conflicts': conflicting, 'stamp': stamp})
+
+
+@st.cache_resource
+def get_write_coordinator(table_id, _column_types, _backend):
+    """Return the process-wide write coordinator for the table."""
+    return WriteCoordinator(table_id, _column_types, _backend)
+
+
+def track_write_job(label, kind, future, restore=None, event=None):
+    """
+    Track a background write in session_state['save_jobs'].
+
+    kind tells finish_write_job what to reload after a commit ('data', 'lock' or 'filters');
+    restore holds edits and row versions (see ChangeBuffer.changes and ChangeBuffer.versions)
+    that go back to the change buffer when the write fails. event is the (message, event_type,
+    event_data) recorded once the write commits, together with the user submitting it.
+    """
+    job = {
+        'label': label,
+        'kind': kind,
+        'future': future,
+        'restore': restore,
+        'event': event,
+        'user_email': st.session_state['user_email'],
+        'state': 'pending',
+    }
+    st.session_state['save_jobs'].append(job)
+    return job
+
+
+def submit_write(label, kind, function, *args, restore=None, event=None, **kwargs):
+    """Run a write on the write pool and track it; the function must not use Streamlit state."""
+    return track_write_job(label, kind, get_write_executor().submit(function, *args, **kwargs), restore=restore, event=event)
+
+
+def submit_changed_rows(changed_rows, client, label, restore=None):
+    """
+    Queue a save of changed rows (see prepare_changed_rows) without waiting for it.
+
+    Writes go through the process-wide WriteCoordinator, so saves of concurrent
+    sessions share one merge. The rows stay marked in the change buffer until the save
+    finishes (see ChangeBuffer.start_save).
+    """
+    rows = prepare_changed_rows(changed_rows, st.session_state['user_email'])
+    table_id = st.secrets["WORKSPACE_SOURCE_TABLE_ID"]
+    coordinator = get_write_coordinator(table_id, load_expected_schema(), get_storage_backend(client))
+    event = ('Streamlit App Snowflake Merge', 'keboola_data_app_snowflake_merge', f'table_id: {table_id}')
+    job = track_write_job(label, 'data', coordinator.submit(rows), restore=restore, event=event)
+    job['keys'] = [row_key(*key) for key in zip(*(rows[column] for column in PK_COLUMNS))]
+    st.session_state['change_buffer'].start_save(job['keys'])
+    return job
+
+
+def submit_lock(keys, client, label):
+    """
+    Queue locking of the rows given by their primary keys without waiting for it.
+
+    The lock is one set-based UPDATE; after it commits, the rows are patched in the shared
+    dataset (see lock_shared_rows).
+    """
+    keys = keys[PK_COLUMNS].dropna().drop_duplicates()
+    keys = keys.astype({column: str if column == 'USER_ID' else 'int64' for column in PK_COLUMNS})
+    user_email = st.session_state['user_email']
+    stamp = timestamp_text(datetime.now())
+    table_id = st.secrets["WORKSPACE_SOURCE_TABLE_ID"]
+    event = ('Streamlit App Snowflake Lock', 'keboola_data_app_snowflake_lock', f'table_id: {table_id}')
+    job = submit_write(label, 'lock', get_storage_backend(client).lock_rows, table_id, keys, user_email, stamp, event=event)
+    job['lock'] = (keys, user_email, stamp)
+    return job
+
+
+def record_write_event(job, client, written_rows=None):
+    """
+    Record the event of a committed write job in Keboola.
+
+    Runs on the script run of the session that submitted the job, never on a write worker,
+    and names the submitting user explicitly, as a batch may hold writes of several users.
+    """
+    if job.get('event') is None:
+        return
+    message, event_type, event_data = job['event']
+    event_data = f"{event_data}, user: {job['user_email']}"
+    if written_rows is not None:
+        event_data = f"{event_data}, rows: {written_rows}"
+    get_storage_backend(client).record_event(message, event_type, event_data)
+
+
+def finish_write_job(job, client):
+    """
+    Record the outcome of a finished write job.
+
+    Committed data writes refresh the shared dataset and hand the stamp of the written rows
+    to the change buffer (see ChangeBuffer.finish_save), failed ones put their edits back
+    into the change buffer. Rows skipped because someone else changed them in the meantime
+    are listed in job['conflicts'] and reported with their keys. Returns the message to show
+    to the user.
+    """
+    change_buffer = st.session_state['change_buffer']
+    try:
+        result = job['future'].result()
+    except Exception as e:
+        job['state'] = 'failed'
+        change_buffer.finish_save(job.get('keys', ()))
+        if job['restore']:
+            changes, versions = job['restore']
+            change_buffer.merge(changes, overwrite=False, versions=versions)
+        return 'error', f"{job['label']}: ukládání selhalo. Kontaktujte prosím administrátora: {e}"
 
+    job['state'] = 'committed'
+    record_write_event(job, client, result['rows'] if job['kind'] == 'data' else result)
+    if job['kind'] == 'data':
+        conflicts = set(result['conflicts'])
+        change_buffer.finish_save([key for key in job['keys'] if key not in conflicts], result['stamp'])
+        change_buffer.finish_save(result['conflicts'])
+        # Fetch only the rows changed since the last refresh, which include the conflicting
+        # rows in the version another user saved, into the shared dataset
+        refresh_data_snowflake(st.secrets["WORKSPACE_SOURCE_TABLE_ID"], client, scope=st.session_state.get('df_scope'))
+        job['conflicts'] = result['conflicts']
+        if job['conflicts']:
+            keys = ', '.join(f"{user_id} ({year}/{evaluation})" for user_id, year, evaluation in job['conflicts'][:10])
+            more = f" a další ({len(job['conflicts']) - 10})" if len(job['conflicts']) > 10 else ""
+            return 'warning', (f"{job['label']}: uloženo {result['rows']} záznamů. Záznamy {keys}{more} mezitím upravil "
+                               f"jiný uživatel, vaše změny u nich nebyly uloženy a zobrazují se aktuální hodnoty.")
+    elif job['kind'] == 'lock':
+        lock_shared_rows(st.secrets["WORKSPACE_SOURCE_TABLE_ID"], st.session_state.get('df_scope'), *job['lock'])
+        return 'success', f"{job['label']}: uzamčeno {result} záznamů."
+    elif job['kind'] == 'filters':
+        # Saved filters are loaded again on the next run
+        st.session_state['user_filters'] = None
+    return 'success', f"{job['label']}: uloženo."
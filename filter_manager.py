@@ -1,10 +1,25 @@
+import numpy as np
 import pandas as pd
 import streamlit as st
 
-import time
+import hashlib
 import json
+import threading
 
-from data_manager_snowflake import get_snowflake_session, execute_query_snowflake
+from collections import OrderedDict
+
+from data_manager_snowflake import LatestVersionCache, submit_write
+from storage_manager import get_storage_backend
+
+
+# Low-cardinality columns that get row-id postings for instant set filtering
+INDEXED_COLUMNS = ['YEAR_EVALUATION', 'DIRECT_MANAGER_EMAIL', 'JOB_TITLE_CZ', 'TEAM_CODE',
+                   'L2_ORGANIZATION_UNIT_NAME_CZ', 'L3_ORGANIZATION_UNIT_NAME_CZ', 'L4_ORGANIZATION_UNIT_NAME_CZ',
+                   'L2_HEAD_OF_UNIT_FULL_NAME', 'L3_HEAD_OF_UNIT_FULL_NAME', 'L4_HEAD_OF_UNIT_FULL_NAME']
+
+# Bounds of the filter result cache, shared by all sessions of the process
+FILTER_CACHE_MAX_BYTES = 64 * 1024 * 1024
+FILTER_CACHE_MAX_ENTRIES = 1024
 
 
 @st.dialog("Potvrdit uložení filtru")
@@ -16,19 +31,17 @@ def save_filter_dialog_snowflake(filter_model, client):
     - filter_model (dict): The filter model configuration to save.
 
     Saves the filter model to Snowflake after user confirmation. Allows the user 
-    to input a filter name and displays a progress bar during the save process.
-    Updates session state and reloads available filters after saving.
+    to input a filter name. The save runs in the background and available filters
+    are reloaded once it is committed.
     """
     st.session_state['filter_name'] = st.text_input(label="Název filtru", value=st.session_state['filter_name'])
     st.session_state['show_filter_name_input'] = False
     if st.button('Potvrdit uložení filtru', use_container_width=True, type='primary'):
         if st.session_state['filter_name']:
-            progress_bar = st.progress(0)
             save_success = save_current_filters_snowflake(
                 st.session_state['user_email'], 
                 st.session_state['filter_name'], 
                 filter_model, 
-                progress_bar, 
                 client
             )
             if save_success:
@@ -43,7 +56,7 @@ def save_filter_dialog_snowflake(filter_model, client):
 
 def load_saved_filters_snowflake(user_email, client):
     """
-    Load saved filters from Snowflake for a specific user.
+    Load saved filters of a specific user from the storage backend.
 
     Parameters:
     - user_email (str): The email of the user whose filters to load.
@@ -51,21 +64,13 @@ def load_saved_filters_snowflake(user_email, client):
     Returns:
     - tuple: A tuple containing a DataFrame of user-specific filters and a list of filter names.
     
-    Retrieves saved filters from Snowflake filtered by the provided user email. 
+    Retrieves saved filters filtered by the provided user email. 
     Returns empty results if an error occurs.
     """
     try:
-        # Get the reusable Snowflake session
-        session = get_snowflake_session(client)
-        
         with st.spinner("Načítám uložené filtry..."):
-            # Load filter table from Keboola
-            table_id = st.secrets["WORKSPACE_FILTER_TABLE_ID"]
-            filters_df = session.table(table_id).to_pandas()
-            client.create_event(message='Streamlit App Snowflake Read Table', event_type='keboola_data_app_snowflake_read_table', event_data=f'table_id: {table_id}')
-        
-        # Filter only for the current user’s filters
-        user_filters = filters_df[filters_df['FILTER_CREATOR'] == user_email]
+            # Only the current user’s filters are read
+            user_filters = get_storage_backend(client).load_filters(st.secrets["WORKSPACE_FILTER_TABLE_ID"], user_email)
         filter_names = user_filters['FILTER_NAME'].tolist()
     except:
         # Return empty results if any error occurs
@@ -74,7 +79,7 @@ def load_saved_filters_snowflake(user_email, client):
     return user_filters, filter_names
 
 
-def save_current_filters_snowflake(user_email, filter_name, current_filter_model, progress_bar=None, client=None):
+def save_current_filters_snowflake(user_email, filter_name, current_filter_model, client=None):
     """
     Save the current filter model to Snowflake, including user and filter metadata.
 
@@ -82,79 +87,390 @@ def save_current_filters_snowflake(user_email, filter_name, current_filter_model
     - user_email (str): The email of the user saving the filter.
     - filter_name (str): The name for the saved filter.
     - current_filter_model (dict): JSON-serializable filter model.
-    - progress_bar (st.progress, optional): Optional progress bar for user feedback.
 
     Side Effects:
-    - Executes a Snowflake MERGE statement to update or insert the filter, then reloads 
-      filters into session state. Displays progress updates if a progress bar is provided.
+    - Queues an update or insert of the filter (StorageBackend.save_filter) on the write
+      pool; filters are reloaded into session state once it is committed.
     """
     # Serialize the filter model to JSON format
     filter_model_json = json.dumps(current_filter_model)
-    if progress_bar:
-        progress_bar.progress(25)
     
-    # Write the filter incrementally to the database using Snowpark
     try:
-        # Target table name
         table_id = st.secrets["WORKSPACE_FILTER_TABLE_ID"]
-        
-        # Execute the MERGE statement to update or insert
-        merge_query = f"""
-            MERGE INTO {table_id} AS target
-            USING (SELECT '{filter_name}' AS FILTER_NAME, '{user_email}' AS FILTER_CREATOR, '{filter_model_json}' AS FILTERED_VALUES) AS source
-            ON target.FILTER_NAME = source.FILTER_NAME AND target.FILTER_CREATOR = source.FILTER_CREATOR
-            WHEN MATCHED THEN UPDATE SET target.FILTERED_VALUES = source.FILTERED_VALUES
-            WHEN NOT MATCHED THEN INSERT (FILTER_NAME, FILTER_CREATOR, FILTERED_VALUES)
-            VALUES (source.FILTER_NAME, source.FILTER_CREATOR, source.FILTERED_VALUES)
-        """
-        execute_query_snowflake(merge_query, client)
-        
-        if progress_bar:
-            progress_bar.progress(75)
-
+        event = ('Streamlit App Snowflake Query', 'keboola_data_app_snowflake_query', f'table_id: {table_id}, filter: {filter_name}')
+        submit_write(f"Filtr {filter_name}", 'filters', get_storage_backend(client).save_filter,
+                     table_id, user_email, filter_name, filter_model_json, event=event)
     except Exception as e:
         # Handle error without breaking the app
-        error_message = f"Ukládání filtru selhalo: {str(e)}"
-        st.error(error_message)
-        
-        # Ensure progress bar is cleared to avoid UI locking
-        if progress_bar:
-            progress_bar.empty()
-        
-        # Safely return to allow app to continue running
+        st.error(f"Ukládání filtru selhalo: {str(e)}")
         return False  # Indicates failure
 
-    # Step 4: Complete the progress bar and reload filters
-    if progress_bar:
-        progress_bar.progress(100)
-    st.success("Filtr úspěšně uložen.")
-    time.sleep(2)
-
-    # Reload filters after saving
-    try:
-        st.session_state['user_filters'], st.session_state['filter_names'] = load_saved_filters_snowflake(user_email, client)
-    except Exception as reload_error:
-        st.warning(f"Chyba při načítání uložených filtrů: {str(reload_error)}")
-    
     return True  # Indicates success
 
 
-def apply_filter(df, filter_model):
+def _blank_mask(series):
+    """Rows AG Grid treats as blank: missing values and empty or whitespace-only text."""
+    return (series.isna() | (series.astype(str).str.strip() == '')).to_numpy()
+
+
+def _key_strings(series):
+    """Format cell values the way the AG Grid set filter keys them (integral floats without '.0')."""
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        numbers = series.astype('float64')
+        integral = numbers.notna() & (numbers % 1 == 0)
+        keys = numbers.astype(str)
+        keys[integral] = numbers[integral].astype('int64').astype(str)
+        return keys.where(numbers.notna(), None)
+    return series.astype(str).where(series.notna(), None)
+
+
+def _text_condition(series, condition):
+    condition_type = condition.get('type', 'contains')
+    if condition_type == 'blank':
+        return _blank_mask(series)
+    if condition_type == 'notBlank':
+        return ~_blank_mask(series)
+
+    # Text filters are case-insensitive by default
+    text = series.astype(str).str.lower()
+    value = str(condition.get('filter', '') or '').lower()
+    is_null = series.isna().to_numpy()
+    if condition_type == 'equals':
+        mask = (text == value).to_numpy()
+    elif condition_type == 'notEqual':
+        return ((text != value).to_numpy() & ~is_null) | is_null
+    elif condition_type == 'contains':
+        mask = text.str.contains(value, regex=False).to_numpy()
+    elif condition_type == 'notContains':
+        return (~text.str.contains(value, regex=False).to_numpy() & ~is_null) | is_null
+    elif condition_type == 'startsWith':
+        mask = text.str.startswith(value).to_numpy()
+    elif condition_type == 'endsWith':
+        mask = text.str.endswith(value).to_numpy()
+    else:
+        return np.ones(len(series), dtype=bool)
+    return mask & ~is_null
+
+
+def _scalar_condition(values, value_from, value_to, condition_type, blank):
+    """Compare numeric or datetime values; blank cells only pass the 'blank' condition."""
+    if condition_type == 'blank':
+        return blank
+    if condition_type == 'notBlank':
+        return ~blank
+
+    if condition_type == 'equals':
+        mask = values == value_from
+    elif condition_type == 'notEqual':
+        mask = values != value_from
+    elif condition_type == 'lessThan':
+        mask = values < value_from
+    elif condition_type == 'lessThanOrEqual':
+        mask = values <= value_from
+    elif condition_type == 'greaterThan':
+        mask = values > value_from
+    elif condition_type == 'greaterThanOrEqual':
+        mask = values >= value_from
+    elif condition_type == 'inRange':
+        # Range bounds are exclusive, as in AG Grid defaults
+        mask = (values > value_from) & (values < value_to)
+    else:
+        return np.ones(len(values), dtype=bool)
+    return np.asarray(mask, dtype=bool) & ~blank
+
+
+def _number_condition(series, condition):
+    values = pd.to_numeric(series, errors='coerce').to_numpy(dtype='float64')
+    value_from = pd.to_numeric(condition.get('filter'), errors='coerce')
+    value_to = pd.to_numeric(condition.get('filterTo'), errors='coerce')
+    return _scalar_condition(values, value_from, value_to, condition.get('type', 'equals'), np.isnan(values))
+
+
+def _date_condition(series, condition):
+    # Dates are compared by calendar day, like the AG Grid date filter
+    dates = pd.to_datetime(series, errors='coerce').dt.normalize()
+    date_from = pd.to_datetime(condition.get('dateFrom'), errors='coerce')
+    date_to = pd.to_datetime(condition.get('dateTo'), errors='coerce')
+    date_from = date_from.normalize() if pd.notnull(date_from) else date_from
+    date_to = date_to.normalize() if pd.notnull(date_to) else date_to
+    return _scalar_condition(dates.to_numpy(), date_from, date_to, condition.get('type', 'equals'), dates.isna().to_numpy())
+
+
+def _set_condition(series, filter_details):
+    values = filter_details.get('values') or []
+    keys = _key_strings(series)
+    mask = keys.isin([str(value) for value in values if value is not None]).to_numpy()
+    if any(value is None for value in values):
+        mask |= series.isna().to_numpy()
+    return mask
+
+
+_CONDITION_BUILDERS = {
+    'text': _text_condition,
+    'number': _number_condition,
+    'date': _date_condition,
+}
+
+# Keys holding the value and the upper bound of an inRange condition, by filter type
+_CONDITION_VALUE_KEYS = {
+    'text': ('filter', 'filterTo'),
+    'number': ('filter', 'filterTo'),
+    'date': ('dateFrom', 'dateTo'),
+}
+
+
+def _is_complete_condition(filter_type, condition):
+    """Whether a condition has the values its type needs; AG Grid ignores incomplete conditions."""
+    condition_type = condition.get('type')
+    if condition_type in ('blank', 'notBlank'):
+        return True
+    value_key, value_to_key = _CONDITION_VALUE_KEYS[filter_type]
+    keys = (value_key, value_to_key) if condition_type == 'inRange' else (value_key,)
+    return all(condition.get(key) not in (None, '') for key in keys)
+
+
+def _compile_column_filter(filter_details):
+    """Compile one column's filter model into a function returning a boolean array for a Series."""
+    filter_type = filter_details.get('filterType')
+
+    if filter_type == 'set':
+        return lambda series: _set_condition(series, filter_details)
+
+    if filter_type == 'multi':
+        # Multi filter: every active child filter has to pass, unsupported children are skipped
+        children = [_compile_column_filter(model) for model in filter_details.get('filterModels') or [] if model]
+        children = [child for child in children if child is not None]
+        if not children:
+            return None
+        return lambda series: np.logical_and.reduce([child(series) for child in children] + [np.ones(len(series), dtype=bool)])
+
+    build_condition = _CONDITION_BUILDERS.get(filter_type)
+    if build_condition is None:
+        return None
+
+    # Combined conditions come either as a list (AG Grid >= 29) or as condition1/condition2
+    if 'conditions' in filter_details:
+        conditions = filter_details['conditions']
+    elif 'condition1' in filter_details:
+        conditions = [c for c in (filter_details.get('condition1'), filter_details.get('condition2')) if c]
+    else:
+        conditions = [filter_details]
+    conditions = [condition for condition in conditions if _is_complete_condition(filter_type, condition)]
+    if not conditions:
+        return None
+    combine = np.logical_or if filter_details.get('operator', 'AND').upper() == 'OR' else np.logical_and
+
+    return lambda series: combine.reduce([build_condition(series, condition) for condition in conditions])
+
+
+def compile_filter_model(filter_model):
     """
-    Apply a filter to the provided DataFrame based on the specified filter model.
+    Translate an AG Grid filter model into column predicates.
+
+    Parameters:
+    - filter_model (dict): The AG Grid filterModel (text, number, date, set and multi
+      filters, including combined AND/OR conditions).
+
+    Returns:
+    - list: (column, predicate) pairs, where predicate maps a Series to a boolean array.
+      Filter types that are not supported, and conditions missing the values they need,
+      are skipped, as AG Grid does.
+    """
+    compiled = []
+    for filter_column, filter_details in (filter_model or {}).items():
+        predicate = _compile_column_filter(filter_details)
+        if predicate is not None:
+            compiled.append((filter_column, predicate))
+    return compiled
+
+
+def build_filter_mask(df, filter_model):
+    """
+    Evaluate a filter model over the DataFrame into a single boolean mask.
 
     Parameters:
     - df (pd.DataFrame): The DataFrame to filter.
     - filter_model (dict): The filter model defining column filters and their criteria.
 
     Returns:
-    - pd.DataFrame: A filtered DataFrame containing only rows matching the filter criteria.
-    """
-    # Iterate through each column in the filter model
-    for filter_column, filter_details in filter_model.items():
-        if filter_details['filterType'] == 'set':
-            filter_values = filter_details['values']
-            
-            # Apply the filter for each column using the values in the filter model
-            df = df[df[filter_column].isin(filter_values)]
-    return df
+    - np.ndarray: Boolean mask of rows matching every column filter.
+    """
+    mask = np.ones(len(df), dtype=bool)
+    for filter_column, predicate in compile_filter_model(filter_model):
+        if filter_column in df.columns:
+            mask &= predicate(df[filter_column])
+    return mask
+
+
+class ColumnIndex:
+    """
+    Sorted row-id postings for low-cardinality columns of one dataset version.
+
+    Values are keyed the same way as the AG Grid set filter, so a set filter or an equality
+    test resolves by concatenating postings instead of comparing strings over every row.
+    """
+
+    def __init__(self, df, columns):
+        self.row_count = len(df)
+        self._codes = {}
+        self._offsets = {}
+        self._rows = {}
+        for column in columns:
+            if column not in df.columns:
+                continue
+            # Code 0 is reserved for missing values
+            codes, uniques = pd.factorize(_key_strings(df[column]))
+            codes = codes + 1
+            self._codes[column] = {value: code for code, value in enumerate(uniques, start=1)}
+            self._codes[column][None] = 0
+            self._offsets[column] = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(uniques) + 1))])
+            self._rows[column] = np.argsort(codes, kind='stable').astype(np.int32)
+
+    def __contains__(self, column):
+        return column in self._codes
+
+    def rows(self, column, values):
+        """Sorted row positions where the column holds any of the values (None matches missing)."""
+        codes = {self._codes[column].get(None if value is None else str(value)) for value in values}
+        codes.discard(None)
+        offsets, rows = self._offsets[column], self._rows[column]
+        postings = [rows[offsets[code]:offsets[code + 1]] for code in codes]
+        if not postings:
+            return np.empty(0, dtype=np.int32)
+        return np.sort(np.concatenate(postings))
+
+    def mask(self, column, values):
+        """Boolean row mask where the column holds any of the values."""
+        mask = np.zeros(self.row_count, dtype=bool)
+        mask[self.rows(column, values)] = True
+        return mask
+
+
+@st.cache_resource
+def get_column_indexes():
+    """Column indexes shared across sessions, one for the newest dataset version of each scope."""
+    return LatestVersionCache(lambda df: ColumnIndex(df, INDEXED_COLUMNS))
+
+
+def get_column_index(df, dataset_version, scope=None):
+    """Return the categorical column index of the dataset version, built once and shared across sessions."""
+    return get_column_indexes().get(df, scope, dataset_version)
+
+
+def filter_rows(df, filter_model, column_index=None, mask=None):
+    """
+    Return row positions of the DataFrame that match the filter model.
+
+    Parameters:
+    - df (pd.DataFrame): The DataFrame to filter.
+    - filter_model (dict): The filter model defining column filters and their criteria.
+    - column_index (ColumnIndex, optional): Index built over the same DataFrame; set filters
+      on indexed columns are resolved from its postings.
+    - mask (np.ndarray, optional): Boolean mask of candidate rows to start from.
+
+    Returns:
+    - np.ndarray: Sorted row positions. Filters that cannot use the index are evaluated
+      only on rows that are still candidates after the indexed ones.
+    """
+    mask = np.ones(len(df), dtype=bool) if mask is None else mask.copy()
+    residual_model = {}
+    for filter_column, filter_details in (filter_model or {}).items():
+        if column_index is not None and filter_details.get('filterType') == 'set' and filter_column in column_index:
+            mask &= column_index.mask(filter_column, filter_details.get('values') or [])
+        else:
+            residual_model[filter_column] = filter_details
+
+    rows = np.flatnonzero(mask)
+    if residual_model and rows.size:
+        rows = rows[build_filter_mask(df.take(rows), residual_model)]
+    return rows
+
+
+def filter_model_hash(filter_model):
+    """Hash of a filter model that does not depend on the order of its keys."""
+    return hashlib.md5(json.dumps(filter_model or {}, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _read_only_rows(rows):
+    """Row positions as a read-only int32 array that sessions can share."""
+    rows = np.asarray(rows, dtype=np.int32)
+    rows.setflags(write=False)
+    return rows
+
+
+class FilterResultCache:
+    """
+    Row positions of filtered views, least recently used first out.
+
+    Entries are keyed by the dataset scope and version and by whatever else selects the
+    view (role, email, round, filter model hash, team toggle). Positions are read-only arrays,
+    so all sessions can share them. Once a newer version of a scope is seen, entries of its
+    older versions are dropped, and sessions still showing an older version compute without
+    the cache. The arrays are accounted by their nbytes and the least recently used entries
+    are evicted above max_bytes or max_entries.
+    """
+
+    def __init__(self, max_bytes=FILTER_CACHE_MAX_BYTES, max_entries=FILTER_CACHE_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.nbytes = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._versions = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _pop(self, key):
+        self.nbytes -= self._entries.pop(key).nbytes
+
+    def _see_version(self, scope, version):
+        """Record the version of a scope, dropping entries of its older versions; False for an outdated version."""
+        newest = self._versions.get(scope)
+        if newest is not None and version < newest:
+            return False
+        if newest != version:
+            self._versions[scope] = version
+            for key in [key for key in self._entries if key[0] == scope]:
+                self._pop(key)
+        return True
+
+    def get(self, scope, version, key, compute):
+        """
+        Return the row positions cached under the key, or compute, cache and return them.
+
+        Parameters:
+        - scope (str): Scope of the dataset (see get_shared_dataset).
+        - version (int): Version of the dataset the positions refer to; without a version
+          the positions are computed and not cached.
+        - key (tuple): Everything else the view depends on; must be hashable.
+        - compute (callable): Returns the row positions, called outside the lock.
+        """
+        if version is None:
+            return _read_only_rows(compute())
+
+        full_key = (scope, version, *key)
+        with self._lock:
+            current = self._see_version(scope, version)
+            rows = self._entries.get(full_key)
+            if rows is not None:
+                self._entries.move_to_end(full_key)
+                return rows
+
+        rows = _read_only_rows(compute())
+        if not current or rows.nbytes > self.max_bytes:
+            return rows
+
+        with self._lock:
+            if self._versions.get(scope) == version and full_key not in self._entries:
+                self._entries[full_key] = rows
+                self.nbytes += rows.nbytes
+                while self.nbytes > self.max_bytes or len(self._entries) > self.max_entries:
+                    self._pop(next(iter(self._entries)))
+        return rows
+
+
+@st.cache_resource
+def get_filter_result_cache():
+    """Return the process-wide FilterResultCache."""
+    return FilterResultCache()
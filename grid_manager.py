@@ -1,16 +1,47 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 
+import copy
 import json
 import os
 
 from st_aggrid import AgGrid, GridOptionsBuilder, DataReturnMode, GridUpdateMode, JsCode
 
+from data_manager_snowflake import PK_COLUMNS, row_key
+from filter_manager import build_filter_mask
+
+# Number of rows sent to the browser at once
+PAGE_SIZE = 500
+
+# Set filters list their values from the whole view only up to this many distinct values
+MAX_SET_FILTER_VALUES = 1000
+
+# Fields read by the JsCode callbacks that are not displayed themselves
+GRID_HIDDEN_COLUMNS = ['LOCKED_TIMESTAMP', 'DIRECT_MANAGER_EMAIL', 'HODNOTY_SYSTEM', 'VYKON_SYSTEM', 'HIST_DATA_MODIFIED_WHEN']
+
+# Decodes dictionary-encoded columns from the dictionaries in the grid context
+DICTIONARY_VALUE_GETTER = JsCode("""
+    function(params) {
+        if (!params.data) { return null; }
+        var code = params.data[params.colDef.field];
+        return code == null || code < 0 ? null : params.context.dictionaries[params.colDef.field][code];
+    }
+""")
+
 # Define common grid styling that can be reused across all grids
 GRID_STYLE = {
     ".ag-row-hover": {"background-color": "#def8ff !important"},  # Light blue hover color
 }
 
+@st.cache_data(show_spinner=False)
+def load_column_names():
+    """Load friendly column names from static/column_names.json once per process."""
+    file_path = os.path.join(os.path.dirname(__file__), './static/column_names.json')
+    with open(file_path, 'r', encoding='utf-8') as file: 
+        return json.load(file)
+
+
 def setup_aggrid(df, editable_columns, columns_to_display, user_role, user_email):
     """
     Configure and set up AgGrid with specific settings for editability, conditional formatting, and column options.
@@ -24,13 +55,26 @@ def setup_aggrid(df, editable_columns, columns_to_display, user_role, user_email
 
     Returns:
     - dict: Configuration options for AgGrid, tailored to user roles and edit permissions.
+      Options are compiled once per role, user, column set and column types, reruns reuse them.
     """
     columns_for_grid = (
         [col for col in columns_to_display if col not in ["MES_DPP_STATUS", "IS_LOCKED"]]
         + editable_columns                                        
         + ["MES_DPP_STATUS", "IS_LOCKED"]                                         
     )
-    gb = GridOptionsBuilder.from_dataframe(df[columns_for_grid])
+    schema = tuple((col, str(df[col].dtype)) for col in columns_for_grid)
+    # The email is interpolated into the callbacks only for MA
+    grid_options = _compile_grid_options(df[columns_for_grid].head(0), schema, tuple(editable_columns), tuple(columns_to_display),
+                                         user_role, user_email if user_role == 'MA' else None)
+    # AgGrid writes rowData and the rendered JsCode into the options it receives
+    return copy.deepcopy(grid_options)
+
+
+@st.cache_resource(max_entries=200, show_spinner=False)
+def _compile_grid_options(_df_schema, schema, editable_columns, columns_to_display, user_role, user_email):
+    """Build the AgGrid options for an empty frame with the grid columns; cached by the hashable arguments."""
+    editable_columns, columns_to_display = list(editable_columns), list(columns_to_display)
+    gb = GridOptionsBuilder.from_dataframe(_df_schema)
     # gb.configure_pagination(paginationAutoPageSize=False, paginationPageSize=100)
     gb.configure_grid_options(
         statusBar={
@@ -129,6 +173,13 @@ def setup_aggrid(df, editable_columns, columns_to_display, user_role, user_email
         suppressColumnVirtualisation=True
     )
 
+    # Stable row ids let the grid apply new row data as a delta instead of re-rendering
+    gb.configure_grid_options(getRowId=JsCode("""
+        function(params) {
+            return params.data.ROW_ID;
+        }
+    """))
+
     options = ["nízký", "střední", "vysoký", 0]
     gb.configure_column("POTENCIAL", cellEditor="agSelectCellEditor", cellEditorParams={'values': options})
     gb.configure_column("PRAVDEPODOBNOST_ODCHODU", cellEditor="agSelectCellEditor", cellEditorParams={'values': options})
@@ -231,10 +282,8 @@ def setup_aggrid(df, editable_columns, columns_to_display, user_role, user_email
                 'TEAM_CODE', 'L2_HEAD_OF_UNIT_FULL_NAME', 'L3_HEAD_OF_UNIT_FULL_NAME','L4_HEAD_OF_UNIT_FULL_NAME']:
         gb.configure_column(col, cellStyle={'backgroundColor': '#e7effd', 'color': '#2870ed'})
 
-    # Load and apply friendly column names from JSON
-    file_path = os.path.join(os.path.dirname(__file__), './static/column_names.json')
-    with open(file_path, 'r', encoding='utf-8') as file: 
-        column_names = json.load(file)    
+    # Apply friendly column names from JSON
+    column_names = load_column_names()
 
     for col in columns_to_display + editable_columns:
         friendly_name = column_names.get(col, col)
@@ -245,34 +294,306 @@ def setup_aggrid(df, editable_columns, columns_to_display, user_role, user_email
     return grid_options
 
 
+def row_ids(df):
+    """Stable AG Grid row ids built from the (USER_ID, YEAR, EVALUATION) key."""
+    return df['USER_ID'].astype(str) + '|' + df['YEAR'].astype(str) + '|' + df['EVALUATION'].astype(str)
+
+
+def sort_rows(df, sort_model):
+    """Sort the DataFrame by an AG Grid sort model, e.g. [{'colId': 'FULL_NAME', 'sort': 'asc'}]."""
+    sort_model = [item for item in (sort_model or []) if item.get('colId') in df.columns]
+    if not sort_model:
+        return df
+    return df.sort_values([item['colId'] for item in sort_model],
+                          ascending=[item.get('sort') != 'desc' for item in sort_model],
+                          kind='stable', na_position='first')
+
+
+def query_grid_rows(df, filter_model, sort_model):
+    """
+    Apply the grid's own filter and sort models to the view on the server.
+
+    Parameters:
+    - df (pd.DataFrame): Rows of the current view (role, round and saved filter already applied).
+    - filter_model (dict): AG Grid filter model from the grid state.
+    - sort_model (list): AG Grid sort model from the grid state.
+
+    Returns:
+    - pd.DataFrame: Filtered and sorted rows, from which pages are cut.
+    """
+    if filter_model:
+        df = df[build_filter_mask(df, filter_model)]
+    return sort_rows(df, sort_model)
+
+
+def get_page(df, page):
+    """Return the rows of one page and the number of pages."""
+    page_count = max(1, -(-len(df) // PAGE_SIZE))
+    page = min(max(page, 0), page_count - 1)
+    return df.iloc[page * PAGE_SIZE:(page + 1) * PAGE_SIZE], page_count
+
+
+def query_grid_page(view_df, change_buffer, key_positions, filter_model, sort_model, page):
+    """
+    Apply the pending edits, the grid's filter and sort models to the view and cut one page.
+
+    Parameters:
+    - view_df (pd.DataFrame): Rows of the current view, with the row labels of the shared dataset.
+    - change_buffer (ChangeBuffer): Pending edits; they are applied before filtering and sorting,
+      so edited rows are found, ordered and shown by their new values on every page.
+    - key_positions (dict): Row labels of the shared dataset by primary key, see ChangeBuffer.apply.
+    - filter_model (dict): AG Grid filter model from the grid state.
+    - sort_model (list): AG Grid sort model from the grid state.
+    - page (int): Index of the page to cut.
+
+    Returns:
+    - tuple: The filtered and sorted view with the edits, the rows of the page and the number of pages.
+    """
+    server_df = query_grid_rows(change_buffer.apply(view_df, key_positions), filter_model, sort_model)
+    page_df, page_count = get_page(server_df, page)
+    return server_df, page_df, page_count
+
+
+def configure_server_view(grid_options, filter_model, sort_model, filter_values):
+    """
+    Prepare grid options for a page of a view that is filtered and sorted on the server.
+
+    The grid gets the server filter and sort back as its initial state, so the filter panel
+    and sort indicators survive remounting, and set filters list values of the whole view
+    instead of the current page only.
+    """
+    initial_state = {}
+    if filter_model:
+        initial_state['filter'] = {'filterModel': filter_model}
+    if sort_model:
+        initial_state['sort'] = {'sortModel': sort_model}
+    if initial_state:
+        grid_options['initialState'] = initial_state
+
+    for column_def in grid_options['columnDefs']:
+        values = filter_values.get(column_def.get('field'))
+        if column_def.get('filter') and values is not None:
+            column_def['filterParams'] = {'values': values}
+    return grid_options
+
+
+def collect_filter_values(df, columns):
+    """Distinct values of low-cardinality columns for the set filters of a server-side view."""
+    filter_values = {}
+    for column in columns:
+        if column not in df.columns or pd.api.types.is_datetime64_any_dtype(df[column]):
+            continue
+        values = df[column].dropna().unique()
+        if len(values) > MAX_SET_FILTER_VALUES:
+            continue
+        filter_values[column] = sorted(values.tolist(), key=str) + ([None] if df[column].isna().any() else [])
+    return filter_values
+
+
+def build_grid_payload(df, grid_options):
+    """
+    Prune a page to the columns the grid needs and dictionary-encode repeated strings.
+
+    Parameters:
+    - df (pd.DataFrame): The page of the view to be sent to the grid.
+    - grid_options (dict): AgGrid options; encoded columns get a valueGetter and their
+      dictionaries are put into the grid context.
+
+    Returns:
+    - pd.DataFrame: ROW_ID, primary key, grid columns and GRID_HIDDEN_COLUMNS, with read-only
+      repeated string columns replaced by integer codes.
+    """
+    column_defs = [column_def for column_def in grid_options['columnDefs'] if column_def.get('field') in df.columns]
+    columns = list(dict.fromkeys(PK_COLUMNS + [column_def['field'] for column_def in column_defs] + GRID_HIDDEN_COLUMNS))
+    payload = df[[column for column in columns if column in df.columns]].copy()
+    payload.insert(0, 'ROW_ID', row_ids(payload))
+
+    # Editable and callback columns keep raw values, the grid writes and compares them
+    raw_columns = {'ROW_ID'} | set(PK_COLUMNS) | set(GRID_HIDDEN_COLUMNS) | set(_tracked_columns(grid_options))
+    dictionaries = {}
+    for column_def in column_defs:
+        column = column_def['field']
+        if column in raw_columns or payload[column].dtype != object:
+            continue
+        codes, uniques = pd.factorize(payload[column])
+        if len(uniques) * 2 > len(payload):
+            continue
+        payload[column] = codes
+        dictionaries[column] = uniques.tolist()
+        column_def['valueGetter'] = DICTIONARY_VALUE_GETTER
+
+    if dictionaries:
+        grid_options['context'] = {'dictionaries': dictionaries}
+    return payload
+
+
+def _changed_cells(previous, payload):
+    """(ROW_ID, column) pairs that differ between two payloads, or None when their rows or columns differ."""
+    if previous is None or list(previous.columns) != list(payload.columns) or not previous['ROW_ID'].reset_index(drop=True).equals(payload['ROW_ID'].reset_index(drop=True)):
+        return None
+    previous, payload = previous.reset_index(drop=True), payload.reset_index(drop=True)
+    differs = (previous != payload) & ~(previous.isna() & payload.isna())
+    rows, columns = np.nonzero(differs.to_numpy())
+    return {(payload['ROW_ID'].iat[row], payload.columns[column]) for row, column in zip(rows, columns)}
+
+
+def get_grid_generation(payload, base_key):
+    """
+    Return the generation to put into the grid key for this payload.
+
+    The grid applies new row data by row id and keeps its scroll, column state and filters,
+    but it ignores new row data once the user edited a cell in it. Such a grid gets a new
+    generation, and so is remounted, only when the page changed outside the cells edited in it.
+    """
+    if st.session_state['grid_base_key'] != base_key:
+        st.session_state['grid_base_key'] = base_key
+        st.session_state['grid_edits'] = set()
+    elif st.session_state['grid_edits']:
+        changed_cells = _changed_cells(st.session_state['grid_payload'], payload)
+        if changed_cells is None or not changed_cells <= st.session_state['grid_edits']:
+            st.session_state['grid_generation'] += 1
+            st.session_state['grid_edits'] = set()
+    st.session_state['grid_payload'] = payload
+    return st.session_state['grid_generation']
+
+
+def display_pagination(page_count, row_count):
+    """Display page controls below the grid; the page is kept in st.session_state['grid_page']."""
+    def move(step):
+        st.session_state['grid_page'] = min(max(st.session_state['grid_page'] + step, 0), page_count - 1)
+
+    prev_col, info_col, next_col = st.columns([0.1, 0.8, 0.1])
+    with prev_col:
+        st.button("◀", key='grid_page_prev', on_click=move, args=(-1,), disabled=st.session_state['grid_page'] <= 0, use_container_width=True)
+    with info_col:
+        st.caption(f"Strana {st.session_state['grid_page'] + 1} z {page_count} · {row_count} záznamů")
+    with next_col:
+        st.button("▶", key='grid_page_next', on_click=move, args=(1,), disabled=st.session_state['grid_page'] >= page_count - 1, use_container_width=True)
+
+
+def _values_differ(new, old):
+    """Compare a value returned by the grid with the stored one, ignoring JSON number and null representation."""
+    new_missing, old_missing = pd.isnull(new), pd.isnull(old)
+    if new_missing or old_missing:
+        return new_missing != old_missing
+    try:
+        return float(new) != float(old)
+    except (TypeError, ValueError):
+        return str(new) != str(old)
+
+
+def _tracked_columns(grid_options):
+    """Columns the grid lets the user edit."""
+    return [column_def['field'] for column_def in grid_options['columnDefs'] if column_def.get('editable')]
+
+
+def record_edit_event(event, baseline_df, tracked_columns, change_buffer, grid_key=None):
+    """
+    Record a cellValueChanged event from the grid into the change buffer.
+
+    Parameters:
+    - event (dict): Event data returned by AgGrid, carrying the edited field and the whole row.
+    - baseline_df (pd.DataFrame): The DataFrame that was sent to the grid, in the same order.
+    - tracked_columns (list): Columns the user can edit.
+    - change_buffer (ChangeBuffer): Buffer of pending edits.
+    - grid_key (str): Key of the grid that produced the event.
+
+    Returns:
+    - bool: True when the event was recorded.
+    """
+    if not event or event.get('type') != 'cellValueChanged':
+        return False
+    data = event.get('data') or {}
+    field = (event.get('colDef') or {}).get('field')
+
+    # The last event is returned again on every rerun until the next one arrives; identify it
+    # by the row's primary key and the grid, as the page position repeats across pages and grids
+    try:
+        key = row_key(*(data.get(column) for column in PK_COLUMNS))
+    except (TypeError, ValueError):
+        return False
+    signature = (grid_key, key, field, str(event.get('oldValue')), str(event.get('newValue')))
+    if signature == st.session_state['last_edit_event']:
+        return False
+    st.session_state['last_edit_event'] = signature
+
+    try:
+        baseline = baseline_df.iloc[int(data['__pandas_index'])]
+    except (KeyError, ValueError, IndexError):
+        return False
+    if key != row_key(*baseline[PK_COLUMNS]):
+        return False
+
+    # Diff the whole row, so edits whose own events were coalesced are not lost
+    edits = {
+        column: (baseline[column], data[column])
+        for column in tracked_columns
+        if column in data and (column == field or _values_differ(data[column], baseline[column]))
+    }
+    versions = {key: baseline['HIST_DATA_MODIFIED_WHEN']} if 'HIST_DATA_MODIFIED_WHEN' in baseline else None
+    change_buffer.merge({key: edits}, versions=versions)
+    if 'ROW_ID' in baseline:
+        st.session_state['grid_edits'].update((baseline['ROW_ID'], column) for column in edits)
+    return True
+
+
+def reconcile_change_buffer(grid_data, baseline_df, grid_options, change_buffer):
+    """
+    Record edits present in the grid data that never arrived as events.
+
+    Parameters:
+    - grid_data (pd.DataFrame): Data returned by AgGrid, indexed by the position of the row sent to the grid.
+    - baseline_df (pd.DataFrame): The DataFrame that was sent to the grid.
+    - grid_options (dict): AgGrid configuration options set up with `setup_aggrid`.
+    - change_buffer (ChangeBuffer): Buffer of pending edits.
+
+    Returns:
+    - int: Number of cells that were missing from the buffer.
+    """
+    if grid_data is None or grid_data.empty:
+        return 0
+    baseline = baseline_df.iloc[grid_data.index.astype(int)].reset_index(drop=True)
+    current = grid_data.reset_index(drop=True)
+
+    missed, versions = {}, {}
+    for column in _tracked_columns(grid_options):
+        if column not in current.columns:
+            continue
+        new, old = current[column], baseline[column]
+        new_number, old_number = pd.to_numeric(new, errors='coerce'), pd.to_numeric(old, errors='coerce')
+        both_numbers = new_number.notna() & old_number.notna()
+        differs = (new.isna() != old.isna()) | (
+            new.notna() & old.notna() & np.where(both_numbers, new_number != old_number, new.astype(str) != old.astype(str))
+        )
+        for position in np.flatnonzero(differs.to_numpy()):
+            key = row_key(*baseline.loc[position, PK_COLUMNS])
+            if (key, column) not in change_buffer:
+                missed.setdefault(key, {})[column] = (old[position], new[position])
+                if 'HIST_DATA_MODIFIED_WHEN' in baseline.columns:
+                    versions[key] = baseline.loc[position, 'HIST_DATA_MODIFIED_WHEN']
+
+    change_buffer.merge(missed, versions=versions)
+    return sum(len(edits) for edits in missed.values())
+
+
 def display_table(input_df, grid_options, grid_key, license_key):
     """
-    Display the filtered DataFrame in an AgGrid table and track changes made by the user.
+    Display one page of the filtered DataFrame in an AgGrid table and track changes made by the user.
 
     Parameters:
-    - input_df (pd.DataFrame): The filtered DataFrame to be displayed in AgGrid.
+    - input_df (pd.DataFrame): The page of the filtered DataFrame to be displayed in AgGrid.
     - grid_options (dict): AgGrid configuration options set up with `setup_aggrid`.
+    - grid_key (str): Key of the grid; a new key remounts the grid with new data.
 
     Returns:
-    - tuple: A tuple with the filtered data, DataFrame of changed rows, and the grid response object.
+    - tuple: A tuple with the filtered data and the grid response object. Edits are recorded
+      into st.session_state['change_buffer'].
     """
-    df_filtered = input_df.copy()
-    selected_year = df_filtered['YEAR_EVALUATION'].unique()[0]
-    pk_columns = ['USER_ID', 'YEAR', 'EVALUATION']
-    df_filtered.set_index(pk_columns, inplace=True)
-    
-    # Initialize original and last_saved DataFrames before displaying the grid
-    if 'df_original' not in st.session_state or st.session_state['df_original'].empty:
-        st.session_state['df_original'] = df_filtered.copy()
-    if 'df_last_saved' not in st.session_state or st.session_state['df_last_saved'].empty:
-        st.session_state['df_last_saved'] = st.session_state['df_original'].copy()
-    
-    # Reset index for display purposes
-    df_filtered.reset_index(inplace=True)
+    df_filtered = input_df.reset_index(drop=True)
 
     grid_response = AgGrid(
         df_filtered,
-        key=f'editable_grid_{selected_year}_{grid_key}',
+        key=f'editable_grid_{grid_key}',
         gridOptions=grid_options,
         data_return_mode=DataReturnMode.FILTERED_AND_SORTED,
         update_mode=GridUpdateMode.MODEL_CHANGED,
@@ -284,23 +605,8 @@ def display_table(input_df, grid_options, grid_key, license_key):
         custom_css=GRID_STYLE
     )
 
-    filtered_data = pd.DataFrame(grid_response['data'])
-    filtered_data.set_index(pk_columns, inplace=True)
-    
-    # Align indexes for accurate comparison and find changes
-    # excluding columns so that values are not considered a change because those fields are not edited by user
-    excluded_columns = ['HIST_DATA_MODIFIED_BY', 'HIST_DATA_MODIFIED_WHEN', 'LOCKED_TIMESTAMP'] 
-    filtered_data_aligned, df_last_saved_aligned = filtered_data.align(st.session_state['df_last_saved'], join='inner', axis=0)
-    filtered_data_aligned_no_hist = filtered_data_aligned.drop(columns=excluded_columns, errors='ignore')
-    df_last_saved_aligned_no_hist = df_last_saved_aligned.drop(columns=excluded_columns, errors='ignore')
-
-    changed_rows = filtered_data_aligned_no_hist.compare(df_last_saved_aligned_no_hist)
-    # Update df_last_saved to track the most recent changes
-    st.session_state['df_last_saved'] = filtered_data.copy()
-
-    # Reset index for display purposes
-    changed_rows.reset_index(inplace=True)
-
-    return filtered_data.reset_index(), changed_rows, grid_response
-
+    # Track edits from the cell event instead of comparing the whole grid on every rerun
+    record_edit_event(grid_response.event_data, df_filtered, _tracked_columns(grid_options), st.session_state['change_buffer'], grid_key)
+    filtered_data = pd.DataFrame(grid_response['data']).reset_index(drop=True)
 
+    return filtered_data, grid_response
@@ -0,0 +1,88 @@
+import os
+
+import streamlit as st
+
+
+class StorageBackend:
+    """
+    Storage of the rating table and the saved filters.
+
+    Implementations must be safe to call from script runs and from write workers
+    (see get_write_executor) at the same time, and must not use Streamlit state.
+    Rows passed to writes are prepared by prepare_changed_rows, timestamps are
+    strings as produced by timestamp_text.
+    """
+
+    def load_rows(self, table_id, columns, scope=None, modified_since=None):
+        """
+        Read rows of the rating table.
+
+        Parameters:
+        - table_id (str): Source table name.
+        - columns (list): Columns to read.
+        - scope (str, optional): Manager email; only that manager's subtree is read (see build_scoped_query).
+        - modified_since (datetime, optional): Read only rows modified or locked at or after it.
+
+        Returns:
+        - pd.DataFrame: The rows, not yet passed through prepare_source_frame.
+        """
+        raise NotImplementedError
+
+    def merge_rows(self, table_id, rows, column_types):
+        """
+        Write the changed cells of existing rows in one transaction, skipping rows whose
+        version check fails (see build_merge_query). Returns the number of updated rows.
+        """
+        raise NotImplementedError
+
+    def find_conflicts(self, table_id, rows, stamp):
+        """Return the keys of rows that a merge stamped with stamp left unwritten."""
+        raise NotImplementedError
+
+    def lock_rows(self, table_id, keys, user_email, stamp):
+        """Lock the rows given by their keys (see lock_rows_snowflake); returns the number of locked rows."""
+        raise NotImplementedError
+
+    def load_filters(self, table_id, user_email):
+        """Return the saved filters of a user as a DataFrame with FILTER_NAME, FILTER_CREATOR and FILTERED_VALUES."""
+        raise NotImplementedError
+
+    def save_filter(self, table_id, user_email, filter_name, filter_model_json):
+        """Insert or update one saved filter."""
+        raise NotImplementedError
+
+    def delete_filter(self, table_id, user_email, filter_name):
+        """Delete one saved filter."""
+        raise NotImplementedError
+
+    def record_event(self, message, event_type, event_data):
+        """Record an audit event of a committed write; called on the script run of the user who made it."""
+
+
+@st.cache_resource
+def get_storage_backend(_client):
+    """
+    Return the process-wide storage backend.
+
+    st.secrets['STORAGE_BACKEND'] selects 'snowflake' or 'local' (SQLite database seeded
+    from the debug CSV, see LocalBackend); without it, debug mode uses 'local'.
+    """
+    # The backends import this module, so they are imported only when one is needed
+    from data_manager_local import LocalBackend
+    from data_manager_snowflake import get_snowflake_config, load_expected_schema
+    from storage_snowflake import SnowflakeBackend
+
+    default_backend = 'local' if st.secrets.get('DEBUG') == 'true' else 'snowflake'
+    backend = st.secrets.get('STORAGE_BACKEND', default_backend)
+    if backend == 'snowflake':
+        return SnowflakeBackend(get_snowflake_config(), _client)
+    if backend == 'local':
+        base_path = os.path.dirname(__file__)
+        return LocalBackend(
+            database_path=st.secrets.get('LOCAL_DATABASE_PATH', os.path.join(base_path, 'data', 'local.sqlite')),
+            seed_path=os.path.join(base_path, 'data', 'in', 'tables', 'anonymized_data.csv'),
+            source_table_id=st.secrets["WORKSPACE_SOURCE_TABLE_ID"],
+            filter_table_id=st.secrets["WORKSPACE_FILTER_TABLE_ID"],
+            column_types=load_expected_schema(),
+        )
+    raise ValueError(f"Unsupported storage backend: {backend}")
@@ -0,0 +1,92 @@
+import threading
+
+import pandas as pd
+
+from snowflake.snowpark import Session
+from snowflake.snowpark.functions import col, lit
+
+from data_manager_snowflake import build_scoped_query, find_conflicts_snowflake, lock_rows_snowflake, merge_rows_snowflake
+from storage_manager import StorageBackend
+
+
+# Each write worker thread keeps its own Snowpark session
+_worker_local = threading.local()
+
+
+def get_worker_session(config):
+    """Return the Snowpark session owned by the current write worker thread."""
+    session = getattr(_worker_local, 'session', None)
+    if session is None:
+        session = Session.builder.configs(config).create()
+        _worker_local.session = session
+    return session
+
+
+class SnowflakeBackend(StorageBackend):
+    """
+    Storage in Snowflake through Snowpark.
+
+    Writes use the session of the write worker they run on (see get_worker_session),
+    reads share one session of the process. Writes do not call the Keboola client, their
+    events are recorded by finish_write_job through record_event.
+    """
+
+    def __init__(self, config, client):
+        self.config = config
+        self.client = client
+        self._read_lock = threading.Lock()
+        self._read_session = None
+
+    def _session_for_reads(self):
+        if self._read_session is None:
+            self._read_session = Session.builder.configs(self.config).create()
+            self.client.create_event(message='Streamlit App Snowflake Init Connection', event_type='keboola_data_app_snowflake_init')
+        return self._read_session
+
+    def load_rows(self, table_id, columns, scope=None, modified_since=None):
+        with self._read_lock:
+            session = self._session_for_reads()
+            if scope:
+                query, params = build_scoped_query(table_id, columns, manager_email=scope)
+                table = session.sql(query, params=params)
+            else:
+                table = session.table(table_id).select(columns)
+            if modified_since is not None:
+                since = lit(pd.Timestamp(modified_since).to_pydatetime())
+                table = table.filter((col('HIST_DATA_MODIFIED_WHEN') >= since) | (col('LOCKED_TIMESTAMP') >= since))
+            df_snowflake = table.to_pandas()
+        self.client.create_event(message='Streamlit App Snowflake Read Table', event_type='keboola_data_app_snowflake_read_table', event_data=f'table_id: {table_id}')
+        return df_snowflake
+
+    def merge_rows(self, table_id, rows, column_types):
+        return merge_rows_snowflake(get_worker_session(self.config), table_id, rows, column_types)
+
+    def find_conflicts(self, table_id, rows, stamp):
+        return find_conflicts_snowflake(get_worker_session(self.config), table_id, rows, stamp)
+
+    def lock_rows(self, table_id, keys, user_email, stamp):
+        return lock_rows_snowflake(get_worker_session(self.config), table_id, keys, user_email, stamp)
+
+    def load_filters(self, table_id, user_email):
+        with self._read_lock:
+            filters_df = self._session_for_reads().table(table_id).filter(col('FILTER_CREATOR') == lit(user_email)).to_pandas()
+        self.client.create_event(message='Streamlit App Snowflake Read Table', event_type='keboola_data_app_snowflake_read_table', event_data=f'table_id: {table_id}')
+        return filters_df
+
+    def save_filter(self, table_id, user_email, filter_name, filter_model_json):
+        merge_query = f"""
+            MERGE INTO {table_id} AS target
+            USING (SELECT ? AS FILTER_NAME, ? AS FILTER_CREATOR, ? AS FILTERED_VALUES) AS source
+            ON target.FILTER_NAME = source.FILTER_NAME AND target.FILTER_CREATOR = source.FILTER_CREATOR
+            WHEN MATCHED THEN UPDATE SET target.FILTERED_VALUES = source.FILTERED_VALUES
+            WHEN NOT MATCHED THEN INSERT (FILTER_NAME, FILTER_CREATOR, FILTERED_VALUES)
+            VALUES (source.FILTER_NAME, source.FILTER_CREATOR, source.FILTERED_VALUES)
+        """
+        get_worker_session(self.config).sql(merge_query, params=[filter_name, user_email, filter_model_json]).collect()
+
+    def delete_filter(self, table_id, user_email, filter_name):
+        delete_query = f"DELETE FROM {table_id} WHERE FILTER_NAME = ? AND FILTER_CREATOR = ?"
+        get_worker_session(self.config).sql(delete_query, params=[filter_name, user_email]).collect()
+
+    def record_event(self, message, event_type, event_data):
+        self.client.create_event(message=message, event_type=event_type, event_data=event_data)
@@ -0,0 +1,93 @@
+import pandas as pd
+
+from data_manager import ChangeBuffer
+from data_manager_snowflake import WriteCoordinator, prepare_changed_rows, row_key
+from storage_manager import StorageBackend
+
+
+KEY = row_key('1001', 2024, 1)
+LOADED_VERSION = '2024-05-01 10:00:00'
+
+
+class VersionedBackend(StorageBackend):
+    """Rows as {key: HIST_DATA_MODIFIED_WHEN}, written under the rules of build_merge_query."""
+
+    def __init__(self, versions):
+        self.versions = dict(versions)
+
+    def merge_rows(self, table_id, rows, column_types):
+        updated_rows = 0
+        for row in rows.to_dict('records'):
+            key = row_key(row['USER_ID'], row['YEAR'], row['EVALUATION'])
+            if row['CHECK_VERSION'] and pd.Timestamp(self.versions[key]) != pd.Timestamp(row['EXPECTED_MODIFIED_WHEN']):
+                continue
+            self.versions[key] = row['HIST_DATA_MODIFIED_WHEN']
+            updated_rows += 1
+        return updated_rows
+
+    def find_conflicts(self, table_id, rows, stamp):
+        keys = map(row_key, rows['USER_ID'], rows['YEAR'], rows['EVALUATION'])
+        return [key for key in keys if self.versions[key] != stamp]
+
+
+def edit(change_buffer, value, version=LOADED_VERSION):
+    """Edit HODNOTY of the row as the grid does, with the version the shown page has."""
+    change_buffer.merge({KEY: {'HODNOTY': (None, value)}}, versions={KEY: version})
+
+
+def save(change_buffer, coordinator):
+    """Submit the buffer as process_and_save_changes and submit_changed_rows do."""
+    future = coordinator.submit(prepare_changed_rows(change_buffer.to_frame(), 'manager@example.com'))
+    change_buffer.start_save([KEY])
+    change_buffer.clear()
+    return future
+
+
+def test_edit_after_own_save_before_refresh_is_not_a_conflict():
+    change_buffer = ChangeBuffer()
+    coordinator = WriteCoordinator('SOURCE', {}, VersionedBackend({KEY: LOADED_VERSION}))
+
+    edit(change_buffer, 3)
+    result = save(change_buffer, coordinator).result(timeout=5)
+    assert result['conflicts'] == []
+    change_buffer.finish_save([KEY], result['stamp'])
+
+    # The page still shows the version loaded before the first save
+    edit(change_buffer, 4)
+    result = save(change_buffer, coordinator).result(timeout=5)
+    assert result['conflicts'] == []
+    assert result['rows'] == 1
+
+
+def test_edit_while_own_save_is_written_skips_the_version_check():
+    change_buffer = ChangeBuffer()
+    edit(change_buffer, 3)
+    change_buffer.start_save([KEY])
+    change_buffer.clear()
+
+    edit(change_buffer, 4)
+    row = change_buffer.to_frame().iloc[0]
+    assert not row['CHECK_VERSION']
+
+
+def test_refreshed_version_replaces_the_stamp_of_own_save():
+    change_buffer = ChangeBuffer()
+    change_buffer.start_save([KEY])
+    change_buffer.finish_save([KEY], '2024-05-02 08:00:00.000001')
+
+    # Someone else saved the row after the refresh brought our own save
+    edit(change_buffer, 4, version='2024-05-03 09:00:00')
+    row = change_buffer.to_frame().iloc[0]
+    assert row['CHECK_VERSION']
+    assert row['EXPECTED_MODIFIED_WHEN'] == '2024-05-03 09:00:00'
+
+
+def test_conflicting_save_keeps_the_loaded_version():
+    change_buffer = ChangeBuffer()
+    change_buffer.start_save([KEY])
+    change_buffer.finish_save([KEY])
+
+    edit(change_buffer, 4)
+    row = change_buffer.to_frame().iloc[0]
+    assert row['CHECK_VERSION']
+    assert row['EXPECTED_MODIFIED_WHEN'] == LOADED_VERSION
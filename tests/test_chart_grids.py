@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+
+from chart_manager import (GRID_CATEGORIES, POTENCIAL_UNRATED, POTENCIAL_VALUES, UNRATED, build_3_grid, build_5_grid,
+                           preprocess_df_for_charts)
+
+
+def chart_frame(rows):
+    """Chart data as preprocess_df_for_charts makes it from rows of (FULL_NAME, VYKON, HODNOTY, POTENCIAL)."""
+    df = pd.DataFrame(rows, columns=['FULL_NAME', 'VYKON', 'HODNOTY', 'POTENCIAL'])
+    for column in ['HODNOTY_PREVIOUS', 'VYKON_PREVIOUS', 'POTENCIAL_PREVIOUS']:
+        df[column] = np.nan
+    return preprocess_df_for_charts(df)
+
+
+def test_3_grid_keeps_people_without_potencial():
+    pivot_df, category_counts = build_3_grid(chart_frame([
+        ('Jana Nováková', 5, 4, 'vysoký'),
+        ('Petr Svoboda', 3, 2, np.nan),
+    ]))
+
+    assert POTENCIAL_UNRATED in pivot_df.columns
+    band_row = pivot_df.set_index('CO_JAK').loc['4-7']
+    assert band_row[POTENCIAL_UNRATED] == 'P. Svoboda'
+    assert pivot_df.set_index('CO_JAK').loc['8-10', 'vysoký'] == 'J. Nováková'
+    assert category_counts[UNRATED] == 1
+    assert category_counts.sum() == 2
+
+
+def test_3_grid_has_no_unrated_column_when_everyone_has_potencial():
+    pivot_df, category_counts = build_3_grid(chart_frame([('Jana Nováková', 5, 4, 'vysoký')]))
+
+    assert POTENCIAL_UNRATED not in pivot_df.columns
+    assert category_counts[GRID_CATEGORIES.index('Top')] == 1
+
+
+def random_chart_frame(seed, size=200):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'USER_ID': [str(i) for i in range(size)],
+        'FULL_NAME': [f'Jméno{i} Příjmení{i}' for i in range(size)],
+        'VYKON': rng.integers(0, 6, size).astype(float),
+        'HODNOTY': rng.integers(0, 6, size).astype(float),
+        'POTENCIAL': rng.choice(np.array(POTENCIAL_VALUES + [np.nan], dtype=object), size),
+    })
+    df.loc[rng.random(size) < 0.1, 'VYKON'] = np.nan
+    for column in ['HODNOTY_PREVIOUS', 'VYKON_PREVIOUS', 'POTENCIAL_PREVIOUS']:
+        df[column] = np.nan
+    return preprocess_df_for_charts(df)
+
+
+def pad_combinations(df):
+    """Rows without a name for every CO, JAK and POTENCIAL, as the grids were once filled in."""
+    combinations = pd.MultiIndex.from_product([range(6), range(6), POTENCIAL_VALUES], names=['JAK', 'CO', 'POTENCIAL'])
+    missing = pd.DataFrame(combinations.tolist(), columns=['JAK', 'CO', 'POTENCIAL'])
+    missing['FULL_NAME_SPLIT'] = ''
+    return pd.concat([df, missing], ignore_index=True)
+
+
+def pivot_names(df, index, columns):
+    pivot_df = df.pivot_table(index=index, columns=columns, values='FULL_NAME_SPLIT',
+                              aggfunc=lambda x: ', '.join([name for name in x if name]), observed=False).fillna('')
+    return pivot_df.sort_index(ascending=False)
+
+
+def rule_5_grid(co, jak):
+    if co == 0 or jak == 0:
+        return 'Nehodnocení'
+    if co in [4, 5] and jak in [4, 5]:
+        return 'Top'
+    if (co == 2 and jak in [3, 4, 5]) or (co == 3 and jak in [2, 3, 4, 5]) or (co in [4, 5] and jak in [2, 3]):
+        return 'Middle'
+    if (co == 1 or jak == 1) or (co == 2 and jak in [1, 2]) or (co in [3, 4, 5] and jak == 1):
+        return 'Low'
+    return 'Nehodnocení'
+
+
+def rule_3_grid(co, jak, potencial):
+    total = co + jak
+    if potencial == '0' or total == 0:
+        return 'Nehodnocení'
+    if potencial in ['nízký', 'střední'] and total in range(1, 4):
+        return 'Low'
+    if (potencial == 'vysoký' and total in range(1, 4)) or (potencial in ['nízký', 'střední'] and total in range(4, 8)) \
+            or (potencial == 'nízký' and total in range(8, 11)):
+        return 'Middle'
+    if (potencial == 'vysoký' and total in range(4, 8)) or (potencial in ['střední', 'vysoký'] and total in range(8, 11)):
+        return 'Top'
+    return 'Nehodnocení'
+
+
+def rule_counts(labels):
+    counts = pd.Series(labels).value_counts()
+    return [counts.get(category, 0) for category in GRID_CATEGORIES]
+
+
+def test_5_grid_matches_pivot_table_and_row_rules():
+    for seed in range(5):
+        chart_df = random_chart_frame(seed)
+        pivot_df, category_counts = build_5_grid(chart_df)
+
+        expected = pivot_names(pad_combinations(chart_df), 'CO', 'JAK')
+        assert pivot_df['CO'].tolist() == expected.index.tolist()
+        for jak in range(6):
+            assert pivot_df[str(jak)].tolist() == expected[jak].tolist()
+        labels = [rule_5_grid(co, jak) for co, jak in zip(chart_df['CO'], chart_df['JAK'])]
+        assert category_counts.tolist() == rule_counts(labels)
+
+
+def test_3_grid_matches_pivot_table_and_row_rules():
+    for seed in range(5):
+        chart_df = random_chart_frame(seed)
+        pivot_df, category_counts = build_3_grid(chart_df)
+
+        padded = pad_combinations(chart_df)
+        padded['CO_JAK'] = pd.cut(padded['JAK'] + padded['CO'], bins=[-float('inf'), 0, 3, 7, 10],
+                                  labels=['0', '1-3', '4-7', '8-10'], include_lowest=True, right=True)
+        expected = pivot_names(padded, 'CO_JAK', 'POTENCIAL')
+        assert pivot_df['CO_JAK'].tolist() == expected.index.astype(str).tolist()
+        for potencial in POTENCIAL_VALUES:
+            assert pivot_df[potencial].tolist() == expected[potencial].tolist()
+        # People without POTENCIAL were once in a 'nan' column, now in POTENCIAL_UNRATED
+        assert pivot_df[POTENCIAL_UNRATED].tolist() == expected['nan'].tolist()
+        labels = [rule_3_grid(co, jak, potencial)
+                  for co, jak, potencial in zip(chart_df['CO'], chart_df['JAK'], chart_df['POTENCIAL'])]
+        assert category_counts.tolist() == rule_counts(labels)
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+
+from filter_manager import ColumnIndex, build_filter_mask, filter_rows
+
+
+def random_frame(seed, size=300):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'JOB_TITLE_CZ': rng.choice(np.array(['Analytik', 'Vedoucí', 'Technik', None], dtype=object), size),
+        'TEAM_CODE': rng.integers(1, 6, size).astype(float),
+        'HODNOTY': rng.integers(0, 6, size),
+    })
+    df.loc[rng.random(size) < 0.1, 'TEAM_CODE'] = np.nan
+    return df
+
+
+def test_rows_match_set_filter_mask():
+    for seed in range(3):
+        df = random_frame(seed)
+        index = ColumnIndex(df, ['JOB_TITLE_CZ', 'TEAM_CODE', 'MISSING_COLUMN'])
+
+        assert 'MISSING_COLUMN' not in index
+        for column, values in [('JOB_TITLE_CZ', ['Analytik']), ('JOB_TITLE_CZ', ['Vedoucí', 'Technik', 'Nikdo']),
+                               ('TEAM_CODE', ['1', '4']), ('TEAM_CODE', [2, 3.0]), ('TEAM_CODE', [])]:
+            expected = build_filter_mask(df, {column: {'filterType': 'set', 'values': values}})
+            np.testing.assert_array_equal(index.rows(column, values), np.flatnonzero(expected))
+            np.testing.assert_array_equal(index.mask(column, values), expected)
+
+
+def test_rows_with_none_match_missing_values():
+    df = random_frame(0)
+    index = ColumnIndex(df, ['JOB_TITLE_CZ'])
+
+    np.testing.assert_array_equal(index.rows('JOB_TITLE_CZ', [None]), np.flatnonzero(df['JOB_TITLE_CZ'].isna()))
+
+
+def test_filter_rows_with_index_matches_filter_without_index():
+    for seed in range(3):
+        df = random_frame(seed)
+        index = ColumnIndex(df, ['JOB_TITLE_CZ', 'TEAM_CODE'])
+        candidates = np.random.default_rng(seed).random(len(df)) < 0.7
+        filter_model = {
+            'JOB_TITLE_CZ': {'filterType': 'set', 'values': ['Analytik', 'Technik']},
+            'TEAM_CODE': {'filterType': 'set', 'values': ['1', '2', '5']},
+            'HODNOTY': {'filterType': 'number', 'type': 'greaterThan', 'filter': 2},
+        }
+
+        expected = np.flatnonzero(build_filter_mask(df, filter_model))
+        np.testing.assert_array_equal(filter_rows(df, filter_model, index), expected)
+        np.testing.assert_array_equal(filter_rows(df, filter_model), expected)
+        np.testing.assert_array_equal(filter_rows(df, filter_model, index, candidates),
+                                      np.flatnonzero(build_filter_mask(df, filter_model) & candidates))
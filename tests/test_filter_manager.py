@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+
+from filter_manager import build_filter_mask, compile_filter_model
+
+
+def make_frame():
+    return pd.DataFrame({
+        'FULL_NAME': ['Jana Nováková', 'Petr Svoboda', 'jan novak', None, '  '],
+        'HODNOTY': [1, 2, 3, np.nan, 5],
+        'LOCKED_TIMESTAMP': pd.to_datetime(['2024-01-01 10:00', '2024-02-01 08:30', '2024-03-15 23:59', None, '2024-02-01 12:00']),
+        'JOB_TITLE_CZ': ['A', 'B', 'A', 'C', None],
+    })
+
+
+def legacy_apply_filter(df, filter_model):
+    """The pandas filtering the compiler replaced: one isin per set filter."""
+    for filter_column, filter_details in filter_model.items():
+        if filter_details['filterType'] == 'set':
+            df = df[df[filter_column].isin(filter_details['values'])]
+    return df
+
+
+def filtered(df, filter_model):
+    return df[build_filter_mask(df, filter_model)]
+
+
+def assert_same_rows(actual, expected):
+    assert list(actual.index) == list(expected.index)
+
+
+def test_text_filter_is_case_insensitive_and_skips_missing_values():
+    df = make_frame()
+    model = {'FULL_NAME': {'filterType': 'text', 'type': 'contains', 'filter': 'JAN'}}
+    assert_same_rows(filtered(df, model), df[df['FULL_NAME'].str.lower().str.contains('jan', na=False)])
+
+
+def test_text_blank_matches_missing_and_whitespace():
+    df = make_frame()
+    model = {'FULL_NAME': {'filterType': 'text', 'type': 'blank'}}
+    assert_same_rows(filtered(df, model), df[df['FULL_NAME'].isna() | (df['FULL_NAME'].str.strip() == '')])
+
+
+def test_number_filters():
+    df = make_frame()
+    greater = {'HODNOTY': {'filterType': 'number', 'type': 'greaterThan', 'filter': 2}}
+    assert_same_rows(filtered(df, greater), df[df['HODNOTY'] > 2])
+
+    in_range = {'HODNOTY': {'filterType': 'number', 'type': 'inRange', 'filter': 1, 'filterTo': 5}}
+    assert_same_rows(filtered(df, in_range), df[(df['HODNOTY'] > 1) & (df['HODNOTY'] < 5)])
+
+
+def test_date_filter_compares_calendar_days():
+    df = make_frame()
+    model = {'LOCKED_TIMESTAMP': {'filterType': 'date', 'type': 'equals', 'dateFrom': '2024-02-01 00:00:00'}}
+    assert_same_rows(filtered(df, model), df[df['LOCKED_TIMESTAMP'].dt.normalize() == pd.Timestamp('2024-02-01')])
+
+    before = {'LOCKED_TIMESTAMP': {'filterType': 'date', 'type': 'lessThan', 'dateFrom': '2024-02-01 00:00:00'}}
+    assert_same_rows(filtered(df, before), df[df['LOCKED_TIMESTAMP'] < pd.Timestamp('2024-02-01')])
+
+
+def test_set_filter_matches_legacy_filtering():
+    df = make_frame()
+    model = {
+        'JOB_TITLE_CZ': {'filterType': 'set', 'values': ['A', 'C']},
+        'HODNOTY': {'filterType': 'set', 'values': ['1', '3', '5']},
+    }
+    legacy_model = {
+        'JOB_TITLE_CZ': {'filterType': 'set', 'values': ['A', 'C']},
+        'HODNOTY': {'filterType': 'set', 'values': [1, 3, 5]},
+    }
+    assert_same_rows(filtered(df, model), legacy_apply_filter(df, legacy_model))
+
+
+def test_combined_conditions():
+    df = make_frame()
+    either = {'HODNOTY': {'filterType': 'number', 'operator': 'OR', 'conditions': [
+        {'filterType': 'number', 'type': 'lessThan', 'filter': 2},
+        {'filterType': 'number', 'type': 'greaterThan', 'filter': 4},
+    ]}}
+    assert_same_rows(filtered(df, either), df[(df['HODNOTY'] < 2) | (df['HODNOTY'] > 4)])
+
+    both = {'FULL_NAME': {'filterType': 'text', 'operator': 'AND',
+                          'condition1': {'filterType': 'text', 'type': 'startsWith', 'filter': 'jan'},
+                          'condition2': {'filterType': 'text', 'type': 'notContains', 'filter': 'nov'}}}
+    names = df['FULL_NAME'].str.lower()
+    assert_same_rows(filtered(df, both), df[names.str.startswith('jan', na=False) & ~names.str.contains('nov', na=True)])
+
+
+def test_incomplete_conditions_are_ignored():
+    df = make_frame()
+    no_value = {'HODNOTY': {'filterType': 'number', 'type': 'equals', 'filter': None},
+                'LOCKED_TIMESTAMP': {'filterType': 'date', 'type': 'greaterThan', 'dateFrom': None}}
+    assert compile_filter_model(no_value) == []
+    assert_same_rows(filtered(df, no_value), df)
+
+    one_complete = {'HODNOTY': {'filterType': 'number', 'operator': 'AND', 'conditions': [
+        {'filterType': 'number', 'type': 'greaterThan', 'filter': 1},
+        {'filterType': 'number', 'type': 'inRange', 'filter': 2},
+    ]}}
+    assert_same_rows(filtered(df, one_complete), df[df['HODNOTY'] > 1])
+
+
+def test_multi_filter_skips_unsupported_children():
+    df = make_frame()
+    model = {'JOB_TITLE_CZ': {'filterType': 'multi', 'filterModels': [
+        {'filterType': 'custom', 'value': 'x'},
+        None,
+        {'filterType': 'set', 'values': ['A', 'B']},
+        {'filterType': 'text', 'type': 'notEqual', 'filter': 'b'},
+    ]}}
+    assert_same_rows(filtered(df, model), df[df['JOB_TITLE_CZ'].isin(['A', 'B']) & (df['JOB_TITLE_CZ'].str.lower() != 'b')])
+
+    unsupported_only = {'JOB_TITLE_CZ': {'filterType': 'multi', 'filterModels': [{'filterType': 'custom'}]}}
+    assert compile_filter_model(unsupported_only) == []
+    assert_same_rows(filtered(df, unsupported_only), df)
@@ -0,0 +1,77 @@
+import numpy as np
+
+from filter_manager import FilterResultCache, filter_model_hash
+
+
+class Counter:
+    """compute callable returning fixed rows and counting its calls."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.rows
+
+
+def test_same_filter_model_hits_the_cache():
+    cache = FilterResultCache()
+    compute = Counter([1, 2, 3])
+    first = cache.get(None, 1, ('BP', filter_model_hash({'A': {'filterType': 'set', 'values': ['x']}, 'B': {}})), compute)
+    second = cache.get(None, 1, ('BP', filter_model_hash({'B': {}, 'A': {'filterType': 'set', 'values': ['x']}})), compute)
+
+    assert compute.calls == 1
+    assert second is first
+    assert not first.flags.writeable
+
+    cache.get(None, 1, ('BP', filter_model_hash({'A': {'filterType': 'set', 'values': ['y']}})), compute)
+    assert compute.calls == 2
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = FilterResultCache(max_entries=2)
+    cache.get(None, 1, ('a',), Counter([1]))
+    cache.get(None, 1, ('b',), Counter([2]))
+    cache.get(None, 1, ('a',), Counter([1]))
+    cache.get(None, 1, ('c',), Counter([3]))
+
+    assert len(cache) == 2
+    compute = Counter([2])
+    cache.get(None, 1, ('b',), compute)
+    assert compute.calls == 1
+
+
+def test_entries_above_the_byte_budget_are_evicted():
+    cache = FilterResultCache(max_bytes=3 * 4 * 10)
+    for name in 'abcd':
+        cache.get(None, 1, (name,), Counter(np.arange(10)))
+    assert len(cache) == 3
+    assert cache.nbytes == 3 * 4 * 10
+
+
+def test_newer_version_drops_results_of_older_versions():
+    cache = FilterResultCache()
+    cache.get('boss@x.cz', 1, ('a',), Counter([1]))
+    cache.get(None, 1, ('a',), Counter([1]))
+    cache.get('boss@x.cz', 2, ('a',), Counter([1, 2]))
+
+    # The other scope keeps its entry
+    assert len(cache) == 2
+    # An older version is computed for the session still showing it, but not cached
+    compute = Counter([1])
+    cache.get('boss@x.cz', 1, ('a',), compute)
+    cache.get('boss@x.cz', 1, ('a',), compute)
+    assert compute.calls == 2
+    assert len(cache) == 2
+
+
+def test_missing_version_is_computed_without_caching():
+    cache = FilterResultCache()
+    cache.get(None, 3, ('a',), Counter([1]))
+    compute = Counter([4, 5])
+
+    assert cache.get(None, None, ('a',), compute).tolist() == [4, 5]
+    assert cache.get(None, None, ('a',), compute).tolist() == [4, 5]
+    assert compute.calls == 2
+    assert len(cache) == 1
@@ -0,0 +1,57 @@
+import pandas as pd
+
+import grid_manager
+from data_manager import ChangeBuffer
+from data_manager_snowflake import row_key
+from grid_manager import query_grid_page
+
+
+def make_view():
+    """Five rows with the row labels they have in the shared dataset."""
+    view_df = pd.DataFrame({
+        'USER_ID': ['1', '2', '3', '4', '5'],
+        'YEAR': [2024] * 5,
+        'EVALUATION': [1] * 5,
+        'FULL_NAME': ['Adam', 'Bara', 'Cyril', 'Dana', 'Emil'],
+        'HODNOTY': [1, 2, 3, 4, 5],
+    }, index=[10, 11, 12, 13, 14])
+    key_positions = {row_key(user_id, 2024, 1): label for user_id, label in zip(view_df['USER_ID'], view_df.index)}
+    return view_df, key_positions
+
+
+def page_values(page_df):
+    return dict(zip(page_df['USER_ID'], page_df['HODNOTY']))
+
+
+def test_pending_edit_stays_visible_after_paging_away_and_back(monkeypatch):
+    monkeypatch.setattr(grid_manager, 'PAGE_SIZE', 2)
+    view_df, key_positions = make_view()
+    change_buffer = ChangeBuffer()
+    change_buffer.record(row_key('1', 2024, 1), 'HODNOTY', 1, 3)
+
+    _, first_page, page_count = query_grid_page(view_df, change_buffer, key_positions, {}, [], 0)
+    assert page_count == 3
+    assert page_values(first_page)['1'] == 3
+
+    _, second_page, _ = query_grid_page(view_df, change_buffer, key_positions, {}, [], 1)
+    assert '1' not in page_values(second_page)
+
+    server_df, first_page, _ = query_grid_page(view_df, change_buffer, key_positions, {}, [], 0)
+    assert page_values(first_page)['1'] == 3
+    assert server_df.loc[10, 'HODNOTY'] == 3
+    # The shared frame is not modified
+    assert view_df.loc[10, 'HODNOTY'] == 1
+
+
+def test_sort_and_filter_use_pending_edits(monkeypatch):
+    monkeypatch.setattr(grid_manager, 'PAGE_SIZE', 2)
+    view_df, key_positions = make_view()
+    change_buffer = ChangeBuffer()
+    change_buffer.record(row_key('1', 2024, 1), 'HODNOTY', 1, 9)
+
+    _, first_page, _ = query_grid_page(view_df, change_buffer, key_positions, {}, [{'colId': 'HODNOTY', 'sort': 'desc'}], 0)
+    assert list(first_page['USER_ID']) == ['1', '5']
+
+    filter_model = {'HODNOTY': {'filterType': 'number', 'type': 'greaterThan', 'filter': 5}}
+    server_df, _, _ = query_grid_page(view_df, change_buffer, key_positions, filter_model, [], 0)
+    assert list(server_df['USER_ID']) == ['1']
@@ -0,0 +1,72 @@
+from collections import defaultdict, deque
+
+import numpy as np
+import pandas as pd
+
+from data_manager import HierarchyIndex
+
+
+def random_hierarchy(seed, people=60, years=3):
+    """Rows of every person in every year with a manager picked among people above them, plus a few odd rows."""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for year in range(years):
+        for person in range(1, people):
+            manager = rng.integers(0, person)
+            rows.append((f'p{person}@firma.cz', f'p{manager}@firma.cz', 2022 + year))
+        rows.append(('p0@firma.cz', None, 2022 + year))
+    # A reporting cycle, a row that is no employee and a manager who is no employee
+    rows += [('p1@firma.cz', f'p{people - 1}@firma.cz', 2025), ('0', 'p2@firma.cz', 2025),
+             (f'p{people}@firma.cz', 'externi@firma.cz', 2025)]
+    rng.shuffle(rows)
+    return pd.DataFrame(rows, columns=['EMAIL_ADDRESS', 'DIRECT_MANAGER_EMAIL', 'YEAR'])
+
+
+def naive_reports(df, manager_email):
+    """Rows of all reports found by a BFS over a dict of manager -> employees."""
+    employees = df[df['EMAIL_ADDRESS'] != '0']
+    manager_to_reports = defaultdict(list)
+    for manager, employee in zip(employees['DIRECT_MANAGER_EMAIL'], employees['EMAIL_ADDRESS']):
+        manager_to_reports[manager].append(employee)
+    reports = set()
+    queue = deque([manager_email])
+    while queue:
+        current = queue.popleft()
+        if current in reports:
+            continue
+        reports.add(current)
+        queue.extend(manager_to_reports.get(current, []))
+    reports.discard(manager_email)
+    return np.flatnonzero((df['EMAIL_ADDRESS'] != '0') & df['EMAIL_ADDRESS'].isin(reports))
+
+
+def test_all_reports_matches_naive_bfs():
+    for seed in range(3):
+        df = random_hierarchy(seed)
+        index = HierarchyIndex(df)
+        for manager in ['p0@firma.cz', 'p1@firma.cz', 'p5@firma.cz', 'p59@firma.cz', 'externi@firma.cz']:
+            np.testing.assert_array_equal(index.all_reports(manager), naive_reports(df, manager))
+            # Memoized result is the same
+            np.testing.assert_array_equal(index.all_reports(manager), naive_reports(df, manager))
+
+
+def test_all_reports_normalizes_email_and_handles_unknown_managers():
+    df = random_hierarchy(0)
+    index = HierarchyIndex(df)
+
+    np.testing.assert_array_equal(index.all_reports(' P3@Firma.cz '), naive_reports(df, 'p3@firma.cz'))
+    assert index.all_reports('nikdo@firma.cz').size == 0
+    assert index.all_reports('').size == 0
+
+
+def test_direct_reports_and_depth():
+    df = pd.DataFrame({
+        'EMAIL_ADDRESS': ['a@firma.cz', 'b@firma.cz', 'c@firma.cz', 'c@firma.cz', 'd@firma.cz'],
+        'DIRECT_MANAGER_EMAIL': [None, 'a@firma.cz', 'b@firma.cz', 'a@firma.cz', 'c@firma.cz'],
+    })
+    index = HierarchyIndex(df)
+
+    assert index.direct_reports('a@firma.cz').tolist() == [1, 2, 3]
+    assert index.all_reports('b@firma.cz').tolist() == [2, 3, 4]
+    assert [index.depth_of(email) for email in ['a@firma.cz', 'b@firma.cz', 'c@firma.cz', 'd@firma.cz']] == [0, 1, 1, 2]
+    assert index.depth_of('nikdo@firma.cz') is None
@@ -0,0 +1,101 @@
+import pandas as pd
+
+from data_manager_local import LocalBackend
+from data_manager_snowflake import changed_mask, load_expected_schema, prepare_changed_rows, row_key
+
+SEED = """USER_ID,YEAR,EVALUATION,FULL_NAME,EMAIL_ADDRESS,DIRECT_MANAGER_EMAIL,HODNOTY,VYKON,POTENCIAL,IS_LOCKED,LOCKED_TIMESTAMP,HIST_DATA_MODIFIED_WHEN
+1,2024,1,Jana Nováková,jana@x.cz,boss@x.cz,3,4,nízký,0,,2024-01-01 10:00:00
+2,2024,1,Petr Svoboda,petr@x.cz,boss@x.cz,2,2,střední,0,,2024-01-01 10:00:00
+3,2024,1,Eva Malá,eva@x.cz,boss@x.cz,5,5,vysoký,1,2024-01-02 08:00:00,2024-01-02 08:00:00
+"""
+
+STAMP = '2024-06-01 12:00:00.000001'
+
+
+def make_backend(tmp_path):
+    seed_path = tmp_path / 'seed.csv'
+    seed_path.write_text(SEED, encoding='utf-8')
+    return LocalBackend(str(tmp_path / 'db' / 'local.sqlite'), str(seed_path), 'SOURCE', 'FILTERS', load_expected_schema())
+
+
+def stored(backend, columns):
+    df = backend.load_rows('SOURCE', ['USER_ID'] + columns)
+    return df.set_index('USER_ID')[columns]
+
+
+def changed_rows(rows):
+    """Rows as the write coordinator merges them, stamped with STAMP."""
+    rows = prepare_changed_rows(pd.DataFrame(rows), 'manager@x.cz')
+    rows['HIST_DATA_MODIFIED_WHEN'] = STAMP
+    return rows
+
+
+def test_merge_writes_only_changed_cells(tmp_path):
+    backend = make_backend(tmp_path)
+    rows = changed_rows([
+        {'USER_ID': '1', 'YEAR': 2024, 'EVALUATION': 1, 'HODNOTY': 5, 'VYKON': None,
+         'CHANGED_MASK': changed_mask(['HODNOTY'])},
+        # Cleared rating is written as NULL
+        {'USER_ID': '2', 'YEAR': 2024, 'EVALUATION': 1, 'HODNOTY': None, 'VYKON': None,
+         'CHANGED_MASK': changed_mask(['VYKON'])},
+    ])
+
+    assert backend.merge_rows('SOURCE', rows, backend.column_types) == 2
+    result = stored(backend, ['HODNOTY', 'VYKON', 'HIST_DATA_MODIFIED_BY', 'HIST_DATA_MODIFIED_WHEN'])
+    assert result.loc['1', 'HODNOTY'] == 5 and result.loc['1', 'VYKON'] == 4
+    assert result.loc['2', 'HODNOTY'] == 2 and pd.isna(result.loc['2', 'VYKON'])
+    assert result.loc['1', 'HIST_DATA_MODIFIED_BY'] == 'manager@x.cz'
+    assert result.loc['1', 'HIST_DATA_MODIFIED_WHEN'] == pd.Timestamp(STAMP)
+    assert backend.find_conflicts('SOURCE', rows, STAMP) == []
+
+
+def test_merge_skips_rows_changed_since_they_were_read(tmp_path):
+    backend = make_backend(tmp_path)
+    rows = changed_rows([
+        {'USER_ID': '1', 'YEAR': 2024, 'EVALUATION': 1, 'HODNOTY': 1, 'CHECK_VERSION': True,
+         'EXPECTED_MODIFIED_WHEN': pd.Timestamp('2024-01-01 10:00:00'), 'CHANGED_MASK': changed_mask(['HODNOTY'])},
+        {'USER_ID': '2', 'YEAR': 2024, 'EVALUATION': 1, 'HODNOTY': 1, 'CHECK_VERSION': True,
+         'EXPECTED_MODIFIED_WHEN': pd.Timestamp('2023-12-31 09:00:00'), 'CHANGED_MASK': changed_mask(['HODNOTY'])},
+    ])
+
+    assert backend.merge_rows('SOURCE', rows, backend.column_types) == 1
+    assert backend.find_conflicts('SOURCE', rows, STAMP) == [row_key('2', 2024, 1)]
+    assert stored(backend, ['HODNOTY'])['HODNOTY'].to_dict() == {'1': 1, '2': 2, '3': 5}
+
+
+def test_merge_of_a_lock_stamps_the_lock_time_once(tmp_path):
+    backend = make_backend(tmp_path)
+    rows = changed_rows([
+        {'USER_ID': user_id, 'YEAR': 2024, 'EVALUATION': 1, 'IS_LOCKED': 1, 'CHANGED_MASK': changed_mask(['IS_LOCKED'])}
+        for user_id in ['1', '3']
+    ])
+
+    backend.merge_rows('SOURCE', rows, backend.column_types)
+    locked = stored(backend, ['IS_LOCKED', 'LOCKED_TIMESTAMP'])
+    assert locked.loc['1', 'IS_LOCKED'] == 1
+    assert locked.loc['1', 'LOCKED_TIMESTAMP'] == pd.Timestamp(STAMP)
+    assert locked.loc['3', 'LOCKED_TIMESTAMP'] == pd.Timestamp('2024-01-02 08:00:00')
+
+
+def test_lock_rows_locks_only_unlocked_rows(tmp_path):
+    backend = make_backend(tmp_path)
+    keys = pd.DataFrame({'USER_ID': ['1', '3', '9'], 'YEAR': [2024, 2024, 2024], 'EVALUATION': [1, 1, 1]})
+
+    assert backend.lock_rows('SOURCE', keys, 'manager@x.cz', STAMP) == 1
+    locked = stored(backend, ['IS_LOCKED', 'LOCKED_TIMESTAMP', 'HIST_DATA_MODIFIED_BY'])
+    assert locked['IS_LOCKED'].to_dict() == {'1': 1, '2': 0, '3': 1}
+    assert locked.loc['1', 'LOCKED_TIMESTAMP'] == pd.Timestamp(STAMP)
+    assert locked.loc['1', 'HIST_DATA_MODIFIED_BY'] == 'manager@x.cz'
+    assert locked.loc['3', 'LOCKED_TIMESTAMP'] == pd.Timestamp('2024-01-02 08:00:00')
+    # Lock is kept when the backend is opened again, the seed is loaded only once
+    assert make_backend(tmp_path).lock_rows('SOURCE', keys, 'manager@x.cz', STAMP) == 0
+
+
+def test_load_rows_reads_the_scope_and_rows_modified_since(tmp_path):
+    backend = make_backend(tmp_path)
+    backend.lock_rows('SOURCE', pd.DataFrame({'USER_ID': ['2'], 'YEAR': [2024], 'EVALUATION': [1]}), 'manager@x.cz', STAMP)
+
+    assert sorted(backend.load_rows('SOURCE', ['USER_ID'], scope='boss@x.cz')['USER_ID']) == ['1', '2', '3']
+    assert backend.load_rows('SOURCE', ['USER_ID'], scope='jana@x.cz').empty
+    since = pd.Timestamp('2024-01-02 00:00:00')
+    assert sorted(backend.load_rows('SOURCE', ['USER_ID'], modified_since=since)['USER_ID']) == ['2', '3']
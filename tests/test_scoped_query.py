@@ -0,0 +1,30 @@
+import sqlite3
+
+import pandas as pd
+
+from data_manager_snowflake import build_scoped_query
+
+
+def make_connection():
+    """Source table with a two-level hierarchy under boss@x.cz, over two years."""
+    connection = sqlite3.connect(':memory:')
+    pd.DataFrame({
+        'USER_ID': ['1', '2', '3', '4', '2', '5'],
+        'YEAR': [2024, 2024, 2024, 2024, 2023, 2024],
+        'EMAIL_ADDRESS': ['boss@x.cz', 'Lead@X.cz ', 'dev@x.cz', 'other@x.cz', 'lead@x.cz', 'intern@x.cz'],
+        'DIRECT_MANAGER_EMAIL': ['ceo@x.cz', 'boss@x.cz', 'lead@x.cz', 'ceo@x.cz', 'boss@x.cz', 'dev@x.cz'],
+    }).to_sql('SOURCE', connection, index=False)
+    return connection
+
+
+def test_scoped_query_reads_the_whole_subtree_of_the_manager():
+    query, params = build_scoped_query('SOURCE', ['USER_ID', 'YEAR'], manager_email=' Boss@x.cz')
+    rows = pd.read_sql_query(query, make_connection(), params=params)
+    # Direct and indirect reports in every year, without the manager and other teams
+    assert sorted(zip(rows['USER_ID'], rows['YEAR'])) == [('2', 2023), ('2', 2024), ('3', 2024), ('5', 2024)]
+
+
+def test_query_without_scope_reads_every_row():
+    query, params = build_scoped_query('SOURCE', ['USER_ID'])
+    assert params == []
+    assert len(pd.read_sql_query(query, make_connection(), params=params)) == 6
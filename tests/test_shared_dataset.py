@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+
+from data_manager_snowflake import SharedDataset, row_key
+
+
+def make_frame():
+    return pd.DataFrame({
+        'USER_ID': ['1', '2', '3', '4'],
+        'YEAR': [2024, 2024, 2024, 2024],
+        'EVALUATION': [1, 1, 1, 1],
+        'FULL_NAME': ['Adam', 'Bara', 'Cyril', 'Dana'],
+        'HODNOTY': [1.0, 2.0, 3.0, np.nan],
+        'VYKON': [5.0, 4.0, 3.0, 2.0],
+        'HIST_DATA_MODIFIED_WHEN': pd.to_datetime(['2024-01-01'] * 4),
+    })
+
+
+def published():
+    dataset = SharedDataset()
+    dataset.publish(make_frame())
+    return dataset
+
+
+def test_upsert_patches_changed_columns_and_appends_new_rows():
+    dataset = published()
+    old_df, old_version, old_positions = dataset.df, dataset.version, dataset.key_positions
+
+    delta = make_frame().iloc[[1, 3]].copy()
+    delta['HODNOTY'] = [4.0, np.nan]
+    delta['HIST_DATA_MODIFIED_WHEN'] = pd.Timestamp('2024-02-01')
+    new_row = pd.DataFrame({'USER_ID': ['5'], 'YEAR': [2024], 'EVALUATION': [1], 'FULL_NAME': ['Emil'],
+                            'HODNOTY': [5.0], 'VYKON': [1.0], 'HIST_DATA_MODIFIED_WHEN': [pd.Timestamp('2024-02-01')]})
+    dataset.upsert(pd.concat([delta, new_row], ignore_index=True))
+
+    assert dataset.version > old_version
+    assert dataset.df['HODNOTY'].iloc[1] == 4.0
+    assert np.isnan(dataset.df['HODNOTY'].iloc[3])
+    assert dataset.df['FULL_NAME'].iloc[4] == 'Emil'
+    assert dataset.key_positions[row_key('5', 2024, 1)] == 4
+    assert dataset.watermark == pd.Timestamp('2024-02-01')
+
+    # Readers still holding the old version see it unchanged
+    assert old_df['HODNOTY'].iloc[1] == 2.0
+    assert len(old_df) == 4
+    assert row_key('5', 2024, 1) not in old_positions
+
+
+def test_upsert_copies_only_columns_with_changed_values():
+    dataset = published()
+    old_df = dataset.df
+
+    delta = make_frame().iloc[[0]].copy()
+    delta['HODNOTY'] = 9.0
+    dataset.upsert(delta)
+
+    assert np.shares_memory(dataset.df['VYKON'].to_numpy(), old_df['VYKON'].to_numpy())
+    assert not np.shares_memory(dataset.df['HODNOTY'].to_numpy(), old_df['HODNOTY'].to_numpy())
+    assert old_df['HODNOTY'].iloc[0] == 1.0
+
+
+def test_upsert_without_changed_values_keeps_the_version():
+    dataset = published()
+    version, df = dataset.version, dataset.df
+
+    dataset.upsert(make_frame().iloc[[0, 3]])
+
+    assert dataset.version == version
+    assert dataset.df is df
+
+
+def test_changed_rows_by_column_and_version():
+    dataset = published()
+    first_version = dataset.version
+
+    delta = make_frame().iloc[[2]].copy()
+    delta['HODNOTY'] = 1.0
+    dataset.upsert(delta)
+    second_version = dataset.version
+
+    new_row = make_frame().iloc[[0]].copy()
+    new_row['USER_ID'] = '6'
+    dataset.upsert(new_row)
+
+    assert dataset.changed_rows(first_version, {'HODNOTY'}).tolist() == [2, 4]
+    # Only the appended row is new for a column no upsert changed
+    assert dataset.changed_rows(first_version, {'VYKON'}).tolist() == [4]
+    assert dataset.changed_rows(second_version, {'HODNOTY'}).tolist() == [4]
+    assert dataset.changed_rows(dataset.version, {'HODNOTY'}).tolist() == []
+    assert dataset.changed_rows(-1, {'HODNOTY'}) is None
+
+    dataset.publish(make_frame())
+    assert dataset.changed_rows(second_version, {'HODNOTY'}) is None
+
+
+def test_rows_not_read_from_the_table_leave_the_watermark():
+    dataset = published()
+    delta = make_frame().iloc[[0]].copy()
+    delta['HIST_DATA_MODIFIED_WHEN'] = pd.Timestamp('2025-01-01')
+    dataset.upsert(delta, advance_watermark=False)
+
+    assert dataset.watermark == pd.Timestamp('2024-01-01')
+    assert dataset.df['HIST_DATA_MODIFIED_WHEN'].iloc[0] == pd.Timestamp('2025-01-01')
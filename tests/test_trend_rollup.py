@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pandas.testing as tm
+
+from chart_manager import TrendRollup
+from data_manager_snowflake import SharedDataset
+
+
+def make_frame():
+    return pd.DataFrame({
+        'USER_ID': ['1', '2', '3', '1', '2', '3'],
+        'YEAR': [2023, 2023, 2023, 2024, 2024, 2024],
+        'EVALUATION': [1, 1, 1, 1, 1, 1],
+        'YEAR_EVALUATION': ['2023-1', '2023-1', '2023-1', '2024-1', '2024-1', '2024-1'],
+        'VYKON': [3.0, 4.0, np.nan, 5.0, 2.0, 1.0],
+        'HODNOTY': [2.0, 2.0, 3.0, np.nan, 4.0, 5.0],
+    })
+
+
+def published():
+    dataset = SharedDataset()
+    dataset.publish(make_frame())
+    return dataset
+
+
+def assert_matches_full_recompute(rollup, dataset, user_ids):
+    tm.assert_frame_equal(rollup.series(user_ids), TrendRollup(dataset).series(user_ids))
+
+
+def test_incremental_update_matches_full_recompute():
+    dataset = published()
+    rollup = TrendRollup(dataset)
+    rollup.series(['1', '2', '3'])
+    builds = []
+    original_build = rollup._build
+    rollup._build = lambda df: builds.append(len(df)) or original_build(df)
+
+    delta = make_frame().iloc[[0, 3, 5]].copy()
+    delta['VYKON'] = [1.0, 3.0, np.nan]
+    delta['HODNOTY'] = [5.0, 4.0, 1.0]
+    dataset.upsert(delta)
+    # A new row of a known person and round is appended to the frame
+    appended = make_frame().iloc[[4]].copy()
+    appended['EVALUATION'] = 2
+    appended['VYKON'] = 5.0
+    dataset.upsert(appended)
+
+    for user_ids in (['1', '2', '3'], ['1'], ['2', '3'], ['9']):
+        assert_matches_full_recompute(rollup, dataset, user_ids)
+    assert builds == []
+
+
+def test_new_round_rebuilds_and_matches_full_recompute():
+    dataset = published()
+    rollup = TrendRollup(dataset)
+    rollup.series(['1'])
+
+    new_round = make_frame().iloc[[3]].copy()
+    new_round['YEAR'] = 2025
+    new_round['YEAR_EVALUATION'] = '2025-1'
+    new_round['VYKON'] = 4.0
+    dataset.upsert(new_round)
+
+    assert_matches_full_recompute(rollup, dataset, ['1', '2', '3'])
+    assert rollup.series(['1'])['YEAR_EVALUATION'].tolist()[-2:] == ['2025-1', '2025-1']
+
+
+def test_series_keeps_only_the_last_rated_rounds():
+    dataset = published()
+    series = TrendRollup(dataset).series(['1', '2'], periods=1)
+
+    assert series['YEAR_EVALUATION'].unique().tolist() == ['2024-1']
+    assert series.set_index('Metric')['Value'].to_dict() == {'CO': 3.5, 'JAK': 4.0}
@@ -2,8 +2,9 @@ import streamlit as st
 import base64
 import os
 
+@st.cache_data
 def get_image_base64(image_path: str):
-    """Get base64 representation of an image.
+    """Get base64 representation of an image, read once per process.
     Args:
         image_path (str): Path to the image.
     Returns: